@@ -156,3 +156,78 @@ STATIC_URL = '/static/'
 LOGIN_REDIRECT_URL = '/'
 
 CURRENCIES = ('USD', 'EUR')
+
+## Cache for rate of return results: 'local' (in-process, least recently
+## used eviction) or 'django' (cache framework, see CACHES)
+
+RATE_CACHE_BACKEND = 'local'
+RATE_CACHE_SIZE = 4096
+RATE_CACHE_ALIAS = 'default'
+
+## Log messages of the returns app (e.g. rate cache hit rate, staleness of
+## prices and valuations) to the console
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'returns': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+## Worker processes for performance summaries (None, 0 or 1: serial) and
+## how they are started ('spawn'; 'fork' only with single-threaded servers,
+## see returns/performance.py)
+
+PERFORMANCE_WORKERS = None
+PERFORMANCE_START_METHOD = 'spawn'
+
+## Number of valuation records written per bulk query when rebuilding
+## security and account valuations
+
+VALUATION_BATCH_SIZE = 500
+
+## Store valuations per account and security when updating security
+## valuations and derive account valuations from these
+
+ACCOUNT_VALUATION_FROM_POSITIONS = False
+
+## Refresh valuations in background jobs run by manage.py
+## run_valuation_worker (False: refresh during the request); jobs running
+## longer than VALUATION_JOB_TIMEOUT seconds (e.g. worker died) are queued
+## again
+
+VALUATION_REFRESH_ASYNC = True
+VALUATION_JOB_TIMEOUT = 3600
+
+## Dates on which valuations are stored: 'daily', 'weekly', 'half-monthly'
+## or 'monthly'; with VALUATION_DENSE_DAYS set, valuations older than this
+## number of days are downsampled to VALUATION_COARSE_GRANULARITY
+
+VALUATION_GRANULARITY = 'half-monthly'
+VALUATION_COARSE_GRANULARITY = 'half-monthly'
+VALUATION_DENSE_DAYS = None
+
+## Alpha Vantage API quota (requests per minute) for fetching prices of
+## mark to market securities, retries per symbol with backoff (seconds,
+## doubled with each retry) and number of pooled HTTP connections
+
+ALPHA_VANTAGE_REQUESTS_PER_MINUTE = 5
+ALPHA_VANTAGE_RETRIES = 3
+ALPHA_VANTAGE_BACKOFF = 15.0
+ALPHA_VANTAGE_CONNECTIONS = 4
+
+## Number of mark to market securities whose prices are fetched per run,
+## those refreshed longest ago first (None: all)
+
+MARKET_DATA_REFRESH_LIMIT = None
+
+## Provider of daily prices (alphavantage, file, fake-http or dotted path to
+## a returns.marketData.PriceProvider subclass) and keyword arguments for it,
+## e.g. {'directory': '/path/to/prices'} for csv or npz files
+
+MARKET_DATA_PROVIDER = 'alphavantage'
+MARKET_DATA_PROVIDER_OPTIONS = {}
@@ -2,7 +2,7 @@ from django.contrib import admin
 from import_export.admin import ImportExportModelAdmin
 from import_export import resources
 
-from .models import Transaction, Account, Security, HistValuation, Inflation, SecurityValuation, AccountValuation
+from .models import Transaction, Account, Security, HistValuation, Inflation, SecurityValuation, AccountValuation, PositionValuation, ValuationJob, DirtyRange, Position, ValuationRefresh
 
 class TransactionResource(resources.ModelResource):
     class Meta:
@@ -72,4 +72,18 @@ class AccountValuationAdmin(ImportExportModelAdmin):
     resource_class = AccountValuationResource
     pass
 
-admin.site.register(AccountValuation, SecurityValuationAdmin)
\ No newline at end of file
+admin.site.register(AccountValuation, SecurityValuationAdmin)
+class PositionValuationResource(resources.ModelResource):
+    class Meta:
+        model = PositionValuation
+
+class PositionValuationAdmin(ImportExportModelAdmin):
+    resource_class = PositionValuationResource
+    pass
+
+admin.site.register(PositionValuation, PositionValuationAdmin)
+
+admin.site.register(ValuationJob)
+admin.site.register(DirtyRange)
+admin.site.register(Position)
+admin.site.register(ValuationRefresh)
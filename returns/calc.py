@@ -1,5 +1,7 @@
 from datetime import date
 
+import numpy as np
+
 def newtonSolve(f, df, x0, absTol=1E-4, relTol=1E-4, itMax=50, damping=0.70):
     lastX = x0
     nextX = lastX + 10.0 * absTol
@@ -52,6 +54,9 @@ class Solver():
         for d in self.cashflowList:
             s += str(d)  + ": " + str(self.cashflowList[d]) + "\n"
         return s
+
+    def numCashflows(self):
+        return len(self.cashflowList)
         
     def addCashflow(self,cashflow, date):
         if len(self.cashflowList) == 0:
@@ -61,14 +66,20 @@ class Solver():
             self.cashflowList[diffDate] = float(cashflow)
         else:
             self.cashflowList[diffDate] = self.cashflowList[diffDate] + float(cashflow)
-    def calcRateOfReturn(self):
+    def calcRateOfReturn(self, method='newton', guess=None):
+        # method 'newton' uses damped Newton from guess (default 0),
+        # 'hybrid' brackets the root around guess first (see hybridSolve);
+        # the number of function evaluations is kept in self.evaluations
         if not self.cashflowList:
             raise RuntimeError('Empty list')
-        r0 = 0.0
+        r0 = 0.0 if guess is None else guess / 100.0
         f = lambda r: self._solverF(r)
         df = lambda r: self._solverDF(r)
         try:
-            r = self._newtonSolve(f=f, df=df, x0=r0)
+            if method == 'hybrid':
+                r, self.evaluations = hybridSolve(lambda r: (f(r), df(r)), x0=r0)
+            else:
+                r = self._newtonSolve(f=f, df=df, x0=r0)
         except StopIteration as e:
             print(e)
             raise RuntimeError('Iteration limit exceeded')
@@ -101,4 +112,347 @@ class Solver():
                 nextX = lastX + absTol
             if (nextX > 10.0 or nextX < -1.0):
                 raise StopIteration('Diverging')
+        self.evaluations = it
+        return nextX
+
+
+class ArraySolver(Solver):
+    # array-backed solver: day offsets and cashflows are kept in contiguous
+    # float64 arrays so that f and f' are evaluated together in one
+    # vectorized pass, sharing the discount factor exp(-t*log1p(r))
+
+    def __init__(self):
+        self._cashflows = None
+        self._days = None
+        self._years = None
+        self._amounts = None
+        Solver.__init__(self)
+
+    @classmethod
+    def fromArrays(cls, days, amounts):
+        # construct solver from day offsets (relative to first cashflow) and
+        # amounts, cashflows on the same day are summed
+        solver = cls()
+        days, inverse = np.unique(np.asarray(days, dtype=np.float64).astype(np.int64), return_inverse=True)
+        solver._amounts = np.bincount(inverse.ravel(), weights=np.asarray(amounts, dtype=np.float64).ravel(),
+                                      minlength=len(days))
+        solver._days = days.astype(np.float64)
+        solver._years = solver._days / 365.0
+        solver._cashflows = None
+        return solver
+
+    @property
+    def cashflowList(self):
+        # cashflows by day offset as in Solver, only built from the arrays
+        # when needed
+        if self._cashflows is None:
+            self._cashflows = dict(zip(self._days.astype(np.int64).tolist(), self._amounts.tolist()))
+        return self._cashflows
+
+    @cashflowList.setter
+    def cashflowList(self, cashflows):
+        self._cashflows = cashflows
+        self._days = None
+
+    def numCashflows(self):
+        if self._cashflows is None:
+            return len(self._days)
+        return len(self._cashflows)
+
+    def addCashflow(self, cashflow, date):
+        Solver.addCashflow(self, cashflow, date)
+        self._days = None
+
+    def cashflowArrays(self):
+        # return day offsets and amounts as float64 arrays
+        if self._days is None:
+            self._days = np.fromiter(self.cashflowList.keys(), dtype=np.float64,
+                                     count=len(self.cashflowList))
+            self._amounts = np.fromiter(self.cashflowList.values(), dtype=np.float64,
+                                        count=len(self.cashflowList))
+            self._years = self._days / 365.0
+        return self._days, self._amounts
+
+    def calcRateOfReturn(self, method='newton', guess=None):
+        if not self.numCashflows():
+            raise RuntimeError('Empty list')
+        r0 = 0.0 if guess is None else guess / 100.0
+        try:
+            if method == 'hybrid':
+                r, self.evaluations = hybridSolve(self._solverFDF, x0=r0)
+            else:
+                r = self._newtonSolveFDF(fdf=self._solverFDF, x0=r0)
+        except StopIteration as e:
+            print(e)
+            raise RuntimeError('Iteration limit exceeded')
+
+        return float(r)*100.0
+
+    def calcModifiedDietz(self, wellConditioned=False):
+        # annualized Modified Dietz estimate (in %), no iteration required;
+        # if wellConditioned, only accept the estimate where it is known to
+        # agree closely with the internal rate of return
+        if not self.numCashflows():
+            raise RuntimeError('Empty list')
+        days, amounts = self.cashflowArrays()
+        if wellConditioned:
+            r = modifiedDietz(days, amounts, maxDays=DIETZ_MAX_DAYS,
+                              minCapitalFraction=DIETZ_MIN_CAPITAL_FRACTION,
+                              maxReturn=DIETZ_MAX_RETURN)
+        else:
+            r = modifiedDietz(days, amounts)
+        if r is None:
+            raise RuntimeError('Modified Dietz estimate not applicable')
+        self.evaluations = 0
+        return r*100.0
+
+    # private functions
+    def _solverF(self, rate):
+        return self._solverFDF(rate)[0]
+
+    def _solverDF(self, rate):
+        return self._solverFDF(rate)[1]
+
+    def _solverFDF(self, rate):
+        self.cashflowArrays()
+        return npvAndDerivative(rate, self._years, self._amounts)
+
+    def _newtonSolveFDF(self, fdf, x0, absTol=1E-4, relTol=1E-4, itMax=50, damping=0.70):
+        # same iteration as _newtonSolve, but f and f' come from one call
+        lastX = x0
+        nextX = lastX + 10.0 * absTol
+        it = 0
+        while (abs(lastX - nextX) > absTol or abs(lastX - nextX) > relTol*abs(lastX)):
+            it = it + 1
+            if it > itMax:
+                raise StopIteration('Exceed iteration count')
+            newY, newDY = fdf(nextX)
+            lastX = nextX
+
+            if newDY == 0.0 or not np.isfinite(newDY):
+                nextX = lastX + absTol
+            else:
+                nextX = lastX - damping * newY / newDY
+            if (nextX > 10.0 or nextX < -1.0):
+                raise StopIteration('Diverging')
+        self.evaluations = it
         return nextX
+
+def npvAndDerivative(rate, years, amounts):
+    # net present value and its derivative w.r.t. rate for cashflows at
+    # times years (in units of 365 days); both share the discount factor
+    logGrowth = np.log1p(rate)
+    discount = np.exp(-years * logGrowth)
+    weighted = amounts * discount
+    f = float(weighted.sum())
+    df = -float(np.dot(years, weighted)) / (1.0 + rate)
+    return f, df
+
+# limits within which the Modified Dietz estimate is used instead of the
+# internal rate of return: period length (days), time-weighted capital as
+# fraction of gross contributions, and return over the period
+DIETZ_MAX_DAYS = 366
+DIETZ_MIN_CAPITAL_FRACTION = 0.5
+DIETZ_MAX_RETURN = 0.1
+
+def modifiedDietz(days, amounts, maxDays=None, minCapitalFraction=0.0, maxReturn=None):
+    # annualized Modified Dietz rate of return for cashflows in the sign
+    # convention of Solver (contributions > 0); cashflows at the last date
+    # make up the final value; returns None if the estimate is not applicable
+    days = np.asarray(days, dtype=np.float64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    if len(days) == 0:
+        return None
+    period = days.max() - days.min()
+    if period <= 0.0 or (maxDays is not None and period > maxDays):
+        return None
+
+    contributions = days < days.max()
+    weights = (days.max() - days[contributions]) / period
+    capital = np.dot(weights, amounts[contributions])
+    gross = np.abs(amounts[contributions]).sum()
+    if capital <= 0.0 or capital < minCapitalFraction * gross:
+        return None
+
+    periodReturn = -amounts.sum() / capital
+    if periodReturn <= -1.0 or (maxReturn is not None and abs(periodReturn) > maxReturn):
+        return None
+    return float((1.0 + periodReturn) ** (365.0 / period) - 1.0)
+
+def hybridSolve(fdf, x0=0.0, lower=-0.999, upper=10.0, absTol=1E-6, itMax=50, step=0.02):
+    # find root of f given fdf(x) = (f(x), f'(x)): first bracket a sign
+    # change of f by stepping outwards from the (warm start) guess x0 with
+    # doubling step size, then iterate Newton steps safeguarded by bisection
+    # so that the iterate never leaves the bracket;
+    # returns root and number of function evaluations
+    x0 = min(max(x0, lower), upper)
+    f0, df0 = fdf(x0)
+    evaluations = 1
+    if f0 == 0.0:
+        return x0, evaluations
+
+    # bracket root, a <= b
+    a, fa, dfa = x0, f0, df0
+    b, fb, dfb = x0, f0, df0
+    bracketed = False
+    while not bracketed:
+        if a <= lower and b >= upper:
+            raise StopIteration('No sign change')
+        if b < upper:
+            x = min(b + step, upper)
+            fx, dfx = fdf(x)
+            evaluations = evaluations + 1
+            if fx * fb <= 0.0:
+                a, fa, dfa = b, fb, dfb
+                bracketed = True
+            b, fb, dfb = x, fx, dfx
+        if not bracketed and a > lower:
+            x = max(a - step, lower)
+            fx, dfx = fdf(x)
+            evaluations = evaluations + 1
+            if fx * fa <= 0.0:
+                b, fb, dfb = a, fa, dfa
+                bracketed = True
+            a, fa, dfa = x, fx, dfx
+        step = 2.0 * step
+
+    # orient bracket such that f(xLow) < 0 < f(xHigh)
+    if fa < 0.0:
+        xLow, xHigh = a, b
+    else:
+        xLow, xHigh = b, a
+
+    # start from the end of the bracket with the smaller residual
+    if abs(fa) < abs(fb):
+        x, f, df = a, fa, dfa
+    else:
+        x, f, df = b, fb, dfb
+    if f == 0.0:
+        return x, evaluations
+
+    dxOld = abs(b - a)
+    dx = dxOld
+    for it in range(itMax):
+        newtonOutside = ((x - xHigh) * df - f) * ((x - xLow) * df - f) > 0.0
+        if df == 0.0 or not np.isfinite(df) or newtonOutside or abs(2.0 * f) > abs(dxOld * df):
+            # bisect if Newton step leaves bracket or does not converge fast enough
+            dxOld = dx
+            dx = 0.5 * (xHigh - xLow)
+            x = xLow + dx
+        else:
+            dxOld = dx
+            dx = f / df
+            x = x - dx
+        if abs(dx) < absTol:
+            return x, evaluations
+        f, df = fdf(x)
+        evaluations = evaluations + 1
+        if f == 0.0:
+            return x, evaluations
+        if f < 0.0:
+            xLow = x
+        else:
+            xHigh = x
+
+    raise StopIteration('Exceed iteration count')
+
+def packSeries(seriesList):
+    # pack a list of (days, amounts) cashflow series into a ragged array:
+    # series i is stored in days[offsets[i]:offsets[i+1]]
+    lengths = [len(days) for days, amounts in seriesList]
+    offsets = np.zeros(len(seriesList)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    if seriesList:
+        days = np.concatenate([np.asarray(d, dtype=np.float64) for d, a in seriesList])
+        amounts = np.concatenate([np.asarray(a, dtype=np.float64) for d, a in seriesList])
+    else:
+        days = np.zeros(0, dtype=np.float64)
+        amounts = np.zeros(0, dtype=np.float64)
+    return offsets, days, amounts
+
+def solveBatch(offsets, days, amounts, x0=0.0, absTol=1E-4, relTol=1E-4, itMax=50, damping=0.70,
+               returnIterations=False):
+    # solve for the rates of return (in %) of many cashflow series at once
+    # using the damped Newton iteration of Solver, with a convergence mask
+    # per series; series that are empty or fail to converge give nan
+    # x0 is either a scalar or one start value (as rate, not in %) per series
+    offsets = np.asarray(offsets, dtype=np.int64)
+    years = np.asarray(days, dtype=np.float64) / 365.0
+    amounts = np.asarray(amounts, dtype=np.float64)
+    numSeries = len(offsets) - 1
+    lengths = np.diff(offsets)
+    seriesIndex = np.repeat(np.arange(numSeries), lengths)
+
+    lastX = np.zeros(numSeries) + x0
+    nextX = lastX + 10.0 * absTol
+    active = lengths > 0
+    failed = ~active
+    iterations = np.zeros(numSeries, dtype=np.int64)
+
+    it = 0
+    while active.any():
+        it = it + 1
+        if it > itMax:
+            failed[active] = True
+            break
+
+        iterations[active] = it
+
+        # evaluate f and f' only for elements of series still iterating
+        elements = np.flatnonzero(active[seriesIndex])
+        elementSeries = seriesIndex[elements]
+        elementYears = years[elements]
+        rate = nextX[elementSeries]
+        with np.errstate(all='ignore'):
+            weighted = amounts[elements] * np.exp(-elementYears * np.log1p(rate))
+            newY = np.bincount(elementSeries, weights=weighted, minlength=numSeries)
+            newDY = -np.bincount(elementSeries, weights=elementYears * weighted,
+                                 minlength=numSeries) / (1.0 + nextX)
+
+            lastX = np.where(active, nextX, lastX)
+            singular = (newDY == 0.0) | ~np.isfinite(newDY)
+            step = np.where(singular, -absTol, damping * newY / np.where(singular, 1.0, newDY))
+            nextX = np.where(active, lastX - step, nextX)
+
+        diverging = active & ((nextX > 10.0) | (nextX < -1.0) | ~np.isfinite(nextX))
+        failed |= diverging
+        active &= ~diverging
+
+        diff = np.abs(lastX - nextX)
+        converged = (diff <= absTol) & (diff <= relTol * np.abs(lastX))
+        active &= ~converged
+
+    rates = nextX * 100.0
+    rates[failed] = np.nan
+    if returnIterations:
+        return rates, iterations
+    return rates
+
+def solveMultiple(solvers, guesses=None):
+    # solve several ArraySolver objects in one batch; series for which the
+    # batched Newton iteration fails are solved again with the bracketed
+    # hybrid solver; guesses are optional warm starts (in %) per solver;
+    # returns a list of rates (in %), None where no rate could be found
+    offsets, days, amounts = packSeries([s.cashflowArrays() for s in solvers])
+    if guesses is None:
+        x0 = 0.0
+    else:
+        x0 = np.array([0.0 if g is None else g / 100.0 for g in guesses])
+    rates, iterations = solveBatch(offsets, days, amounts, x0=x0, returnIterations=True)
+
+    result = []
+    for i, s in enumerate(solvers):
+        s.evaluations = int(iterations[i])
+        if not np.isnan(rates[i]):
+            result.append(float(rates[i]))
+        elif not s.numCashflows():
+            result.append(None)
+        else:
+            batchEvaluations = s.evaluations
+            try:
+                result.append(s.calcRateOfReturn(method='hybrid',
+                                                  guess=None if guesses is None else guesses[i]))
+                s.evaluations = batchEvaluations + s.evaluations
+            except RuntimeError:
+                result.append(None)
+    return result
@@ -0,0 +1,71 @@
+# Refresh of valuations outside of the web request: views enqueue jobs, the
+# run_valuation_worker command runs them (or they run right away if
+# VALUATION_REFRESH_ASYNC is off)
+
+from sys import stderr
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ValuationJob, ValuationRefresh, AccountValuation
+from .processTransaction2 import updateSecurityValuation, updateAccountValuation, propagateTransactionChange
+
+def requestRefresh(kind, owner = None, security = None, account = None, fullRebuild = False):
+    # queue refresh job, jobs for the same owner and security (or account)
+    # waiting to be run are combined
+    job = ValuationJob.objects.enqueue(kind, owner, security, account, fullRebuild)
+    if not getattr(settings, 'VALUATION_REFRESH_ASYNC', True) and ValuationJob.objects.claim(job):
+        runJob(job)
+    return job
+
+def transactionChanged(old = None, new = None):
+    # apply single added (old None), edited or deleted (new None) transaction
+    # to stored valuations right away if possible, queue refresh otherwise;
+    # valuations before the date of an edited transaction may be stale too,
+    # so these are rebuilt completely
+    if propagateTransactionChange(old, new):
+        return True
+    fullRebuild = old is not None
+    for t in set((t.owner, t.security, t.account) for t in [old, new] if t is not None):
+        owner, security, account = t
+        requestRefresh(ValuationJob.SECURITY, owner=owner, security=security, fullRebuild=fullRebuild)
+        requestRefresh(ValuationJob.ACCOUNT, owner=owner, account=account, fullRebuild=fullRebuild)
+    return False
+
+def runJob(job):
+    # job has to be claimed (marked as running) before
+    try:
+        with transaction.atomic():
+            if job.kind == ValuationJob.SECURITY:
+                if job.owner_id is None:
+                    raise RuntimeError('Security valuation job without owner')
+                updateSecurityValuation(job.owner_id, job.security_id, fullRebuild=job.fullRebuild)
+            else:
+                if job.fullRebuild and job.account_id is not None:
+                    AccountValuation.objects.filter(account_id=job.account_id).delete()
+                updateAccountValuation(job.account_id)
+        job.status = ValuationJob.DONE
+    except Exception as e:
+        print("Error running valuation job", job.id, file=stderr)
+        traceback.print_exc(file=stderr)
+        job.status = ValuationJob.FAILED
+        job.error = str(e)
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished'])
+    if job.status == ValuationJob.DONE:
+        ValuationRefresh.objects.refreshed(job)
+    return job
+
+def jobStatus(job):
+    return {'id': job.id,
+            'kind': job.kind,
+            'status': job.get_status_display(),
+            'security': job.security_id,
+            'account': job.account_id,
+            'created': job.created.isoformat(),
+            'started': job.started.isoformat() if job.started else None,
+            'finished': job.finished.isoformat() if job.finished else None,
+            'error': job.error,
+            }
@@ -0,0 +1,37 @@
+# Fetch and store daily prices of mark to market securities, e.g. from local
+# files or a simulated server to benchmark the ingestion offline
+
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from returns.marketData import PROVIDERS, getPriceProvider
+from returns.models import Security
+
+class Command(BaseCommand):
+    help = 'Fetch and store prices of mark to market securities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider',
+                            help='provider (%s or dotted path, default: as configured)' % ', '.join(PROVIDERS))
+        parser.add_argument('--directory',
+                            help='directory of price files for the file and fake-http providers')
+        parser.add_argument('--latency', type=float, default=None,
+                            help='seconds per simulated request of the fake-http provider')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='number of securities refreshed longest ago to fetch (default: setting)')
+        parser.add_argument('--latest-only', action='store_true',
+                            help='store only the latest price of each security')
+
+    def handle(self, *args, **options):
+        providerOptions = {}
+        if options['directory'] is not None:
+            providerOptions['directory'] = options['directory']
+        if options['latency'] is not None:
+            providerOptions['latency'] = options['latency']
+        provider = getPriceProvider(options['provider'], **providerOptions)
+
+        start = perf_counter()
+        securities = Security.objects.saveMarkToMarketValues(options['latest_only'], provider, options['limit'])
+        self.stdout.write("Fetched prices of %d securities with %s in %.1f s" %
+                          (len(securities), type(provider).__name__, perf_counter() - start))
@@ -0,0 +1,50 @@
+# Bulk load historical prices from csv or npz files (see
+# marketData.readPrices) named after the symbol of the securities, e.g.
+# ETF.csv for all securities with symbol ETF
+
+import os
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from returns.marketData import readPrices
+from returns.models import Security, HistValuation
+
+class Command(BaseCommand):
+    help = 'Load historical prices of securities from csv or npz files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+',
+                            help='price files named <symbol>.csv or <symbol>.npz')
+        parser.add_argument('--security', type=int, default=None,
+                            help='id of security to load a single file for, instead of by symbol')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='prices per insert statement (capped by the database)')
+
+    def handle(self, *args, **options):
+        if options['security'] is not None and len(options['files']) > 1:
+            raise CommandError('--security requires a single file')
+
+        start = perf_counter()
+        numRows = 0
+        for path in options['files']:
+            if options['security'] is not None:
+                securities = Security.objects.filter(id=options['security'])
+            else:
+                symbol = os.path.splitext(os.path.basename(path))[0]
+                securities = Security.objects.filter(symbol=symbol)
+            securities = list(securities.values_list('id', 'currency'))
+            if not securities:
+                self.stderr.write("No security for %s, skipped" % path)
+                continue
+
+            prices = readPrices(path)
+            with transaction.atomic():
+                for securityId, currency in securities:
+                    numRows = numRows + HistValuation.objects.upsert(securityId, prices, currency,
+                                                                     options['batch_size'])
+
+        elapsed = perf_counter() - start
+        self.stdout.write("Loaded %d prices in %.1f s (%.0f rows/s)" %
+                          (numRows, elapsed, numRows / elapsed if elapsed > 0 else 0.0))
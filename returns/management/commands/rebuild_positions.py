@@ -0,0 +1,21 @@
+# Rebuild the ledger of positions (current holdings per owner, account and
+# security) from all transactions, e.g. after importing transactions with
+# signals disabled or after changing how positions are derived
+
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from returns.processTransaction2 import rebuildPositions
+
+class Command(BaseCommand):
+    help = 'Rebuild the ledger of positions from transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owners', type=int, nargs='+',
+                            help='ids of owners to rebuild (default: all)')
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        count = rebuildPositions(options['owners'])
+        self.stdout.write("Rebuilt %d positions in %.1f s" % (count, perf_counter() - start))
@@ -0,0 +1,113 @@
+# Rebuild security (and afterwards account) valuations for all or selected
+# owners, partitioned by owner or by owner and range of securities; the
+# partitions run in worker processes, each with its own database connection
+# and transaction
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from returns.models import Transaction
+from returns.processTransaction2 import updateSecurityValuation, updateAccountValuation
+
+def partitions(ownerIds, securityChunks):
+    # list of (owner id, list of security ids or None for all securities)
+    result = []
+    for ownerId in ownerIds:
+        if securityChunks <= 1:
+            result.append((ownerId, None))
+            continue
+        securityIds = sorted(set(Transaction.objects.filter(owner_id=ownerId)
+                                 .values_list('security_id', flat=True)))
+        size = max(1, -(-len(securityIds) // securityChunks))
+        for i in range(0, len(securityIds), size):
+            result.append((ownerId, securityIds[i:i+size]))
+    return result
+
+def initWorker():
+    # set up Django in case worker is spawned rather than forked
+    django.setup()
+
+def rebuildPartition(ownerId, securityIds, fullRebuild):
+    # runs in worker process, returns time taken and number of rows written
+    start = perf_counter()
+    rows = 0
+    if securityIds is None:
+        stats = [updateSecurityValuation(ownerId, fullRebuild=fullRebuild)]
+    else:
+        stats = [updateSecurityValuation(ownerId, s, fullRebuild=fullRebuild) for s in securityIds]
+    for s in stats:
+        rows = rows + s['created'] + s['updated']
+    return perf_counter() - start, rows
+
+def describe(ownerId, securityIds):
+    if securityIds is None:
+        return "owner %d" % ownerId
+    return "owner %d, securities %d-%d" % (ownerId, securityIds[0], securityIds[-1])
+
+class Command(BaseCommand):
+    help = 'Rebuild security and account valuations in parallel per owner'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owners', type=int, nargs='+',
+                            help='ids of owners to rebuild (default: all)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='number of worker processes, 1 runs in this process (default: one per cpu)')
+        parser.add_argument('--security-chunks', type=int, default=1,
+                            help='split securities of each owner into this many partitions')
+        parser.add_argument('--full', action='store_true',
+                            help='replay all transactions instead of updating incrementally')
+        parser.add_argument('--skip-accounts', action='store_true',
+                            help='do not update account valuations afterwards')
+
+    def handle(self, *args, **options):
+        owners = User.objects.order_by('id')
+        if options['owners']:
+            owners = owners.filter(id__in=options['owners'])
+        work = partitions(list(owners.values_list('id', flat=True)), options['security_chunks'])
+
+        workers = options['workers']
+        if workers != 1 and connections['default'].vendor == 'sqlite':
+            self.stderr.write("SQLite does not support concurrent writes, running in this process")
+            workers = 1
+
+        start = perf_counter()
+        totalRows = 0
+        if workers == 1:
+            for i, (ownerId, securityIds) in enumerate(work):
+                elapsed, rows = rebuildPartition(ownerId, securityIds, options['full'])
+                totalRows = totalRows + rows
+                self.report(i + 1, len(work), ownerId, securityIds, elapsed, rows)
+        else:
+            # workers must not share the connection of this process
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=initWorker) as executor:
+                futures = {executor.submit(rebuildPartition, ownerId, securityIds, options['full']):
+                           (ownerId, securityIds) for ownerId, securityIds in work}
+                for i, future in enumerate(as_completed(futures)):
+                    ownerId, securityIds = futures[future]
+                    try:
+                        elapsed, rows = future.result()
+                    except Exception as e:
+                        self.stderr.write("[%d/%d] %s failed: %s" % (i + 1, len(work),
+                                                                    describe(ownerId, securityIds), e))
+                        continue
+                    totalRows = totalRows + rows
+                    self.report(i + 1, len(work), ownerId, securityIds, elapsed, rows)
+
+        if not options['skip_accounts']:
+            accountStart = perf_counter()
+            stats = updateAccountValuation()
+            self.stdout.write("Account valuations: %.2f s, %d rows" %
+                              (perf_counter() - accountStart, stats['created'] + stats['updated']))
+
+        self.stdout.write("Rebuilt %d partitions in %.2f s, %d security valuation rows" %
+                          (len(work), perf_counter() - start, totalRows))
+
+    def report(self, done, total, ownerId, securityIds, elapsed, rows):
+        self.stdout.write("[%d/%d] %s: %.2f s, %d rows" %
+                          (done, total, describe(ownerId, securityIds), elapsed, rows))
@@ -0,0 +1,46 @@
+# Worker processing valuation refresh jobs queued by the views; several
+# workers can run at the same time
+
+from time import perf_counter, sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from returns.jobs import runJob
+from returns.models import ValuationJob
+
+class Command(BaseCommand):
+    help = 'Run queued valuation refresh jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='exit when no job is queued')
+        parser.add_argument('--sleep', type=float, default=5.0,
+                            help='seconds to wait before checking for new jobs')
+        parser.add_argument('--max-jobs', type=int, default=None,
+                            help='exit after this many jobs')
+        parser.add_argument('--job-timeout', type=float, default=None,
+                            help='seconds after which running jobs are queued again (default: setting)')
+
+    def handle(self, *args, **options):
+        timeout = options['job_timeout']
+        if timeout is None:
+            timeout = getattr(settings, 'VALUATION_JOB_TIMEOUT', 3600)
+        numJobs = 0
+        while options['max_jobs'] is None or numJobs < options['max_jobs']:
+            requeued = ValuationJob.objects.requeueStale(timeout)
+            if requeued:
+                self.stdout.write("Queued %d timed out jobs again" % requeued)
+            job = ValuationJob.objects.claimNext()
+            if job is None:
+                if options['once']:
+                    break
+                sleep(options['sleep'])
+                continue
+
+            start = perf_counter()
+            job = runJob(job)
+            numJobs = numJobs + 1
+            self.stdout.write("Job %d (%s, owner %s, security %s, account %s): %s in %.2f s" %
+                              (job.id, job.get_kind_display(), job.owner_id, job.security_id,
+                               job.account_id, job.get_status_display(), perf_counter() - start))
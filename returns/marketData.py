@@ -0,0 +1,296 @@
+# Providers of daily closing prices for mark to market securities
+#
+# All providers implement fetch(symbols, since) for a batch of symbols, the
+# one used by the models is set with MARKET_DATA_PROVIDER:
+# - AlphaVantageProvider fetches from Alpha Vantage concurrently: all requests
+#   share one pooled HTTP session and are spaced by a token bucket sized to
+#   the API quota; failed symbols are retried with jittered backoff without
+#   holding up the others
+# - FileProvider reads local csv or npz files, e.g. for tests and benchmarks
+# - FakeHTTPProvider runs the Alpha Vantage code path against a simulated
+#   server answering from another provider, with latency and quota notes
+
+import asyncio
+import csv
+import json
+import os
+import random
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sys import stderr
+
+import aiohttp
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+API_URL = 'https://www.alphavantage.co/query'
+
+# the compact response only covers the last 100 trading days
+COMPACT_DAYS = 140
+
+class QuotaExceeded(Exception):
+    # API answered with a note instead of data, worth trying again later
+    pass
+
+class InvalidSymbol(Exception):
+    pass
+
+class PriceProvider():
+    # batch interface of all price providers
+
+    def fetch(self, symbols, since):
+        # dict of symbol to its daily closing prices (list of (date, price),
+        # most recent first, down to and including the first date not after
+        # since) or to the exception that prevented getting them; since is a
+        # date or a dict of symbol to date
+        raise NotImplementedError
+
+def sinceDates(symbols, since):
+    # dict of symbol to date up to which prices are needed
+    if isinstance(since, dict):
+        return {symbol: since[symbol] for symbol in symbols}
+    return {symbol: since for symbol in symbols}
+
+def pricesSince(prices, since):
+    # prices (most recent first) down to and including the first date not
+    # after since
+    for i, (d, price) in enumerate(prices):
+        if d <= since:
+            return prices[:i+1]
+    return prices
+
+class TokenBucket():
+    # allows rate requests per second on average, up to capacity at once
+
+    def __init__(self, rate, capacity = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+        self.lock = None
+
+    async def acquire(self):
+        # waiting requests are served one after another in order
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self.updated is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def parseDaily(text, upToDate):
+    # (date, closing price) from csv response, most recent first, down to and
+    # including the first date not after upToDate
+    if text.lstrip().startswith('{'):
+        message = json.loads(text)
+        if 'Error Message' in message:
+            raise InvalidSymbol(message['Error Message'])
+        raise QuotaExceeded(message.get('Note') or message.get('Information') or text)
+
+    rows = csv.reader(text.splitlines())
+    # skip header
+    next(rows)
+    prices = []
+    for row in rows:
+        if not row:
+            continue
+        date = datetime.strptime(row[0], "%Y-%m-%d").date()
+        prices.append((date, Decimal(row[4])))
+        if date <= upToDate:
+            break
+    return prices
+
+async def fetchDaily(session, bucket, symbol, upToDate, apiKey, retries, backoff):
+    outputsize = 'compact' if upToDate >= datetime.today().date() - timedelta(days=COMPACT_DAYS) else 'full'
+    params = {'function': 'TIME_SERIES_DAILY',
+              'symbol': symbol,
+              'outputsize': outputsize,
+              'datatype': 'csv',
+              'apikey': apiKey}
+    attempt = 0
+    while True:
+        await bucket.acquire()
+        try:
+            async with session.get(API_URL, params=params) as response:
+                response.raise_for_status()
+                text = await response.text()
+            return parseDaily(text, upToDate)
+        except (aiohttp.ClientError, asyncio.TimeoutError, QuotaExceeded) as e:
+            if attempt >= retries:
+                raise
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            print("Retrying", symbol, "in %.1f s:" % delay, e, file=stderr)
+            attempt = attempt + 1
+            await asyncio.sleep(delay)
+
+async def fetchAll(symbols, apiKey, requestsPerMinute, retries, backoff, connections, session = None):
+    # symbols: dict of symbol to date up to which prices are needed
+    bucket = TokenBucket(requestsPerMinute / 60.0)
+    if session is None:
+        connector = aiohttp.TCPConnector(limit=connections)
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=aiohttp.ClientTimeout(total=60)) as session:
+            return await fetchAll(symbols, apiKey, requestsPerMinute, retries, backoff, connections, session)
+
+    results = await asyncio.gather(*[fetchDaily(session, bucket, symbol, upToDate, apiKey, retries, backoff)
+                                     for symbol, upToDate in symbols.items()],
+                                   return_exceptions=True)
+    return dict(zip(symbols, results))
+
+class AlphaVantageProvider(PriceProvider):
+    # quota, retries and connections default to the ALPHA_VANTAGE settings;
+    # session is an aiohttp like session to use instead of a pooled one
+
+    def __init__(self, apiKey = None, session = None, requestsPerMinute = None,
+                 retries = None, backoff = None, connections = None):
+        if apiKey is None:
+            apiKey = settings.ALPHA_VANTAGE_KEY
+        if requestsPerMinute is None:
+            requestsPerMinute = getattr(settings, 'ALPHA_VANTAGE_REQUESTS_PER_MINUTE', 5)
+        if retries is None:
+            retries = getattr(settings, 'ALPHA_VANTAGE_RETRIES', 3)
+        if backoff is None:
+            backoff = getattr(settings, 'ALPHA_VANTAGE_BACKOFF', 15.0)
+        if connections is None:
+            connections = getattr(settings, 'ALPHA_VANTAGE_CONNECTIONS', 4)
+        self.apiKey = apiKey
+        self.session = session
+        self.requestsPerMinute = requestsPerMinute
+        self.retries = retries
+        self.backoff = backoff
+        self.connections = connections
+
+    def fetch(self, symbols, since):
+        return asyncio.run(fetchAll(sinceDates(symbols, since), self.apiKey, self.requestsPerMinute,
+                                    self.retries, self.backoff, self.connections, self.session))
+
+def fetchDailyPrices(symbols, apiKey = None, session = None):
+    # daily closing prices from Alpha Vantage per symbol or the exception
+    # that prevented getting them; symbols is a dict of symbol to date up to
+    # which prices are needed
+    return AlphaVantageProvider(apiKey, session).fetch(list(symbols), symbols)
+
+def readPrices(path):
+    # all prices in a npz (arrays date and close) or csv file (header row with
+    # date or timestamp and close columns, as in Alpha Vantage csv
+    # responses), most recent first
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            dates = data['date'].astype('datetime64[D]')
+            close = data['close']
+        order = np.argsort(dates)[::-1]
+        return [(d, Decimal(repr(c))) for d, c in zip(dates[order].tolist(), close[order].tolist())]
+
+    with open(path, newline='') as f:
+        rows = csv.reader(f)
+        header = [column.strip().lower() for column in next(rows)]
+        dateColumn = header.index('date') if 'date' in header else 0
+        closeColumn = header.index('close') if 'close' in header else 1
+        prices = [(date.fromisoformat(row[dateColumn]), Decimal(row[closeColumn]))
+                  for row in rows if row]
+    prices.sort(reverse=True)
+    return prices
+
+class FileProvider(PriceProvider):
+    # prices of each symbol from <symbol>.npz or <symbol>.csv in directory,
+    # see readPrices, rows in any order
+
+    def __init__(self, directory = None):
+        if directory is None:
+            directory = getattr(settings, 'MARKET_DATA_DIRECTORY', '.')
+        self.directory = directory
+
+    def load(self, symbol):
+        # all prices of symbol, most recent first
+        path = os.path.join(self.directory, symbol)
+        for extension in ('.npz', '.csv'):
+            if os.path.exists(path + extension):
+                return readPrices(path + extension)
+        raise InvalidSymbol('No price file for symbol %s in %s' % (symbol, self.directory))
+
+    def fetch(self, symbols, since):
+        prices = {}
+        for symbol, upToDate in sinceDates(symbols, since).items():
+            try:
+                prices[symbol] = pricesSince(self.load(symbol), upToDate)
+            except (InvalidSymbol, OSError, ValueError, KeyError) as e:
+                prices[symbol] = e
+        return prices
+
+class FakeResponse():
+    def __init__(self, text, latency):
+        self.text_ = text
+        self.latency = latency
+
+    async def __aenter__(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def text(self):
+        return self.text_
+
+class FakeSession():
+    # stands in for the aiohttp session, answers like Alpha Vantage with the
+    # prices of source after latency seconds; every quotaEvery-th request
+    # gets the quota note instead
+    def __init__(self, source, latency = 0.0, quotaEvery = None):
+        self.source = source
+        self.latency = latency
+        self.quotaEvery = quotaEvery
+        self.requests = 0
+
+    def get(self, url, params):
+        self.requests = self.requests + 1
+        if self.quotaEvery and self.requests % self.quotaEvery == 0:
+            return FakeResponse('{"Note": "API call frequency exceeded"}', self.latency)
+        symbol = params['symbol']
+        prices = self.source.fetch([symbol], date.min)[symbol]
+        if isinstance(prices, Exception):
+            return FakeResponse(json.dumps({'Error Message': str(prices)}), self.latency)
+        lines = ['timestamp,open,high,low,close,volume']
+        lines.extend('%s,%s,%s,%s,%s,0' % (d.isoformat(), p, p, p, p) for d, p in prices)
+        return FakeResponse('\n'.join(lines) + '\n', self.latency)
+
+class FakeHTTPProvider(AlphaVantageProvider):
+    # Alpha Vantage requests, retries and parsing against FakeSession;
+    # source defaults to a FileProvider for directory, no quota limit
+    # unless requestsPerMinute is given
+
+    def __init__(self, source = None, directory = None, latency = 0.0, quotaEvery = None,
+                 requestsPerMinute = 1e9, retries = 3, backoff = 0.0, connections = 4):
+        if source is None:
+            source = FileProvider(directory)
+        super().__init__('fake', FakeSession(source, latency, quotaEvery),
+                         requestsPerMinute, retries, backoff, connections)
+
+PROVIDERS = {
+    'alphavantage': AlphaVantageProvider,
+    'file': FileProvider,
+    'fake-http': FakeHTTPProvider,
+}
+
+def getPriceProvider(name = None, **options):
+    # provider by name in PROVIDERS or dotted path, as configured with
+    # MARKET_DATA_PROVIDER and MARKET_DATA_PROVIDER_OPTIONS by default
+    if name is None:
+        name = getattr(settings, 'MARKET_DATA_PROVIDER', 'alphavantage')
+        options = dict(getattr(settings, 'MARKET_DATA_PROVIDER_OPTIONS', {}), **options)
+    provider = PROVIDERS.get(name)
+    if provider is None:
+        provider = import_string(name)
+    return provider(**options)
@@ -0,0 +1,35 @@
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import djmoney.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('returns', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionValuation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='Valuation date')),
+                ('cur_value_currency', djmoney.models.fields.CurrencyField(choices=[('EUR', 'Euro'), ('USD', 'US Dollar')], default='EUR', editable=False, max_length=3)),
+                ('cur_value', djmoney.models.fields.MoneyField(decimal_places=2, default=Decimal('0.0'), default_currency='EUR', max_digits=10, verbose_name='Current value')),
+                ('base_value_currency', djmoney.models.fields.CurrencyField(choices=[('EUR', 'Euro'), ('USD', 'US Dollar')], default='EUR', editable=False, max_length=3)),
+                ('base_value', djmoney.models.fields.MoneyField(decimal_places=2, default=Decimal('0.0'), default_currency='EUR', max_digits=10, verbose_name='Base value based on in- and outflows')),
+                ('modifiedDate', models.DateField(db_index=True, verbose_name='Last modification')),
+                ('sum_num', models.DecimalField(decimal_places=5, default=0, max_digits=13, verbose_name='sum of number of securities exchanged')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='returns.Account')),
+                ('owner', models.ForeignKey(default=2, on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL)),
+                ('security', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='returns.Security')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('returns', '0002_positionvaluation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValuationJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('SE', 'Security valuations'), ('AC', 'Account valuations')], max_length=2, verbose_name='kind of job')),
+                ('status', models.CharField(choices=[('QU', 'Queued'), ('RU', 'Running'), ('DO', 'Done'), ('FA', 'Failed')], db_index=True, default='QU', max_length=2, verbose_name='status of job')),
+                ('fullRebuild', models.BooleanField(default=False, verbose_name='Replay all transactions')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Finished')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Error message')),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='returns.Account')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('security', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='returns.Security')),
+            ],
+        ),
+    ]
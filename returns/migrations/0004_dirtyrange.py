@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('returns', '0003_valuationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyRange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Out of date from')),
+                ('securityPending', models.BooleanField(default=True, verbose_name='Security valuations out of date')),
+                ('accountPending', models.BooleanField(default=True, verbose_name='Account valuations out of date')),
+                ('changed', models.DateTimeField(verbose_name='Last changed')),
+                ('account', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='returns.Account')),
+                ('owner', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('security', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='returns.Security')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='dirtyrange',
+            unique_together={('owner', 'account', 'security')},
+        ),
+    ]
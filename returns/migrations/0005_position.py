@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import djmoney.models.fields
+
+
+def fillPositions(apps, schema_editor):
+    # fill the ledger from existing transactions, securities and accounts
+    # are looked up there from now on
+    from returns.processTransaction2 import rebuildPositions
+    rebuildPositions(transactionModel=apps.get_model('returns', 'Transaction'),
+                     positionModel=apps.get_model('returns', 'Position'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('returns', '0004_dirtyrange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Position',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num', models.DecimalField(decimal_places=5, default=0, max_digits=13, verbose_name='number of securities held')),
+                ('cur_value_currency', djmoney.models.fields.CurrencyField(choices=[('EUR', 'Euro'), ('USD', 'US Dollar')], default='EUR', editable=False, max_length=3)),
+                ('cur_value', djmoney.models.fields.MoneyField(decimal_places=2, default_currency='EUR', max_digits=10, verbose_name='Current value if not marked to market')),
+                ('base_value_currency', djmoney.models.fields.CurrencyField(choices=[('EUR', 'Euro'), ('USD', 'US Dollar')], default='EUR', editable=False, max_length=3)),
+                ('base_value', djmoney.models.fields.MoneyField(decimal_places=2, default_currency='EUR', max_digits=10, verbose_name='Base value based on in- and outflows')),
+                ('cost_currency', djmoney.models.fields.CurrencyField(choices=[('EUR', 'Euro'), ('USD', 'US Dollar')], default='EUR', editable=False, max_length=3)),
+                ('cost', djmoney.models.fields.MoneyField(decimal_places=2, default_currency='EUR', max_digits=10, verbose_name='Paid for securities bought')),
+                ('transactions', models.IntegerField(default=0, verbose_name='Number of transactions')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='returns.Account')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('security', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='returns.Security')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='position',
+            unique_together={('owner', 'account', 'security')},
+        ),
+        migrations.RunPython(fillPositions, migrations.RunPython.noop),
+    ]
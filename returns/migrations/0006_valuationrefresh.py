@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('returns', '0005_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='security',
+            name='priceRefreshed',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Last price refresh'),
+        ),
+        migrations.CreateModel(
+            name='ValuationRefresh',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('SE', 'Security valuations'), ('AC', 'Account valuations')], max_length=2, verbose_name='kind of valuations')),
+                ('refreshed', models.DateTimeField(blank=True, null=True, verbose_name='Last refresh')),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='returns.Account')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('security', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='returns.Security')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='valuationrefresh',
+            index_together={('kind', 'owner', 'refreshed')},
+        ),
+    ]
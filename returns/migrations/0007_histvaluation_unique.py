@@ -0,0 +1,28 @@
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def deduplicate(apps, schema_editor):
+    # keep the most recently written price of each security and date
+    HistValuation = apps.get_model('returns', 'HistValuation')
+    duplicates = HistValuation.objects.values('security_id', 'date') \
+                                      .annotate(n=Count('id'), keep=Max('id')) \
+                                      .filter(n__gt=1)
+    for d in duplicates.iterator():
+        HistValuation.objects.filter(security_id=d['security_id'], date=d['date']) \
+                             .exclude(id=d['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('returns', '0006_valuationrefresh'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='histvaluation',
+            unique_together={('security', 'date')},
+        ),
+    ]
@@ -1,4 +1,5 @@
 from time import mktime, sleep
+from bisect import bisect_left, bisect_right
 from datetime import datetime, date, timedelta
 from decimal import *
 from moneyed import Money
@@ -10,26 +11,32 @@ from sys import stderr
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import connection, models
-from django.db.models import Sum, Subquery, OuterRef
+from django.db import connection, models, IntegrityError, transaction
+from django.db.models import F, Max, Min, Q, Sum, Subquery, OuterRef, Value
+from django.db.models.functions import Coalesce, Least
 from django.urls import reverse
 from django.utils import timezone
 
 from six import python_2_unicode_compatible
-from alpha_vantage.timeseries import TimeSeries
 # from pandas import DataFrame
 
-from .calc import Solver
-from .utilities import yearsago, last_day_of_month
+from .calc import Solver, ArraySolver
+from .rateCache import getRateCache
+from .marketData import getPriceProvider
+from .utilities import yearsago, last_day_of_month, stalenessReport, formatStaleness
+from .snapshots import getSnapshotCalendar
 
-from finance.settings import ALPHA_VANTAGE_KEY
 
+import logging
+import numpy as np
 import requests
 
+logger = logging.getLogger(__name__)
+
 class SecurityQuerySet(models.QuerySet):
     def securityOwnedBy(self,ownerID):
-        pk_securities = Transaction.thobjects2.owner(ownerID) \
-                                              .values_list('security', flat=True)
+        pk_securities = Position.objects.owner(ownerID) \
+                                        .values_list('security', flat=True)
         return self.filter(pk__in=pk_securities)
 
     def markToMarket(self):
@@ -41,6 +48,10 @@ class SecurityQuerySet(models.QuerySet):
     def active(self):
         return self.filter(active=True)
 
+    def mostStale(self):
+        # securities whose prices were refreshed longest ago (or never) first
+        return self.order_by(F('priceRefreshed').asc(nulls_first=True), 'id')
+
 class SecurityManager(models.Manager):
     def get_queryset(self):
         return SecurityQuerySet(self.model, using=self._db)
@@ -58,60 +69,66 @@ class SecurityManager(models.Manager):
         return self.get_queryset().active()
 
     def saveCurrentMarkToMarketValue(self):
-        # for each mark to market security get and save current value, random ordering
-        markToMarketSecurities = self.get_queryset().markToMarket().active().order_by('?')[0:8]
-        # today = timezone.now().date() + timezone.timedelta(days=-1)
-
-        #ts = TimeSeries(key=ALPHA_VANTAGE_KEY, output_format='pandas')
-        ts = TimeSeries(key=ALPHA_VANTAGE_KEY, output_format='csv')
-
-        for s in markToMarketSecurities:
-            try:
-                value, date = s.markToMarket(ts)
-                HistValuation.objects.update_or_create(
-                        date = date,
-                        security = s,
-                        defaults = { 'value': value }
-                )
-            except:
-                print("Error getting data for security ", s, file=stderr)
-
-        return markToMarketSecurities
+        # for each active mark to market security get and save current value
+        return self.saveMarkToMarketValues(latestOnly=True)
 
     def saveMultiCurrentMarkToMarketValue(self):
-        # for each mark to market security get and save current value, random ordering
-        markToMarketSecurities = self.get_queryset().markToMarket().active().order_by('?')[0:10]
+        # for each active mark to market security get and save values since
+        # the last one stored (up to 30 days if there is none)
+        return self.saveMarkToMarketValues(latestOnly=False)
+
+    def saveMarkToMarketValues(self, latestOnly = False, provider = None, limit = None):
+        # prices of all securities are fetched in one batch from provider
+        # (default as configured, see marketData); with limit (default
+        # MARKET_DATA_REFRESH_LIMIT setting, None for all) only as many
+        # securities refreshed longest ago; returns securities that were not
+        # up to date
+        if provider is None:
+            provider = getPriceProvider()
+        if limit is None:
+            limit = getattr(settings, 'MARKET_DATA_REFRESH_LIMIT', None)
+        today = datetime.today().date()
+        now = timezone.now()
+        candidates = self.get_queryset().markToMarket().active().exclude(symbol='').mostStale()
+        logger.info("Staleness of security prices: %s", formatStaleness(stalenessReport(
+            candidates.values_list('priceRefreshed', flat=True), now)))
+        if limit is not None:
+            candidates = candidates[:limit]
+        candidates = list(candidates.annotate(latestDate=Max('histvaluation__date')))
+
+        markToMarketSecurities = []
+        refreshed = []
+        symbols = {}
+        for s in candidates:
+            if s.latestDate is not None and s.latestDate >= today:
+                # skip if already got data
+                print("Skip getting data for security ", s, file=stderr)
+                refreshed.append(s.id)
+                continue
+            if latestOnly:
+                upToDate = today
+            elif s.latestDate is None:
+                upToDate = today + timedelta(days=-30)
+            else:
+                upToDate = s.latestDate
+            symbols[s.symbol] = min(upToDate, symbols.get(s.symbol, upToDate))
+            markToMarketSecurities.append(s)
 
-        ts = TimeSeries(key=ALPHA_VANTAGE_KEY, output_format='csv')
+        print("Get mark-to-market data for", len(symbols), "symbols", file=stderr)
+        prices = provider.fetch(list(symbols), symbols) if symbols else {}
 
         for s in markToMarketSecurities:
-            # find which is the most recent entry
-            try:
-                latest_date = HistValuation.objects.security(s).latest('date').date
-                if latest_date >= datetime.today().date():
-                    # skip if already got data
-                    print("Skip getting data for security ", s, file=stderr)
-                    continue
-            except:
-                latest_date = (datetime.today() + timedelta(days=-30)).date()
-
-            if s.symbol == '':
-                # skip if no symbol
-                print("Error (no symbol) getting data for security ", s, file=stderr)
+            valuation = prices[s.symbol]
+            if isinstance(valuation, Exception):
+                # not marked as refreshed, so tried first next time
+                print("Error getting data for security ", s, ":", valuation, file=stderr)
                 continue
+            if latestOnly:
+                valuation = valuation[:1]
+            HistValuation.objects.upsert(s.id, valuation, s.currency)
+            refreshed.append(s.id)
 
-            try:
-                print("Get mark-to-market data for security ", s, file=stderr)
-                valuation = s.markToMarketMultiple(ts, latest_date)
-                for date, value in valuation:
-                    HistValuation.objects.update_or_create(
-                            date = date,
-                            security = s,
-                            defaults = { 'value': value }
-                )
-            except:
-                print("Error getting data for security ", s, file=stderr)
-
+        self.get_queryset().filter(pk__in=refreshed).update(priceRefreshed=now)
         return markToMarketSecurities
 
 
@@ -163,6 +180,10 @@ class Security(models.Model):
 
     active = models.BooleanField('Active security',
                                  default=True)
+    priceRefreshed = models.DateTimeField('Last price refresh',
+                                          null = True,
+                                          blank = True,
+                                          db_index = True)
 
     objects = SecurityManager()
 
@@ -175,80 +196,27 @@ class Security(models.Model):
     def getSymbol(self):
         return self.symbol
 
-    def markToMarket(self, ts):
-        if not self.mark_to_market:
-            raise RuntimeError('Security not marked to market prices')
-
-        if self.symbol == '':
-            raise RuntimeError('No symbol for mark to market security')
-        try:
-            # query website using alpha vantage API
-            counter = 0
-            data_retrieved = False
-            # if data was not retrieved, try again after short wait
-            while (counter < 5 and not data_retrieved):
-                try:
-                    data, meta_data = ts.get_daily(self.symbol)
-                    # skip first row
-                    next(data)
-                    # extract information
-                    row = next(data)
-                    #value = Decimal(float(data['4. close'][-1]))
-                    value = Decimal(float(row[4]))
-                    #date = datetime.strptime(str(data.index[-1]), "%Y-%m-%d %H:%M:%S").date()
-                    date = datetime.strptime(str(row[0]), "%Y-%m-%d").date()
-                    data_retrieved = True
-                    sleep(12) # wait to not exceep API max
-                except:
-                    counter += 2
-                    sleep(counter)
-            price = Money(amount=value, currency=self.currency)
-        except:
+    def markToMarket(self, provider = None):
+        # latest price and its date
+        valuation = self.markToMarketMultiple(datetime.today().date(), provider)
+        if not valuation:
             raise RuntimeError('Trouble getting data for security', self.name)
-
-        # screen scraping based on yahoo website
-        # try:
-        #     data = requests.get(self.url)
-        #     value = Decimal(float(data.content))
-        #     price = Money(amount=value,currency=self.currency)
-        # except:
-        #     raise RuntimeError('Trouble getting data for security', security.name)
-
+        date, price = valuation[0]
         return price, date
 
-    def markToMarketMultiple(self, ts, up_to_date):
+    def markToMarketMultiple(self, up_to_date, provider = None):
+        # prices (list of [date, price]) from the latest down to up_to_date
         if not self.mark_to_market:
             raise RuntimeError('Security not marked to market prices')
 
         if self.symbol == '':
             raise RuntimeError('No symbol for mark to market security')
-        try:
-            # query website using alpha vantage API
-            counter = 0
-            data_retrieved = False
-            # if data was not retrieved, try again after short wait
-            valuation = []
-            while (counter < 2 and not data_retrieved):
-                try:
-                    data, meta_data = ts.get_daily(self.symbol)
-                    # skip first row
-                    next(data)
-                    # extract information
-                    for row in data:
-                        value = Decimal(float(row[4]))
-                        date = datetime.strptime(str(row[0]), "%Y-%m-%d").date()
-                        valuation.append([date, Money(amount=value, currency=self.currency)])
-                        if date <= up_to_date:
-                            break
-                    data_retrieved = True
-                    #sleep(12) # wait to not exceep API max
-                except:
-                    counter += 1
-                    #sleep(counter)
-        except:
+        if provider is None:
+            provider = getPriceProvider()
+        prices = provider.fetch([self.symbol], up_to_date)[self.symbol]
+        if isinstance(prices, Exception):
             raise RuntimeError('Trouble getting data for security', self.name)
-        return valuation
-
+        return [[date, Money(amount=value, currency=self.currency)] for date, value in prices]
 
     def calcInterest(self, date, owner):
     # calculate interest for security based on for year leading up to date
@@ -266,8 +234,8 @@ class Security(models.Model):
 
 class AccountQuerySet(models.QuerySet):
     def accountOwnedBy(self,ownerID):
-        pk_accounts = Transaction.thobjects2.owner(ownerID) \
-                                            .values_list('account', flat=True)
+        pk_accounts = Position.objects.owner(ownerID) \
+                                      .values_list('account', flat=True)
         return self.filter(pk__in=pk_accounts)
 
     def active(self):
@@ -413,6 +381,13 @@ class TransactionManager2(models.Manager):
     def num(self, beginDate = None, endDate = None,
                   securities = None, accounts = None, owner = None):
     # sum transacted securities
+        if beginDate is None and endDate is None:
+            # current holdings from the ledger of positions
+            return Position.objects.restrict(securities, accounts, owner) \
+                                   .filter(security__mark_to_market=True) \
+                                   .values('security_id') \
+                                   .annotate(sumNumTransacted=Sum('num'))
+
         numSecurities = self.transactionHistory(beginDate, endDate, securities, accounts, owner)
         numSecurities = numSecurities.markToMarket()
 
@@ -520,6 +495,17 @@ class TransactionManager(models.Manager):
             return dict_cursor(cursor)
 
     def getNum(self, beginDate = None, endDate = None, securities = None, accounts = None, owner = None):
+        if beginDate == None and endDate == None:
+            # current holdings from the ledger of positions
+            if securities != None:
+                accounts = None
+            nums = list(Position.objects.restrict(securities, accounts, owner)
+                                        .filter(security__mark_to_market=True)
+                                        .values('security_id')
+                                        .annotate(num_transacted=Sum('num'))
+                                        .order_by('security_id'))
+            return nums if nums else None
+
         cursor = connection.cursor()
         sql = """SELECT security_id, SUM(num_transacted) AS num_transacted FROM returns_transaction T1 INNER JOIN returns_security T2 ON T1.security_id = T2.id WHERE T2.mark_to_market"""
         if securities == None and accounts == None:
@@ -657,6 +643,12 @@ class Transaction(models.Model):
     def __str__(self):
         return "%s: (%s) %s (%s) %s" % (self.date, self.kind, self.security.name, self.security.descrip, self.cashflow)
 
+    def save(self, *args, **kwargs):
+        # ledger of positions is updated by signal handlers, in the same
+        # database transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def match(self, percentage):
     # Copy transaction and adjust
         self.pk = None
@@ -665,6 +657,45 @@ class Transaction(models.Model):
 
         return self
 
+class PriceIndex():
+    # historical valuations of securities loaded once into sorted arrays per
+    # security, answers as-of lookups (last valuation on or before a date)
+    # like HistValuationManager.getHistValuation without further queries
+
+    def __init__(self, rows, currencies):
+        self.dates = {}
+        self.days = {}
+        self.values = {}
+        self.currencies = currencies
+        for securityId, d, amount, currency in rows:
+            self.dates.setdefault(securityId, []).append(d)
+            self.values.setdefault(securityId, []).append(Money(amount, currency))
+        for securityId, dates in self.dates.items():
+            self.days[securityId] = np.array([d.toordinal() for d in dates], dtype=np.int64)
+
+    def missing(self, securityId):
+        # value used if there is no valuation (yet)
+        return Money(0.0, currency=self.currencies.get(securityId, 'EUR'))
+
+    def asOf(self, securityId, date, default = None):
+        try:
+            i = bisect_right(self.dates[securityId], date)
+        except KeyError:
+            i = 0
+        if i == 0:
+            return self.missing(securityId) if default is None else default
+        return self.values[securityId][i-1]
+
+    def asOfMany(self, securityId, dates):
+        # valuations for a list of dates at once
+        if securityId not in self.days:
+            return [self.missing(securityId) for d in dates]
+        indices = np.searchsorted(self.days[securityId],
+                                  np.array([d.toordinal() for d in dates], dtype=np.int64),
+                                  side='right')
+        values = self.values[securityId]
+        return [values[i-1] if i > 0 else self.missing(securityId) for i in indices]
+
 class HistValuationQuerySet(models.QuerySet):
     def security(self,securityID):
         return self.filter(security=securityID)
@@ -682,6 +713,65 @@ class HistValuationManager(models.Manager):
     def date(self,date):
         return self.get_queryset().date(date)
 
+    def priceIndex(self, securityIDs = None):
+        # load historical valuations for given (default all) securities,
+        # two queries independent of the number of lookups made later
+        hist = self.get_queryset()
+        securities = Security.objects.all()
+        if securityIDs is not None:
+            hist = hist.filter(security__in=securityIDs)
+            securities = securities.filter(id__in=securityIDs)
+        rows = hist.order_by('security_id', 'date') \
+                   .values_list('security_id', 'date', 'value', 'value_currency')
+        return PriceIndex(rows.iterator(), dict(securities.values_list('id', 'currency')))
+
+    def upsert(self, securityID, prices, currency, batchSize = None):
+        # insert or replace prices (iterable of (date, amount)) of security
+        # with one multi-row statement per batch (default VALUATION_BATCH_SIZE
+        # rows, fewer if the database limits query parameters) instead of a
+        # query per price; returns number of prices written; valuations of
+        # the security are marked out of date from the first price on
+        rows = dict(prices)
+        if not rows:
+            return 0
+        DirtyRange.objects.markSecurity(securityID, min(rows))
+
+        opts = self.model._meta
+        columns = [opts.get_field('date').column, opts.get_field('security').column,
+                   opts.get_field('value').column, opts.get_field('value_currency').column]
+        if connection.vendor not in ('mysql', 'sqlite', 'postgresql'):
+            for date, value in rows.items():
+                self.update_or_create(date=date, security_id=securityID,
+                                      defaults={'value': Money(amount=value, currency=currency)})
+            return len(rows)
+
+        ops = connection.ops
+        table = ops.quote_name(opts.db_table)
+        names = [ops.quote_name(c) for c in columns]
+        if connection.vendor == 'mysql':
+            conflict = 'ON DUPLICATE KEY UPDATE ' + ', '.join('%s = VALUES(%s)' % (n, n) for n in names[2:])
+        else:
+            conflict = 'ON CONFLICT (%s, %s) DO UPDATE SET ' % (names[1], names[0]) + \
+                       ', '.join('%s = excluded.%s' % (n, n) for n in names[2:])
+        if batchSize is None:
+            batchSize = getattr(settings, 'VALUATION_BATCH_SIZE', 500)
+        batchSize = min(batchSize, ops.bulk_batch_size(columns, list(rows)) or 1)
+
+        # dates in ISO format accepted by all backends, sorted for index locality
+        items = sorted(rows.items())
+        sql = None
+        with connection.cursor() as cursor:
+            for i in range(0, len(items), batchSize):
+                batch = items[i:i+batchSize]
+                params = []
+                for date, value in batch:
+                    params.extend((date.isoformat(), securityID, value, currency))
+                if sql is None or len(batch) < batchSize:
+                    sql = 'INSERT INTO %s (%s) VALUES %s %s' % (table, ', '.join(names),
+                                                                ', '.join(['(%s, %s, %s, %s)'] * len(batch)), conflict)
+                cursor.execute(sql, params)
+        return len(rows)
+
     def getHistValuation(self,securityID, date):
         try:
             h = self.get_queryset().security(securityID).date(date).latest('date')
@@ -714,6 +804,9 @@ class HistValuation(models.Model):
     def get_absolute_url(self):
         return reverse('views.transaction', args=[str(self.id)])
 
+    class Meta:
+        unique_together = ('security', 'date')
+
 class InflationManager(models.Manager):
     def getHistoricalRateOfInflation(self):
         # calculate inflation rate for multiple time periods
@@ -783,39 +876,179 @@ def dict_cursor(cursor):
     return [dict(zip([col[0] for col in description], row))
             for row in cursor.fetchall()]
 
+class ValuationSeries():
+    # valuations aggregated per date, kept in memory so that the cashflows
+    # for any date range can be sliced out without further queries
+
+    def __init__(self, rows):
+        self.dates = []
+        self.baseValues = []
+        self.curValues = []
+        self.currencies = []
+        for v in rows:
+            if self.dates and self.dates[-1] == v['date']:
+                self.baseValues[-1] = self.baseValues[-1] + v['sumBaseValue']
+                self.curValues[-1] = self.curValues[-1] + v['sumCurValue']
+            else:
+                self.dates.append(v['date'])
+                self.baseValues.append(v['sumBaseValue'])
+                self.curValues.append(v['sumCurValue'])
+                self.currencies.append(v['cur_value_currency'])
+        self.days = np.array([d.toordinal() for d in self.dates], dtype=np.float64)
+        self.base = np.array([float(b) for b in self.baseValues], dtype=np.float64)
+        self.cur = np.array([float(c) for c in self.curValues], dtype=np.float64)
+
+    def rangeIndices(self, beginDate = None, endDate = None):
+        # indices of first and one past last valuation in the date range
+        # as well as of the valuation used as final value
+        if endDate is None:
+            endDate = timezone.now().date()
+
+        # make sure we end on a snapshot date
+        endDate = getSnapshotCalendar().snapshotDate(endDate)
+
+        # limit to date range given
+        if beginDate is None:
+            first = 0
+        else:
+            first = bisect_left(self.dates, beginDate)
+        last = bisect_right(self.dates, endDate)
+
+        # get final value, if none at end date take last valuation
+        final = bisect_left(self.dates, endDate)
+        if final == len(self.dates):
+            final = final - 1
+
+        return first, last, final
+
+    def rateOfReturnSolver(self, beginDate = None, endDate = None):
+        # set up solver with the cashflows in the given date range as well as
+        # the values at the beginning and the end of the range
+        first, last, final = self.rangeIndices(beginDate, endDate)
+        return self.solverForRange(first, last, final)
+
+    def solverForRange(self, first, last, final):
+        # set up solver for the valuations with index first to last-1, the
+        # valuation before first as initial and final as final value
+
+        # get value at beginning of interval
+        if first > 0:
+            baseValue0 = self.base[first-1]
+            initialValue0 = Money(self.curValues[first-1], self.currencies[first-1])
+            days = [self.days[first-1:first]]
+            amounts = [np.array([float(initialValue0.amount)])]
+        else:
+        # if empty --> baseValue must be zero
+            baseValue0 = 0.
+            initialValue0 = 0.
+            days = []
+            amounts = []
+
+        # add date/cashflows, i.e. changes of the base value
+        if last > first:
+            base = self.base[first:last]
+            cashflows = np.diff(base, prepend=baseValue0)
+            nonZero = cashflows != 0.0
+            days.append(self.days[first:last][nonZero])
+            amounts.append(cashflows[nonZero])
+
+        if final >= 0:
+            finalValue = Money(self.curValues[final], self.currencies[final])
+            # negative due to different sign conventions
+            days.append(self.days[final:final+1])
+            amounts.append(np.array([-float(finalValue.amount)]))
+        else:
+            finalValue = 0.
+
+        if days:
+            days = np.concatenate(days)
+            solver = ArraySolver.fromArrays(days - days[0], np.concatenate(amounts))
+        else:
+            solver = ArraySolver()
+
+        return solver, initialValue0, finalValue
+
+    def timeWeightedReturns(self, periods):
+        # annualized time-weighted rate of return (in %) for each
+        # (begin date, end date) period by chain-linking the sub-period
+        # returns between valuation dates; in- and outflows (changes of the
+        # base value) are assumed to occur at the end of each sub-period;
+        # 'Error' (as in getRateOfReturn) if not computable, i.e. the period
+        # has no sub-period with a positive value at its start
+        growth = np.ones(len(self.dates))
+        invested = np.zeros(len(self.dates), dtype=bool)
+        if len(self.dates) > 1:
+            cashflows = np.diff(self.base)
+            previous = self.cur[:-1]
+            invested[1:] = previous > 0.0
+            growth[1:][invested[1:]] = (self.cur[1:][invested[1:]] - cashflows[invested[1:]]) / previous[invested[1:]]
+        cumGrowth = np.cumprod(growth)
+        numInvested = np.cumsum(invested)
+
+        rates = []
+        for beginDate, endDate in periods:
+            first, last, final = self.rangeIndices(beginDate, endDate)
+            start = max(first - 1, 0)
+            if final < 0 or final <= start or numInvested[final] == numInvested[start]:
+                rates.append('Error')
+                continue
+            totalGrowth = cumGrowth[final] / cumGrowth[start]
+            years = (self.days[final] - self.days[start]) / 365.0
+            if totalGrowth > 0.0:
+                rates.append(float(totalGrowth ** (1.0 / years) - 1.0) * 100.0)
+            else:
+                rates.append('Error')
+        return rates
+
+    def rollingRatesOfReturn(self, years = 1):
+        # trailing rate of return over the given number of years at every
+        # valuation date; the window slides along the series and each solve
+        # is warm started from the rate of the previous window
+        dates = []
+        rates = []
+        first = 0
+        guess = None
+        for i, d in enumerate(self.dates):
+            beginDate = yearsago(years, d)
+            if beginDate < self.dates[0]:
+                continue
+            while self.dates[first] < beginDate:
+                first = first + 1
+
+            solver, initialValue0, finalValue = self.solverForRange(first, i+1, i)
+            try:
+                rate = solver.calcRateOfReturn(method='hybrid', guess=guess)
+                guess = rate
+            except RuntimeError:
+                rate = None
+            dates.append(d)
+            rates.append(rate)
+
+        return dates, rates
+
+def rateOfReturn(solver, guess = None, method = 'irr'):
+    # rate of return and method ('irr' or 'dietz') that produced it
+    if method in ('dietz', 'auto'):
+        try:
+            return solver.calcModifiedDietz(wellConditioned=(method == 'auto')), 'dietz'
+        except RuntimeError:
+            if method == 'dietz':
+                return 'Error', 'dietz'
+
+    try:
+        r = getRateCache().rateOfReturn(solver, guess=guess)
+    except:
+        r = 'Error'
+    return r, 'irr'
+
 class ValuationQuerySet(models.QuerySet):
     def mostRecent(self):
         return self.filter(date__gte=timezone.now())#.order_by('-date')
 
 
-    def getHistoricalRateOfReturn(self):
+    def getHistoricalRateOfReturn(self, periods = None, method = 'irr'):
         # calculate internal rate of return for multiple time periods
-
-        # go to end of the month to ensure that all transactions have been captured
-        #--> appears on longer necessary
-#        today = last_day_of_month(timezone.now().date())
-        today = timezone.now().date()
-        thisYear = date(today.year,1,1)
-        prevYear = yearsago(1)
-        fiveYear = yearsago(5)
-
-        performanceYTD = self.getRateOfReturn(beginDate = thisYear, endDate = today)
-        performancePrevYear = self.getRateOfReturn(beginDate = prevYear, endDate = today)
-        performanceFiveYear = self.getRateOfReturn(beginDate = fiveYear, endDate = today)
-        performanceOverall = self.getRateOfReturn()
-
-        return {'rYTD': performanceYTD['rate'],
-                'iYTD': performanceYTD['initial'],
-                'tYTD': performanceYTD['final'],
-                'r1Y': performancePrevYear['rate'],
-                'i1Y': performancePrevYear['initial'],
-                't1Y': performancePrevYear['final'],
-                'r5Y': performanceFiveYear['rate'],
-                'i5Y': performanceFiveYear['initial'],
-                't5Y': performanceFiveYear['final'],
-                'rInfY': performanceOverall['rate'],
-                'iInfY': performanceOverall['initial'],
-                'tInfY': performanceOverall['final']}
+        return getHistoricalRatesOfReturn([self], periods, method)[0]
 
     def restrictDateRange(self, beginDate = None, endDate = None):
         qs = self.order_by('date')
@@ -827,85 +1060,55 @@ class ValuationQuerySet(models.QuerySet):
 
         return qs
 
-    def getRateOfReturn(self, beginDate = None, endDate = None):
+    def getRateOfReturn(self, beginDate = None, endDate = None, guess = None, method = 'irr'):
         # calculate internal rate of return given the cashflows
+        # guess (in %) is used as warm start, e.g. rate of previous period
+        # method 'dietz' uses the Modified Dietz estimate, 'auto' uses it when
+        # well-conditioned and falls back to the internal rate of return
+        solver, initialValue0, finalValue = self.rateOfReturnSolver(beginDate, endDate)
 
-        if endDate is None:
-            endDate = timezone.now().date()
-
-        # make sure we end on a 15th or last day
-        if endDate.day > 15:
-            endDate = last_day_of_month(endDate)
-        else:
-            endDate = endDate.replace(day=15)
-
-        # limit query set to date range given
-        qs = self.restrictDateRange(beginDate, endDate)
-
-        # aggregate values per date
-        qs = qs.values('date').annotate(sumBaseValue=Sum('base_value'),
-                                        sumCurValue=Sum('cur_value'))
-
-        # get value at beginning of interval
-        try:
-            base0 = self.filter(date__lt=beginDate).order_by('date')\
-              .values('date', 'cur_value_currency').annotate(sumBaseValue=Sum('base_value'),
-                                                                        sumCurValue=Sum('cur_value'))\
-                        .last()
-            date0 = base0['date']
-            baseValue0 = base0['sumBaseValue']
-            initialValue0 = Money(base0['sumCurValue'], base0['cur_value_currency'])
-        except:
-        # if query empty --> baseValue must be zero
-            date0 = None
-            baseValue0 = 0.
-            initialValue0 = 0.
-
-        # get final value
-        try:
-            final = self.filter(date__gte=endDate).order_by('date')\
-                        .values('date', 'cur_value_currency').annotate(sumCurValue=Sum('cur_value'))\
-                        .first()
-            finalValue = Money(final['sumCurValue'],final['cur_value_currency'])
-            finalDate = final['date']
-        except:
-        # if query empty --> either no valuations at all or none at end date
-            finalValue = 0.
-            finalDate = None
-            try:
-                # take last valuation
-                final = self.order_by('date')\
-                            .values('date', 'cur_value_currency').annotate(sumCurValue=Sum('cur_value'))\
-                            .last()
-                finalValue = Money(final['sumCurValue'],final['cur_value_currency'])
-                finalDate = final['date']
-            except:
-                pass
-
-        solver = Solver()
-
-        if date0 is not None:
-            solver.addCashflow(initialValue0.amount, date0)
-
-        # add date/cashflows to solver
-        for v in qs:
-            cashflow = float(v['sumBaseValue'])-float(baseValue0)
-            if cashflow != 0.0:
-                solver.addCashflow(cashflow, v['date'])
-            baseValue0 = v['sumBaseValue']
-
-        if finalDate is not None:
-            # negative due to different sign conventions
-            solver.addCashflow(-finalValue.amount, finalDate)
-
-        try:
-            r = solver.calcRateOfReturn()
-        except:
-            r = 'Error'
+        r, method = rateOfReturn(solver, guess, method)
 
         return {'rate': r,
                 'initial': initialValue0,
-                'final': finalValue }
+                'final': finalValue,
+                'method': method,
+                'evaluations': getattr(solver, 'evaluations', 0) }
+
+    def valuationSeries(self):
+        # get valuations aggregated per date in one query
+        rows = self.order_by('date').values('date', 'cur_value_currency')\
+                   .annotate(sumBaseValue=Sum('base_value'),
+                             sumCurValue=Sum('cur_value'))
+        return ValuationSeries(rows)
+
+    def rateOfReturnSolver(self, beginDate = None, endDate = None):
+        # set up solver with the cashflows in the given date range as well as
+        # the values at the beginning and the end of the range
+        return self.restrictToRange(beginDate, endDate).valuationSeries().rateOfReturnSolver(beginDate, endDate)
+
+    def restrictToRange(self, beginDate = None, endDate = None):
+        # valuations needed for the date range: those in it, the last one
+        # before it (initial value) and the first one from the end date on
+        # (final value, see ValuationSeries.rangeIndices)
+        if endDate is None:
+            endDate = timezone.now().date()
+        endDate = getSnapshotCalendar().snapshotDate(endDate)
+        dateField = models.DateField()
+        qs = self
+        if beginDate is not None:
+            previous = self.filter(date__lt=beginDate).order_by('-date').values('date')[:1]
+            qs = qs.filter(date__gte=Coalesce(Subquery(previous), Value(beginDate, output_field=dateField)))
+        final = self.filter(date__gte=endDate).order_by('date').values('date')[:1]
+        return qs.filter(date__lte=Coalesce(Subquery(final), Value(endDate, output_field=dateField)))
+
+    def getTimeWeightedReturn(self, beginDate = None, endDate = None):
+        # time-weighted rate of return as alternative to internal rate of return
+        return self.valuationSeries().timeWeightedReturns([(beginDate, endDate)])[0]
+
+    def getRollingRateOfReturn(self, years = 1):
+        # trailing rate of return at every valuation date, see ValuationSeries
+        return self.valuationSeries().rollingRatesOfReturn(years)
 
     def makeChart(self):
         # Collects information and processes it to show chart of valuation
@@ -943,6 +1146,7 @@ class ValuationQuerySet(models.QuerySet):
                 'name1': 'Actual value', 'y1': y1data, 'extra1': extra_serie,
                 'name2': 'Inflow - outflows', 'y2': y2data, 'extra2': extra_serie,
             }
+
             charttype = "lineWithFocusChart"
             chartcontainer = 'asset_history'
             data = {
@@ -962,6 +1166,109 @@ class ValuationQuerySet(models.QuerySet):
         except:
             return None
 
+    def makeRollingReturnChart(self, years = 1):
+        # chart of trailing rate of return (in %), separate from makeChart
+        # as it needs its own y-axis; starts once a full window of history
+        # is available
+        rollingDates, rollingRates = self.getRollingRateOfReturn(years)
+        if not rollingDates:
+            return None
+
+        xdata = [int(mktime(d.timetuple())*1000) for d in rollingDates]
+        ydata = [None if r is None else round(r, 2) for r in rollingRates]
+        chartdata = {
+            'x': xdata,
+            'name1': 'Trailing %dY return' % years, 'y1': ydata,
+            'extra1': {"tooltip": {"y_start": "", "y_end": "%"},
+                       "date_format": "%b %Y"},
+        }
+        return {
+            'charttype': "lineChart",
+            'chartdata': chartdata,
+            'chartcontainer': 'rolling_return',
+            'extra': {
+                'x_is_date': True,
+                'x_axis_format': '%b %Y',
+                'tag_script_js': True,
+                'jquery_on_ready': False,
+                'margin_left': 70,
+            }
+        }
+
+def historicalPeriods():
+    # time periods (key suffix, begin date, end date) for historical rates of return
+    #--> going to end of the month appears no longer necessary
+    today = timezone.now().date()
+    thisYear = date(today.year,1,1)
+    prevYear = yearsago(1)
+    fiveYear = yearsago(5)
+
+    return [('YTD', thisYear, today),
+            ('1Y', prevYear, today),
+            ('5Y', fiveYear, today),
+            ('InfY', None, None)]
+
+def getHistoricalRatesOfReturn(valuationSets, periods = None, method = 'irr'):
+    # calculate internal rates of return (r), initial (i) and final (t) values
+    # and time-weighted returns (w) for multiple time periods of several
+    # valuation query sets, solving all cashflow series together in one batch;
+    # each valuation query set is fetched once, periods default to
+    # historicalPeriods() but any list of (key suffix, begin, end) works;
+    # method as for getRateOfReturn, the method used is stored as m<suffix>
+    return seriesRatesOfReturn([valuation.valuationSeries() for valuation in valuationSets],
+                               periods, method)
+
+def seriesRatesOfReturn(seriesList, periods = None, method = 'irr'):
+    # as getHistoricalRatesOfReturn, but for valuation series already loaded;
+    # needs no database access so can run in a worker process
+    if periods is None:
+        periods = historicalPeriods()
+
+    solvers = []
+    values = []
+    timeWeighted = []
+    for series in seriesList:
+        for suffix, beginDate, endDate in periods:
+            solver, initialValue0, finalValue = series.rateOfReturnSolver(beginDate, endDate)
+            solvers.append(solver)
+            values.append((initialValue0, finalValue))
+        # time-weighted returns come at little extra cost from the same series
+        timeWeighted.extend(series.timeWeightedReturns([(b, e) for s, b, e in periods]))
+
+    # use Modified Dietz estimate where requested, solve the rest in one batch
+    rates = [None for s in solvers]
+    methods = ['irr' for s in solvers]
+    if method in ('dietz', 'auto'):
+        for i, s in enumerate(solvers):
+            try:
+                rates[i] = s.calcModifiedDietz(wellConditioned=(method == 'auto'))
+                methods[i] = 'dietz'
+            except RuntimeError:
+                if method == 'dietz':
+                    methods[i] = 'dietz'
+    irr = [i for i, m in enumerate(methods) if m == 'irr']
+    rateCache = getRateCache()
+    for i, r in zip(irr, rateCache.solveMultiple([solvers[i] for i in irr])):
+        rates[i] = r
+    stats = rateCache.stats()
+    logger.info("Rate cache: %d hits, %d misses (%.0f%% hit rate)",
+                stats['hits'], stats['misses'], stats['hitRate'] * 100.0)
+
+    performance = []
+    i = 0
+    for series in seriesList:
+        perf = {}
+        for suffix, beginDate, endDate in periods:
+            perf['r' + suffix] = 'Error' if rates[i] is None else rates[i]
+            perf['m' + suffix] = methods[i]
+            perf['i' + suffix] = values[i][0]
+            perf['t' + suffix] = values[i][1]
+            perf['w' + suffix] = timeWeighted[i]
+            i = i + 1
+        performance.append(perf)
+
+    return performance
+
 class ValuationManager(models.Manager):
     def get_queryset(self):
         return ValuationQuerySet(self.model, using=self._db)
@@ -969,12 +1276,15 @@ class ValuationManager(models.Manager):
     def mostRecent(self):
         return self.get_queryset().mostRecent()
 
-    def getRateOfReturn(self, beginDate = None, endDate = None):
-        return self.get_queryset().getRateOfReturn(beginDate, endDate)
+    def getRateOfReturn(self, beginDate = None, endDate = None, guess = None, method = 'irr'):
+        return self.get_queryset().getRateOfReturn(beginDate, endDate, guess, method)
 
     def makeChart(self):
         return self.get_queryset().makeChart()
 
+    def makeRollingReturnChart(self, years = 1):
+        return self.get_queryset().makeRollingReturnChart(years)
+
 @python_2_unicode_compatible
 class Valuation(models.Model):
     # abstract model to store historical valuation to be used to calculate rate of returns
@@ -1023,6 +1333,391 @@ class AccountValuation(Valuation):
     def __str__(self):
         return "%s (%s): %s (%s)" % (self.account.name, self.date, self.cur_value, self.base_value)
 
+@python_2_unicode_compatible
+class PositionValuation(Valuation):
+    # models the current valuation and the base value of a security held in an account by a given owner for a given date,
+    # account valuations are aggregated from these
+    account = models.ForeignKey(Account,
+                                on_delete = models.PROTECT,
+                                db_index=True)
+    security = models.ForeignKey(Security,
+                                 on_delete = models.PROTECT,
+                                 db_index=True)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              default=2,
+                              on_delete=models.PROTECT)
+    sum_num = models.DecimalField('sum of number of securities exchanged',
+                                   max_digits = 13,
+                                   decimal_places = 5,
+                                   default = 0)
+
+    def __str__(self):
+        return "%s, %s (%s): %s (%s)" % (self.account.name, self.security.name, self.date, self.cur_value, self.base_value)
+
+class ValuationJobQuerySet(models.QuerySet):
+    def queued(self):
+        return self.filter(status=ValuationJob.QUEUED)
+
+    def owner(self, ownerID):
+        return self.filter(owner_id=ownerID)
+
+class ValuationJobManager(models.Manager):
+    def get_queryset(self):
+        return ValuationJobQuerySet(self.model, using=self._db)
+
+    def queued(self):
+        return self.get_queryset().queued()
+
+    def owner(self, ownerID):
+        return self.get_queryset().owner(ownerID)
+
+    def enqueue(self, kind, owner = None, security = None, account = None, fullRebuild = False):
+        # add refresh job unless the same one is already waiting
+        job = self.get_queryset().queued().filter(kind=kind, owner=owner, security=security,
+                                                  account=account).first()
+        if job is None:
+            job = self.create(kind=kind, owner=owner, security=security, account=account,
+                              fullRebuild=fullRebuild)
+        elif fullRebuild and not job.fullRebuild:
+            job.fullRebuild = True
+            job.save(update_fields=['fullRebuild'])
+        return job
+
+    def claim(self, job):
+        # mark queued job as running, False if another worker was faster
+        return self.get_queryset().queued().filter(pk=job.pk) \
+                   .update(status=ValuationJob.RUNNING, started=timezone.now()) == 1
+
+    def requeueStale(self, timeout):
+        # queue jobs running for more than timeout seconds again, their
+        # worker presumably died; returns number of jobs requeued
+        cutoff = timezone.now() - timedelta(seconds=timeout)
+        return self.get_queryset().filter(status=ValuationJob.RUNNING, started__lt=cutoff) \
+                   .update(status=ValuationJob.QUEUED, started=None)
+
+    def claimNext(self):
+        # oldest queued job marked as running, None if there is none
+        while True:
+            job = self.get_queryset().queued().order_by('created', 'id').first()
+            if job is None:
+                return None
+            if self.claim(job):
+                job.refresh_from_db()
+                return job
+
+class ValuationJob(models.Model):
+    # models a request to refresh security or account valuations, processed
+    # by the run_valuation_worker command outside of the web request
+    SECURITY = 'SE'
+    ACCOUNT = 'AC'
+    JOB_KIND_CHOICES = (
+        (SECURITY, 'Security valuations'),
+        (ACCOUNT, 'Account valuations'),
+    )
+    QUEUED = 'QU'
+    RUNNING = 'RU'
+    DONE = 'DO'
+    FAILED = 'FA'
+    JOB_STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    kind = models.CharField('kind of job',
+                            max_length = 2,
+                            choices = JOB_KIND_CHOICES)
+    status = models.CharField('status of job',
+                              max_length = 2,
+                              choices = JOB_STATUS_CHOICES,
+                              default = QUEUED,
+                              db_index=True)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              null = True,
+                              blank = True,
+                              on_delete=models.CASCADE)
+    security = models.ForeignKey(Security,
+                                 null = True,
+                                 blank = True,
+                                 on_delete = models.CASCADE)
+    account = models.ForeignKey(Account,
+                                null = True,
+                                blank = True,
+                                on_delete = models.CASCADE)
+    fullRebuild = models.BooleanField('Replay all transactions',
+                                      default = False)
+    created = models.DateTimeField('Created',
+                                   auto_now_add = True)
+    started = models.DateTimeField('Started',
+                                   null = True,
+                                   blank = True)
+    finished = models.DateTimeField('Finished',
+                                    null = True,
+                                    blank = True)
+    error = models.TextField('Error message',
+                             blank = True,
+                             default = '')
+
+    objects = ValuationJobManager()
+
+    def __str__(self):
+        return "%s (%s): %s" % (self.get_kind_display(), self.created, self.get_status_display())
+
+class DirtyRangeQuerySet(models.QuerySet):
+    def owner(self, ownerID):
+        return self.filter(owner_id=ownerID)
+
+    def securityPending(self):
+        return self.filter(securityPending=True)
+
+    def accountPending(self):
+        return self.filter(accountPending=True)
+
+    def earliestDate(self):
+        # first date from which valuations are out of date, None if none
+        return self.aggregate(Min('date'))['date__min']
+
+    def consumed(self, pendingField, started):
+        # mark ranges as processed for securities or accounts, ranges changed
+        # since the valuation engine started remain pending
+        self.filter(changed__lte=started).update(**{pendingField: False})
+        DirtyRange.objects.filter(securityPending=False, accountPending=False).delete()
+
+class DirtyRangeManager(models.Manager):
+    def get_queryset(self):
+        return DirtyRangeQuerySet(self.model, using=self._db)
+
+    def owner(self, ownerID):
+        return self.get_queryset().owner(ownerID)
+
+    def securityPending(self):
+        return self.get_queryset().securityPending()
+
+    def accountPending(self):
+        return self.get_queryset().accountPending()
+
+    def mark(self, ownerID, accountID, securityID, date):
+        # record that valuations of the position are out of date from date
+        # on, merged with the record of the same position if there is one
+        key = {'owner_id': ownerID, 'account_id': accountID, 'security_id': securityID}
+        changes = {'date': Least(F('date'), Value(date, output_field=models.DateField())),
+                   'securityPending': True,
+                   'accountPending': True,
+                   'changed': timezone.now()}
+        if self.get_queryset().filter(**key).update(**changes) == 0:
+            try:
+                with transaction.atomic():
+                    self.create(date=date, changed=changes['changed'], **key)
+            except IntegrityError:
+                # created concurrently
+                self.get_queryset().filter(**key).update(**changes)
+
+    def markSecurity(self, securityID, date):
+        # record that valuations of all positions in the security are out of
+        # date from date on, e.g. since its historical prices changed
+        for ownerID, accountID in Position.objects.filter(security_id=securityID) \
+                                                  .values_list('owner_id', 'account_id'):
+            self.mark(ownerID, accountID, securityID, date)
+
+class DirtyRange(models.Model):
+    # models the earliest date from which valuations of a position (owner,
+    # account and security) are out of date due to transactions saved or
+    # deleted or prices stored; written by signal handlers and when prices
+    # are stored, consumed by the valuation engine for securities and
+    # accounts separately
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              on_delete = models.DO_NOTHING,
+                              db_constraint = False,
+                              related_name = '+')
+    account = models.ForeignKey(Account,
+                                on_delete = models.DO_NOTHING,
+                                db_constraint = False,
+                                related_name = '+')
+    security = models.ForeignKey(Security,
+                                 on_delete = models.DO_NOTHING,
+                                 db_constraint = False,
+                                 related_name = '+')
+    date = models.DateField('Out of date from')
+    securityPending = models.BooleanField('Security valuations out of date',
+                                          default = True)
+    accountPending = models.BooleanField('Account valuations out of date',
+                                         default = True)
+    changed = models.DateTimeField('Last changed')
+
+    objects = DirtyRangeManager()
+
+    class Meta:
+        unique_together = ('owner', 'account', 'security')
+
+    def __str__(self):
+        return "%s/%s/%s: %s" % (self.owner_id, self.account_id, self.security_id, self.date)
+
+class PositionQuerySet(models.QuerySet):
+    def owner(self, ownerID):
+        return self.filter(owner_id=ownerID)
+
+    def held(self):
+        # positions with securities (or value if not marked to market) left
+        return self.filter(Q(security__mark_to_market=True, num__gt=0) |
+                           Q(security__mark_to_market=False, cur_value__gt=0))
+
+    def restrict(self, securities = None, accounts = None, owner = None):
+        positions = self
+        if not owner is None:
+            positions = positions.owner(owner)
+        if not securities is None:
+            positions = positions.filter(security_id__in=securities)
+        if not accounts is None:
+            positions = positions.filter(account_id__in=accounts)
+        return positions
+
+class PositionManager(models.Manager):
+    def get_queryset(self):
+        return PositionQuerySet(self.model, using=self._db)
+
+    def owner(self, ownerID):
+        return self.get_queryset().owner(ownerID)
+
+    def held(self):
+        return self.get_queryset().held()
+
+    def restrict(self, securities = None, accounts = None, owner = None):
+        return self.get_queryset().restrict(securities, accounts, owner)
+
+    def add(self, ownerID, accountID, securityID, currency, num, curValue, baseValue, cost, count):
+        # add change due to transactions (count of them, negative if removed)
+        # to the position, which is removed once it has no transactions left
+        key = {'owner_id': ownerID, 'account_id': accountID, 'security_id': securityID}
+        changes = {'num': F('num') + num,
+                   'cur_value': F('cur_value') + curValue,
+                   'base_value': F('base_value') + baseValue,
+                   'cost': F('cost') + cost,
+                   'transactions': F('transactions') + count}
+        if self.get_queryset().filter(**key).update(**changes) == 0:
+            try:
+                with transaction.atomic():
+                    self.create(num=num,
+                                cur_value=Money(curValue, currency),
+                                base_value=Money(baseValue, currency),
+                                cost=Money(cost, currency),
+                                transactions=count,
+                                **key)
+            except IntegrityError:
+                # created concurrently
+                self.get_queryset().filter(**key).update(**changes)
+        self.get_queryset().filter(transactions__lte=0, **key).delete()
+
+class Position(models.Model):
+    # models the current holdings of a security in an account of an owner,
+    # kept up to date whenever transactions are saved or deleted (see
+    # signals) instead of summing all transactions; values are in the
+    # currency of the security
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              on_delete = models.CASCADE)
+    account = models.ForeignKey(Account,
+                                on_delete = models.CASCADE)
+    security = models.ForeignKey(Security,
+                                 on_delete = models.CASCADE)
+    num = models.DecimalField('number of securities held',
+                              max_digits = 13,
+                              decimal_places = 5,
+                              default = 0)
+    cur_value = MoneyField('Current value if not marked to market',
+                           max_digits = 10,
+                           decimal_places = 2,
+                           default_currency='EUR')
+    base_value = MoneyField('Base value based on in- and outflows',
+                            max_digits = 10,
+                            decimal_places = 2,
+                            default_currency='EUR')
+    cost = MoneyField('Paid for securities bought',
+                      max_digits = 10,
+                      decimal_places = 2,
+                      default_currency='EUR')
+    transactions = models.IntegerField('Number of transactions',
+                                       default = 0)
+
+    objects = PositionManager()
+
+    class Meta:
+        unique_together = ('owner', 'account', 'security')
+
+    def __str__(self):
+        return "%s (%s): %s" % (self.security.name, self.account.name, self.num)
+
+class ValuationRefreshQuerySet(models.QuerySet):
+    def owner(self, ownerID):
+        return self.filter(owner_id=ownerID)
+
+    def mostStale(self):
+        # refreshed longest ago (or never) first
+        return self.order_by(F('refreshed').asc(nulls_first=True), 'id')
+
+class ValuationRefreshManager(models.Manager):
+    def get_queryset(self):
+        return ValuationRefreshQuerySet(self.model, using=self._db)
+
+    def owner(self, ownerID):
+        return self.get_queryset().owner(ownerID)
+
+    def schedule(self, kind, ownerID, ids):
+        # make sure there is a record for each security (or account) id of
+        # the owner, new ones count as never refreshed
+        field = 'security_id' if kind == ValuationJob.SECURITY else 'account_id'
+        existing = set(self.get_queryset().filter(kind=kind, owner_id=ownerID)
+                                          .values_list(field, flat=True))
+        self.bulk_create([self.model(kind=kind, owner_id=ownerID, **{field: i})
+                          for i in sorted(set(ids) - existing)])
+
+    def mostStale(self, kind, ownerID, ids, n):
+        # records of the n securities (or accounts) of the given ids
+        # refreshed longest ago and last refresh times of all of them
+        self.schedule(kind, ownerID, ids)
+        field = 'security_id' if kind == ValuationJob.SECURITY else 'account_id'
+        refreshes = self.get_queryset().filter(kind=kind, owner_id=ownerID, **{field + '__in': ids}).mostStale()
+        return (list(refreshes.select_related('security', 'account')[:n]),
+                list(refreshes.values_list('refreshed', flat=True)))
+
+    def refreshed(self, job):
+        # note time valuations were refreshed by a finished job
+        refreshes = self.get_queryset().filter(kind=job.kind)
+        if job.owner_id is not None:
+            refreshes = refreshes.owner(job.owner_id)
+        if job.security_id is not None:
+            refreshes = refreshes.filter(security_id=job.security_id)
+        if job.account_id is not None:
+            refreshes = refreshes.filter(account_id=job.account_id)
+        refreshes.update(refreshed=job.finished)
+
+class ValuationRefresh(models.Model):
+    # models when the valuations of a security of an owner (or of an
+    # account) were last refreshed, to refresh the most stale ones first
+    kind = models.CharField('kind of valuations',
+                            max_length = 2,
+                            choices = ValuationJob.JOB_KIND_CHOICES)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              on_delete=models.CASCADE)
+    security = models.ForeignKey(Security,
+                                 null = True,
+                                 blank = True,
+                                 on_delete = models.CASCADE)
+    account = models.ForeignKey(Account,
+                                null = True,
+                                blank = True,
+                                on_delete = models.CASCADE)
+    refreshed = models.DateTimeField('Last refresh',
+                                     null = True,
+                                     blank = True)
+
+    objects = ValuationRefreshManager()
+
+    class Meta:
+        index_together = [('kind', 'owner', 'refreshed')]
+
+    def __str__(self):
+        return "%s (%s/%s/%s): %s" % (self.get_kind_display(), self.owner_id, self.security_id,
+                                      self.account_id, self.refreshed)
+
 class ExchangeUSDToEURQuerySet(models.QuerySet):
     def date(self,date):
         return self.filter(date__lte=date)
@@ -0,0 +1,83 @@
+# Performance summary for several valuation query sets (e.g. the total and one
+# per security kind): all valuation series are loaded up front, the solver work
+# for each series can then run in a pool of worker processes
+#
+# The pool is off unless PERFORMANCE_WORKERS is set. Its workers are started
+# with PERFORMANCE_START_METHOD, 'spawn' by default: forking the web server
+# process would copy its threads, locks and database connections into the
+# workers, which is only safe in single-threaded servers that do not share
+# connections ('fork' may be used there to save start up time).
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from sys import stderr
+
+import django
+from django.conf import settings
+
+from .models import historicalPeriods, seriesRatesOfReturn
+
+_executor = None
+_executorWorkers = None
+_executorLock = threading.Lock()
+
+def performanceWorkers():
+    # number of worker processes set in settings; None, 0 or 1 computes
+    # everything serially in the calling process
+    return getattr(settings, 'PERFORMANCE_WORKERS', None) or 1
+
+def getExecutor(workers):
+    # process pool is kept between requests to avoid start up cost, created
+    # once even with concurrent requests; workers set up Django themselves
+    # as they are spawned, not forked
+    global _executor, _executorWorkers
+    with _executorLock:
+        if _executor is None or _executorWorkers != workers:
+            shutdownPool()
+            context = multiprocessing.get_context(getattr(settings, 'PERFORMANCE_START_METHOD', 'spawn'))
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                            initializer=django.setup)
+            _executorWorkers = workers
+        return _executor
+
+def shutdownPool():
+    # callers hold _executorLock
+    global _executor, _executorWorkers
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+        _executorWorkers = None
+
+def shutdownExecutor():
+    with _executorLock:
+        shutdownPool()
+
+def seriesPerformance(series, periods, method):
+    # runs in worker process
+    return seriesRatesOfReturn([series], periods, method)[0]
+
+def getPerformanceSummary(valuationSets, periods = None, method = 'irr', workers = None):
+    # same result as models.getHistoricalRatesOfReturn, with one task per
+    # valuation query set; falls back to solving all series together in the
+    # calling process if there are not enough workers or the pool fails
+    if periods is None:
+        periods = historicalPeriods()
+    if workers is None:
+        workers = performanceWorkers()
+
+    # queries stay in this process
+    seriesList = [valuation.valuationSeries() for valuation in valuationSets]
+
+    if workers > 1 and len(seriesList) > 1:
+        try:
+            executor = getExecutor(workers)
+            futures = [executor.submit(seriesPerformance, series, periods, method)
+                       for series in seriesList]
+            return [f.result() for f in futures]
+        except (BrokenProcessPool, OSError) as e:
+            print("Worker pool failed, computing performance serially:", e, file=stderr)
+            shutdownExecutor()
+
+    return seriesRatesOfReturn(seriesList, periods, method)
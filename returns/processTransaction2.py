@@ -1,83 +1,364 @@
 from django.db import transaction
+from django.conf import settings
+from django.db.models import F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
+import logging
 from decimal import *
-from datetime import date
+from datetime import date, timedelta
+from sys import stderr
+from time import perf_counter
 from moneyed import Money, get_currency
-from .models import Security, Transaction, Account, HistValuation, Inflation, SecurityValuation, AccountValuation
-from .utilities import yearsago, last_day_of_month, mid_day_of_next_month
+from .models import Security, Transaction, Account, HistValuation, Inflation, SecurityValuation, AccountValuation, PositionValuation, \
+    DirtyRange, Position
+from .utilities import yearsago
+from .snapshots import getSnapshotCalendar
+
+logger = logging.getLogger(__name__)
+
+class ValuationWriter():
+    # collects valuation snapshots in memory and writes them in chunks using
+    # bulk_create and bulk_update instead of one update_or_create per record;
+    # compact skips updates of records whose values did not change (except
+    # the latest one of each series, its modification date is used to find
+    # changes), meant for dense snapshot calendars
+
+    def __init__(self, model, keyFields, batchSize = None, compact = False):
+        self.model = model
+        self.keyFields = keyFields
+        if batchSize is None:
+            batchSize = getattr(settings, 'VALUATION_BATCH_SIZE', 500)
+        self.batchSize = batchSize
+        self.compact = compact
+        self.rows = {}
+
+    def add(self, values, **key):
+        # later snapshots for the same key replace earlier ones
+        self.rows[tuple(key[f] for f in self.keyFields)] = (key, values)
+
+    def write(self, existing, deleteStale = False):
+        # existing: query set covering all records that may need an update,
+        # with deleteStale those not collected again are removed
+        start = perf_counter()
+
+        # map keys to primary keys of existing records (may not be unique)
+        pks = {}
+        stored = {}
+        compareFields = self.compareFields() if self.compact else []
+        n = len(self.keyFields) + 1
+        for r in existing.values_list('pk', *self.keyFields, *compareFields).iterator():
+            pks.setdefault(tuple(r[1:n]), []).append(r[0])
+            stored[r[0]] = tuple(r[n:])
+
+        if self.compact:
+            # latest date of each series (keys without date)
+            latest = {}
+            dateIndex = self.keyFields.index('date')
+            for k in self.rows:
+                series = k[:dateIndex] + k[dateIndex+1:]
+                latest[series] = max(latest.get(series, k[dateIndex]), k[dateIndex])
+
+        created = []
+        updated = []
+        unchanged = 0
+        for k, (key, values) in self.rows.items():
+            if k in pks:
+                for pk in pks[k]:
+                    if (self.compact and stored[pk] == self.comparable(values, compareFields)
+                            and latest[k[:dateIndex] + k[dateIndex+1:]] != k[dateIndex]):
+                        unchanged = unchanged + 1
+                    else:
+                        updated.append(self.model(pk=pk, **key, **values))
+            else:
+                created.append(self.model(**key, **values))
+
+        stale = []
+        if deleteStale:
+            for k, pk in pks.items():
+                if k not in self.rows:
+                    stale.extend(pk)
+            for i in range(0, len(stale), self.batchSize):
+                self.model.objects.filter(pk__in=stale[i:i+self.batchSize]).delete()
+
+        self.model.objects.bulk_create(created, batch_size=self.batchSize)
+        if updated:
+            fields = [f.name for f in self.model._meta.concrete_fields
+                      if f.name in self.fieldNames()]
+            self.model.objects.bulk_update(updated, fields, batch_size=self.batchSize)
+
+        elapsed = perf_counter() - start
+        stats = {'created': len(created),
+                 'updated': len(updated),
+                 'unchanged': unchanged,
+                 'deleted': len(stale),
+                 'seconds': elapsed,
+                 'rowsPerSecond': (len(created) + len(updated)) / elapsed if elapsed > 0 else 0.0}
+        logger.debug("Wrote %s records: %d created, %d updated, %d unchanged, %d deleted, %.0f rows/s",
+                     self.model.__name__, stats['created'], stats['updated'], stats['unchanged'],
+                     stats['deleted'], stats['rowsPerSecond'])
+        self.rows = {}
+        return stats
+
+    def compareFields(self):
+        # value fields compared in compact mode, all but the modification date
+        names = self.fieldNames()
+        return [f.name for f in self.model._meta.concrete_fields
+                if f.name in names and f.name != 'modifiedDate']
+
+    def comparable(self, values, compareFields):
+        # values as returned by values_list for compareFields, rounded like
+        # the database does
+        result = []
+        for name in compareFields:
+            if name.endswith('_currency'):
+                result.append(str(values[name[:-len('_currency')]].currency))
+                continue
+            value = values[name]
+            value = getattr(value, 'amount', value)
+            field = self.model._meta.get_field(name)
+            if getattr(field, 'decimal_places', None) is not None:
+                value = Decimal(value).quantize(Decimal(1).scaleb(-field.decimal_places))
+            result.append(value)
+        return tuple(result)
+
+    def fieldNames(self):
+        # names of value fields including currency fields of money fields
+        names = set()
+        for key, values in self.rows.values():
+            for name in values:
+                names.add(name)
+                names.add(name + '_currency')
+        return names
+
+def downsampleValuations(valuations, calendar):
+    # remove snapshots on dates that are no longer snapshot dates, i.e. those
+    # of the dense granularity that moved out of the dense period
+    if calendar.boundary is None:
+        return 0
+    dates = [d for d in valuations.filter(date__lte=calendar.boundary).order_by()
+                                  .values_list('date', flat=True).distinct()
+             if not calendar.isSnapshotDate(d)]
+    deleted = 0
+    batchSize = getattr(settings, 'VALUATION_BATCH_SIZE', 500)
+    for i in range(0, len(dates), batchSize):
+        deleted = deleted + valuations.filter(date__in=dates[i:i+batchSize]).delete()[0]
+    return deleted
+
+def firstDirtyDate(valuations, transactionList, calendar = None):
+    # earliest date from which stored valuations may be out of date, None if
+    # there are none; per security this is the first transaction modified
+    # since its valuations were last written, or for securities still held
+    # the last valuation written (period may not have been complete)
+    lastUpdates = {}
+    for v in valuations.values('security_id').annotate(lastModified=Max('modifiedDate'),
+                                                       lastDate=Max('date')):
+        lastUpdates[v['security_id']] = v
+
+    if not lastUpdates:
+        return None
+    if calendar is None:
+        calendar = getSnapshotCalendar()
+
+    dirtyDates = []
+    for v in lastUpdates.values():
+        if v['lastDate'] >= calendar.snapshotDate(v['lastModified']):
+            dirtyDates.append(v['lastDate'])
+    for securityId, d, modifiedDate in transactionList.values_list('security_id', 'date', 'modifiedDate').iterator():
+        if securityId not in lastUpdates or modifiedDate >= lastUpdates[securityId]['lastModified']:
+            dirtyDates.append(d)
+
+    if not dirtyDates:
+        return date.today()
+    return min(dirtyDates)
+
+def transactionEffect(t):
+    # change of number of securities, current value (if not marked to market)
+    # and base value due to a transaction
+    dNum = Decimal(0.0)
+    dCur = Decimal(0.0)
+    dBase = Decimal(0.0)
+
+    # treat accumulated interest or matched contributions separately
+    # also exclude write downs
+    # -cashflow b/c sign convention for cashflows
+    if not ((t.security.accumulate_interest and (t.kind == Transaction.INTEREST or t.kind == Transaction.MATCH))
+                or t.kind == Transaction.WRITE_DOWN):
+        dBase = -t.cashflow.amount
+
+    if t.security.mark_to_market:
+        dNum = t.num_transacted
+    # cashflow b/c sign convention for cashflows (always >0 for these)
+    elif t.security.accumulate_interest and (t.kind == Transaction.INTEREST or t.kind == Transaction.MATCH):
+        dCur = t.cashflow.amount
+    # -cashflow b/c sign convention for cashflows
+    elif not (t.kind == Transaction.INTEREST or t.kind == Transaction.MATCH):
+        dCur = -(t.cashflow.amount - t.tax.amount - t.expense.amount)
+
+    return dNum, dCur, dBase
+
+def transactionCost(t):
+    # amount paid for securities bought in a transaction
+    if t.kind == Transaction.BUY:
+        return -t.cashflow.amount
+    return Decimal(0.0)
 
 @transaction.atomic
-def updateSecurityValuation(owner, selectSecurityId = None):
-    # get date of last update of security valuations
-    try:
-        if selectSecurityId is not None:
-            lastUpdate = SecurityValuation.object.filter(security__id=selectSecurityId,owner=owner).order_by('-modifiedDate').last().modifiedDate
-        else:
-            lastUpdate = SecurityValuation.object.filter(owner=owner).order_by('-modifiedDate').last().modifiedDate
-    except:
-         lastUpdate = date(1900,1,1)
-    # find transactions that have been added since
-    if selectSecurityId is not None:
-        transactionList = Transaction.objects.filter(security__id=selectSecurityId,owner=owner,modifiedDate__gte=lastUpdate).order_by('date').select_related('security')
-    else:
-        transactionList = Transaction.objects.filter(owner=owner,modifiedDate__gte=lastUpdate).order_by('date').select_related('security')
+def rebuildPositions(ownerIds = None, transactionModel = Transaction, positionModel = Position):
+    # recompute the ledger of positions from all transactions (of the
+    # given owners), returns number of positions; migrations pass their
+    # historical models
+    transactionList = transactionModel._default_manager.select_related('security')
+    positions = positionModel._default_manager.all()
+    if ownerIds is not None:
+        transactionList = transactionList.filter(owner_id__in=ownerIds)
+        positions = positions.filter(owner_id__in=ownerIds)
+
+    sums = {}
+    for t in transactionList.iterator():
+        dNum, dCur, dBase = transactionEffect(t)
+        key = (t.owner_id, t.account_id, t.security_id)
+        if key not in sums:
+            sums[key] = [t.security.currency, Decimal(0.0), Decimal(0.0), Decimal(0.0), Decimal(0.0), 0]
+        p = sums[key]
+        p[1] = p[1] + dNum
+        p[2] = p[2] + dCur
+        p[3] = p[3] + dBase
+        p[4] = p[4] + transactionCost(t)
+        p[5] = p[5] + 1
+
+    positions.delete()
+    positionModel._default_manager.bulk_create(
+        [positionModel(owner_id=ownerId, account_id=accountId, security_id=securityId,
+                       num=num,
+                       cur_value=Money(curValue, currency),
+                       base_value=Money(baseValue, currency),
+                       cost=Money(cost, currency),
+                       transactions=count)
+         for (ownerId, accountId, securityId), (currency, num, curValue, baseValue, cost, count)
+         in sorted(sums.items())],
+        batch_size=getattr(settings, 'VALUATION_BATCH_SIZE', 500))
+    return len(sums)
 
+@transaction.atomic
+def updateSecurityValuation(owner, selectSecurityId = None, fullRebuild = False, positions = None, calendar = None):
+    # with positions (default ACCOUNT_VALUATION_FROM_POSITIONS setting) also
+    # store valuations per account and security, see rollUpAccountValuation;
+    # snapshots are stored on the dates of calendar (default from settings)
+    if positions is None:
+        positions = getattr(settings, 'ACCOUNT_VALUATION_FROM_POSITIONS', False)
     today = date.today()
+    if calendar is None:
+        calendar = getSnapshotCalendar(today)
+
+    # owner may be given as user or id
+    ownerId = getattr(owner, 'pk', owner)
+
+    started = timezone.now()
+    valuations = SecurityValuation.objects.filter(owner_id=ownerId)
+    positionValuations = PositionValuation.objects.filter(owner_id=ownerId)
+    transactionList = Transaction.objects.filter(owner_id=ownerId)
+    dirtyRanges = DirtyRange.objects.owner(ownerId).securityPending()
+    if selectSecurityId is not None:
+        valuations = valuations.filter(security_id=selectSecurityId)
+        positionValuations = positionValuations.filter(security_id=selectSecurityId)
+        transactionList = transactionList.filter(security_id=selectSecurityId)
+        dirtyRanges = dirtyRanges.filter(security_id=selectSecurityId)
+
+    # only recompute valuations from the first date affected by changes,
+    # starting from the valuations stored for the date before
+    if fullRebuild or (positions and not positionValuations.exists()):
+        dirtyDate = None
+    else:
+        dirtyDate = firstDirtyDate(valuations, transactionList, calendar)
+        # transactions deleted or moved are only known from dirty ranges
+        rangeDate = dirtyRanges.earliestDate()
+        if dirtyDate is not None and rangeDate is not None:
+            dirtyDate = min(dirtyDate, rangeDate)
+    if dirtyDate is not None:
+        seedDate = calendar.previousDate(dirtyDate)
+        transactionList = transactionList.filter(date__gt=seedDate)
+        latest = SecurityValuation.objects.filter(owner_id=ownerId, security=OuterRef('security'),
+                                                  date__lte=seedDate).order_by('-date').values('date')[:1]
+        seeds = valuations.filter(date=Subquery(latest))
+        latest = PositionValuation.objects.filter(owner_id=ownerId, security=OuterRef('security'),
+                                                  account=OuterRef('account'),
+                                                  date__lte=seedDate).order_by('-date').values('date')[:1]
+        positionSeeds = positionValuations.filter(date=Subquery(latest)) if positions else []
+    else:
+        seeds = []
+        positionSeeds = []
+    transactionList = transactionList.order_by('date').select_related('security')
 
     if transactionList.exists():
         transactionIterator = transactionList.iterator()
         endOfTransactionList = False
         previousTransactionNotProcessed = False
-        if transactionList.first().date.day > 15:
-            currentDate = last_day_of_month(transactionList.first().date)
-        else:
-            currentDate = transactionList.first().date.replace(day=15)
+        currentDate = calendar.snapshotDate(transactionList.first().date)
     else:
         endOfTransactionList = True
-        if today.day > 15:
-            currentDate = last_day_of_month(today)
-        else:
-            currentDate = today.replace(day=15)
-
-    # set up data structure
-    numSecurityObjects = Security.objects.order_by('id').last().id
-    securityActive = [False for i in range(numSecurityObjects+1)]
-    securityMtM = [False for i in range(numSecurityObjects+1)]
-    numSecurity = [Decimal(0.0) for i in range(numSecurityObjects+1)]
-    curValueSecurity = [Decimal(0.0) for i in range(numSecurityObjects+1)]
-    baseValueSecurity = [Decimal(0.0) for i in range(numSecurityObjects+1)]
-    lastUpdate = [False for i in range(numSecurityObjects+1)]
-    currencySecurity = ['' for i in range(numSecurityObjects+1)]
-
-    # populate using existing data
+        currentDate = calendar.lastDate()
+    if dirtyDate is not None:
+        currentDate = min(currentDate, calendar.snapshotDate(dirtyDate))
+
+    # set up data structure, state is only kept for securities that have
+    # valuations to start from or occur in transactions
+    securityActive = {}
+    numSecurity = {}
+    curValueSecurity = {}
+    baseValueSecurity = {}
+    lastUpdate = {}
+    securityMtM = {}
+    currencySecurity = {}
+
     if selectSecurityId is not None:
         listOfSecurities = Security.objects.filter(id=selectSecurityId)
     else:
         listOfSecurities = Security.objects.all()
     for s in listOfSecurities:
         sID = s.id
-        try:
-            secValuation = SecurityValuation.objects.filter(owner=owner, date__lte=lastUpdate, security=s).order_by('-date').first()
-            securityActive[sID] = True
-            numSecurity[sID] = secValuation.sum_num
-            curValueSecurity[sID] = secValuation.cur_value.amount
-            baseValueSecurity[sID] = secValuation.base_value.amount
-        except:
-            pass
-
         try:
             currencySecurity[sID] = s.currency
         except:
             currencySecurity[sID] = 'EUR'
-        if s.markToMarket == True:
-            securityMtM = True
+        securityMtM[sID] = s.mark_to_market
+
+    # populate using existing data, a security is held if its value is positive
+    for v in seeds:
+        sID = v.security_id
+        numSecurity[sID] = v.sum_num
+        curValueSecurity[sID] = v.cur_value.amount
+        baseValueSecurity[sID] = v.base_value.amount
+        lastUpdate[sID] = False
+        if securityMtM[sID]:
+            securityActive[sID] = numSecurity[sID] > 0.0
+        else:
+            securityActive[sID] = curValueSecurity[sID] > 0.0
+
+    # same for positions (account and security)
+    positionActive = {}
+    numPosition = {}
+    curValuePosition = {}
+    baseValuePosition = {}
+    for v in positionSeeds:
+        pID = (v.account_id, v.security_id)
+        numPosition[pID] = v.sum_num
+        curValuePosition[pID] = v.cur_value.amount
+        baseValuePosition[pID] = v.base_value.amount
+        if securityMtM[v.security_id]:
+            positionActive[pID] = numPosition[pID] > 0.0
+        else:
+            positionActive[pID] = curValuePosition[pID] > 0.0
 
-    if today.day > 15:
-        lastDay = last_day_of_month(today)
-        endOfMonth = True
-    else:
-        lastDay = today.replace(day=15)
-        endOfMonth = False
+    lastDay = calendar.lastDate()
+
+    # historical prices for mark to market valuations
+    prices = HistValuation.objects.priceIndex([s.id for s in listOfSecurities])
+
+    writer = ValuationWriter(SecurityValuation, ('date', 'security_id', 'owner_id'), compact=calendar.compact)
+    positionWriter = ValuationWriter(PositionValuation, ('date', 'account_id', 'security_id', 'owner_id'),
+                                     compact=calendar.compact)
+    firstDate = currentDate
 
     while currentDate <= lastDay:
 
@@ -99,43 +380,38 @@ def updateSecurityValuation(owner, selectSecurityId = None):
 
             # process current transaction record
             tSecurityId = t.security_id
+            if tSecurityId not in securityActive:
+                numSecurity[tSecurityId] = Decimal(0.0)
+                curValueSecurity[tSecurityId] = Decimal(0.0)
+                baseValueSecurity[tSecurityId] = Decimal(0.0)
+                lastUpdate[tSecurityId] = False
             securityActive[tSecurityId] = True
 
-            # update base value
-            # treat accumulated interest or matched contributions separately
-            # also exclude write downs
-            # -cashflow b/c sign convention for cashflows
-            if not ((t.security.accumulate_interest and (t.kind == Transaction.INTEREST or t.kind == Transaction.MATCH))
-                        or t.kind == Transaction.WRITE_DOWN):
-                baseValueSecurity[tSecurityId] = baseValueSecurity[tSecurityId] - t.cashflow.amount
+            # update number of securities, current and base value
+            dNum, dCur, dBase = transactionEffect(t)
+            numSecurity[tSecurityId] = numSecurity[tSecurityId] + dNum
+            curValueSecurity[tSecurityId] = curValueSecurity[tSecurityId] + dCur
+            baseValueSecurity[tSecurityId] = baseValueSecurity[tSecurityId] + dBase
 
-            # update number of securities
-            if t.security.mark_to_market:
-                numSecurity[tSecurityId] = numSecurity[tSecurityId] + t.num_transacted
-                securityMtM[tSecurityId] = True
-            # update current value
-            else:
-                # treat accumulated interest or matched contributions separate
-                # cashflow b/c sign convention for cashflows (always >0 for these)
-                if t.security.accumulate_interest and (t.kind == Transaction.INTEREST or t.kind == Transaction.MATCH):
-                    curValueSecurity[tSecurityId] = curValueSecurity[tSecurityId] + t.cashflow.amount
-                # -cashflow b/c sign convention for cashflows
-                elif not (t.kind == Transaction.INTEREST or t.kind == Transaction.MATCH):
-                    curValueSecurity[tSecurityId] = curValueSecurity[tSecurityId] - (t.cashflow.amount - t.tax.amount - t.expense.amount)
-            #print(t.date, currentDate, lastDay, baseValueSecurity[tSecurityId])
+            if positions:
+                pID = (t.account_id, tSecurityId)
+                positionActive[pID] = True
+                numPosition[pID] = numPosition.get(pID, Decimal(0.0)) + dNum
+                curValuePosition[pID] = curValuePosition.get(pID, Decimal(0.0)) + dCur
+                baseValuePosition[pID] = baseValuePosition.get(pID, Decimal(0.0)) + dBase
 
         # store information
-        for securityId in range(1,numSecurityObjects+1):
+        for securityId in sorted(securityActive):
             if securityActive[securityId] == True:
                 # update security value with market data if applicable
                 if securityMtM[securityId] == True:
                     # if all securities were sold, no longer need to update
                     if numSecurity[securityId] <= 0.0:
                         securityActive[securityId] = False
-                        curValueSecurity[securityId] = 0.0
+                        curValueSecurity[securityId] = Decimal(0.0)
                         lastUpdate[securityId] = True
                     else:
-                        curValueSecurity[securityId] = numSecurity[securityId] * (HistValuation.objects.getHistValuation(securityId, currentDate).amount)
+                        curValueSecurity[securityId] = numSecurity[securityId] * (prices.asOf(securityId, currentDate).amount)
                 else:
                     # if all securities were sold, no longer need to update
                     if curValueSecurity[securityId] <= 0.0:
@@ -143,95 +419,300 @@ def updateSecurityValuation(owner, selectSecurityId = None):
                         lastUpdate[securityId] = True
 
             if securityActive[securityId] == True or baseValueSecurity[securityId] != 0.0 or lastUpdate[securityId]:
-                # store information, update record if possible
-                s, created = SecurityValuation.objects.update_or_create(
-                    date = currentDate,
-                    security_id = securityId,
-                    owner = owner,
-                    defaults = {
+                # store information, record is updated if it exists
+                writer.add(
+                    {
                         'cur_value': Money(amount=curValueSecurity[securityId], currency=currencySecurity[securityId]),
                         'base_value': Money(amount=baseValueSecurity[securityId], currency=currencySecurity[securityId]),
                         'sum_num': numSecurity[securityId],
                         'modifiedDate': today
                     },
+                    date = currentDate,
+                    security_id = securityId,
+                    owner_id = ownerId,
                 )
                 lastUpdate[securityId] = False
 
-        # go to next date (15th of next month or last day of month)
-        if endOfMonth == True:
-            currentDate = mid_day_of_next_month(currentDate)
-            endOfMonth = False
-        else:
-            currentDate = last_day_of_month(currentDate)
-            endOfMonth = True
+        # positions are valued like securities in updateAccountValuation
+        for pID in sorted(positionActive):
+            accountId, securityId = pID
+            wasActive = positionActive[pID]
+            if positionActive[pID] == True or baseValuePosition[pID] != 0.0:
+                if securityMtM[securityId] == True:
+                    if numPosition[pID] <= 0.0:
+                        positionActive[pID] = False
+                        curValuePosition[pID] = Decimal(0.0)
+                    else:
+                        curValuePosition[pID] = numPosition[pID] * (prices.asOf(securityId, currentDate).amount)
+                elif curValuePosition[pID] <= 0.0:
+                    positionActive[pID] = False
+
+            # positions without value do not contribute to account valuation
+            if (wasActive or baseValuePosition[pID] != 0.0 or curValuePosition[pID] != 0.0
+                    or numPosition[pID] != 0.0):
+                positionWriter.add(
+                    {
+                        'cur_value': Money(amount=curValuePosition[pID], currency=currencySecurity[securityId]),
+                        'base_value': Money(amount=baseValuePosition[pID], currency=currencySecurity[securityId]),
+                        'sum_num': numPosition[pID],
+                        'modifiedDate': today
+                    },
+                    date = currentDate,
+                    account_id = accountId,
+                    security_id = securityId,
+                    owner_id = ownerId,
+                )
 
+        # go to next snapshot date
+        currentDate = calendar.nextDate(currentDate)
+
+    # write all snapshots at once, remove those no longer valid
+    stats = writer.write(valuations.filter(date__gte=firstDate), deleteStale=True)
+    stats['downsampled'] = downsampleValuations(valuations, calendar)
+    if positions:
+        stats['positions'] = positionWriter.write(positionValuations.filter(date__gte=firstDate),
+                                                  deleteStale=True)
+        stats['positions']['downsampled'] = downsampleValuations(positionValuations, calendar)
+    dirtyRanges.consumed('securityPending', started)
+    return stats
+
+def heldThroughout(transactions, startDate, calendar, markToMarket):
+    # True if the position made up by the transactions is held (positive
+    # number of securities or current value) on every snapshot date from
+    # startDate on, i.e. valuations exist and do not change status
+    effects = sorted((t.date, transactionEffect(t)) for t in transactions)
+    held = Decimal(0.0)
+    i = 0
+    currentDate = startDate
+    while currentDate <= calendar.lastDate():
+        while i < len(effects) and effects[i][0] <= currentDate:
+            dNum, dCur, dBase = effects[i][1]
+            held = held + (dNum if markToMarket else dCur)
+            i = i + 1
+        if held <= 0.0:
+            return False
+        currentDate = calendar.nextDate(currentDate)
+    return True
+
+def swapTransaction(transactions, old, new):
+    # transactions as they were before new replaced old
+    result = [t for t in transactions if new is None or t.pk != new.pk]
+    if old is not None:
+        result.append(old)
+    return result
+
+def applyTransactionDelta(valuations, t, sign, markToMarket, calendar, hasNum = True):
+    # add change due to transaction t (sign -1 to remove it) to all
+    # valuations from the date of the transaction on in a single UPDATE
+    dNum, dCur, dBase = transactionEffect(t)
+    dNum = sign * dNum
+    dCur = sign * dCur
+    dBase = sign * dBase
+    valuations = valuations.filter(date__gte=calendar.snapshotDate(t.date))
+    today = calendar.today
+    if markToMarket:
+        # value of securities at the last price known on the valuation date
+        price = Coalesce(Subquery(HistValuation.objects.filter(security_id=t.security_id, date__lte=OuterRef('date'))
+                                  .order_by('-date').values('value')[:1]),
+                         Value(Decimal(0.0)))
+        if hasNum:
+            # cur_value first since MySQL uses already updated columns in later assignments
+            return valuations.update(cur_value=(F('sum_num') + dNum) * price,
+                                     sum_num=F('sum_num') + dNum,
+                                     base_value=F('base_value') + dBase,
+                                     modifiedDate=today)
+        return valuations.update(cur_value=F('cur_value') + dNum * price,
+                                 base_value=F('base_value') + dBase,
+                                 modifiedDate=today)
+    return valuations.update(cur_value=F('cur_value') + dCur,
+                             base_value=F('base_value') + dBase,
+                             modifiedDate=today)
+
+class DeltaNotApplicable(Exception):
+    pass
+
+def propagateTransactionChange(old = None, new = None):
+    # update stored security, position and account valuations for a single
+    # added (old None), edited or deleted (new None) transaction with a few
+    # UPDATE statements instead of replaying transactions; new has to be
+    # saved (or old deleted) already; returns False without changing
+    # anything if the status of a position would change (bought for the
+    # first time, sold completely), a rebuild is needed then
+    changes = [(t, sign) for t, sign in [(old, -1), (new, 1)] if t is not None]
+    calendar = getSnapshotCalendar(date.today())
+    try:
+        with transaction.atomic():
+            for t, sign in changes:
+                markToMarket = t.security.mark_to_market
+                startDate = calendar.snapshotDate(min(c.date for c, s in changes))
+
+                # security valuations of owner
+                transactions = list(Transaction.objects.filter(owner_id=t.owner_id, security_id=t.security_id)
+                                                       .select_related('security'))
+                for ts in [transactions, swapTransaction(transactions, old, new)]:
+                    if not heldThroughout(ts, startDate, calendar, markToMarket):
+                        raise DeltaNotApplicable()
+                applyTransactionDelta(SecurityValuation.objects.filter(owner_id=t.owner_id, security_id=t.security_id),
+                                      t, sign, markToMarket, calendar)
+
+                # position valuations, if stored
+                positionValuations = PositionValuation.objects.filter(owner_id=t.owner_id, account_id=t.account_id,
+                                                                      security_id=t.security_id)
+                if positionValuations.exists():
+                    transactions = [p for p in transactions if p.account_id == t.account_id]
+                    for ts in [transactions, swapTransaction(transactions, old, new)]:
+                        if not heldThroughout(ts, startDate, calendar, markToMarket):
+                            raise DeltaNotApplicable()
+                    applyTransactionDelta(positionValuations, t, sign, markToMarket, calendar)
+
+                # account valuations, values of positions not marked to
+                # market are included whether held or not
+                accountValuations = AccountValuation.objects.filter(account_id=t.account_id)
+                first = accountValuations.order_by('date').first()
+                if first is None:
+                    continue
+                if first.date > startDate or str(first.cur_value.currency) != t.security.currency:
+                    raise DeltaNotApplicable()
+                if markToMarket:
+                    transactions = list(Transaction.objects.filter(account_id=t.account_id, security_id=t.security_id)
+                                                           .select_related('security'))
+                    for ts in [transactions, swapTransaction(transactions, old, new)]:
+                        if not heldThroughout(ts, startDate, calendar, markToMarket):
+                            raise DeltaNotApplicable()
+                applyTransactionDelta(accountValuations, t, sign, markToMarket, calendar, hasNum=False)
+    except DeltaNotApplicable:
+        return False
+    return True
 
 @transaction.atomic
-def updateAccountValuation(selectAccountId = None):
-    # get date of last update of account valuations
-    try:
-        if selectAccountId is not None:
-            lastUpdate = AccountValuation.object.filter(account__id=selectAccountId).order_by('-modifiedDate').last().modifiedDate
-        else:
-            lastUpdate = AccountValuation.object.order_by('-modifiedDate').last().modifiedDate
-    except:
-         lastUpdate = date(1900,1,1)
-    # find transactions that have been added since
+def rollUpAccountValuation(selectAccountId = None, calendar = None):
+    # account valuations as sum of the position valuations stored by
+    # updateSecurityValuation, aggregated in the database per account, date
+    # and currency; accounts are valued up to today once they hold a position
+    started = timezone.now()
+    positionValuations = PositionValuation.objects.all()
+    dirtyRanges = DirtyRange.objects.accountPending()
     if selectAccountId is not None:
-        transactionList = Transaction.objects.filter(modifiedDate__gte=lastUpdate,account__id = selectAccountId).order_by('date').select_related('security')
-    else:
-        transactionList = Transaction.objects.filter(modifiedDate__gte=lastUpdate).order_by('date').select_related('security')
+        positionValuations = positionValuations.filter(account_id=selectAccountId)
+        dirtyRanges = dirtyRanges.filter(account_id=selectAccountId)
+    sums = positionValuations.values('account_id', 'date', 'cur_value_currency') \
+                             .annotate(sumCurValue=Sum('cur_value'), sumBaseValue=Sum('base_value')) \
+                             .order_by('account_id', 'date')
 
     today = date.today()
+    if calendar is None:
+        calendar = getSnapshotCalendar(today)
+    lastDay = calendar.lastDate()
+    currencyAccount = dict(Account.objects.values_list('id', 'currency'))
+
+    valuations = {}
+    mixedCurrency = set()
+    for v in sums.iterator():
+        accountId = v['account_id']
+        if v['cur_value_currency'] != currencyAccount[accountId]:
+            mixedCurrency.add(accountId)
+        valuations.setdefault(accountId, []).append((v['date'], v['sumCurValue'], v['sumBaseValue']))
+
+    writer = ValuationWriter(AccountValuation, ('date', 'account_id'), compact=calendar.compact)
+    for accountId, rows in valuations.items():
+        if accountId in mixedCurrency:
+            print("Error: securities in account", accountId, "not in account currency", file=stderr)
+            continue
+        currency = currencyAccount[accountId]
+        # fill dates without positions with zero value
+        i = 0
+        currentDate = rows[0][0]
+        while currentDate <= lastDay:
+            curValue = Decimal(0.0)
+            baseValue = Decimal(0.0)
+            if i < len(rows) and rows[i][0] == currentDate:
+                curValue = rows[i][1]
+                baseValue = rows[i][2]
+                i = i + 1
+            writer.add(
+                {
+                    'cur_value': Money(amount=curValue, currency=currency),
+                    'base_value': Money(amount=baseValue, currency=currency),
+                    'modifiedDate': today
+                },
+                date = currentDate,
+                account_id = accountId,
+            )
+            currentDate = calendar.nextDate(currentDate)
+
+    # accounts without positions left (all transactions deleted) lose
+    # their valuations too
+    accounts = set(valuations) | set(dirtyRanges.values_list('account_id', flat=True))
+    existing = AccountValuation.objects.filter(account_id__in=[a for a in accounts if a not in mixedCurrency])
+    stats = writer.write(existing, deleteStale=True)
+    stats['downsampled'] = downsampleValuations(AccountValuation.objects.filter(account_id__in=accounts), calendar)
+    # positions not recomputed yet remain pending for accounts as well
+    dirtyRanges.filter(securityPending=False).exclude(account_id__in=mixedCurrency) \
+               .consumed('accountPending', started)
+    return stats
+
+@transaction.atomic
+def updateAccountValuation(selectAccountId = None, rollUp = None, calendar = None):
+    # with rollUp (default ACCOUNT_VALUATION_FROM_POSITIONS setting) aggregate
+    # stored position valuations instead of replaying all transactions
+    if rollUp is None:
+        rollUp = getattr(settings, 'ACCOUNT_VALUATION_FROM_POSITIONS', False)
+    if rollUp:
+        return rollUpAccountValuation(selectAccountId, calendar)
+    today = date.today()
+    if calendar is None:
+        calendar = getSnapshotCalendar(today)
+
+    started = timezone.now()
+    dirtyRanges = DirtyRange.objects.accountPending()
+    if selectAccountId is not None:
+        dirtyRanges = dirtyRanges.filter(account_id=selectAccountId)
+
+    # account valuations are recomputed from the first transaction of the
+    # accounts on, dirty ranges add accounts whose transactions were deleted
+    if selectAccountId is not None:
+        transactionList = Transaction.objects.filter(account__id = selectAccountId).order_by('date').select_related('security')
+    else:
+        transactionList = Transaction.objects.order_by('date').select_related('security')
 
     if transactionList.exists():
         transactionIterator = transactionList.iterator()
         endOfTransactionList = False
         previousTransactionNotProcessed = False
-        if transactionList.first().date.day > 15:
-            currentDate = last_day_of_month(transactionList.first().date)
-        else:
-            currentDate = transactionList.first().date.replace(day=15)
+        currentDate = calendar.snapshotDate(transactionList.first().date)
 
     else:
-        endOfTransactionList = False
-        if today.day > 15:
-            currentDate = last_day_of_month(today.date)
-        else:
-            currentDate = today.replace(day=15)
+        endOfTransactionList = True
+        currentDate = calendar.lastDate()
+    rangeDate = dirtyRanges.earliestDate()
+    if rangeDate is not None:
+        currentDate = min(currentDate, calendar.snapshotDate(rangeDate))
 
-    # construct list of all accounts that require updating
-    relevantAccounts = list(set(transactionList.values_list('account_id', flat=True).order_by('account_id')))
+    # construct list of all accounts that require updating, including those
+    # with transactions deleted
+    relevantAccounts = list(set(transactionList.values_list('account_id', flat=True).order_by('account_id'))
+                            | set(dirtyRanges.values_list('account_id', flat=True)))
 
     # construct list of all required transactions
     transactionList = Transaction.objects.filter(account_id__in=relevantAccounts).order_by('date')
 
-    # set up data structure
-    numSecurityObjects = Security.objects.order_by('id').last().id
-    numAccountObjects = Account.objects.order_by('id').last().id
-    accountActive = [False for i in range(numAccountObjects+1)]
-    securityActive = [False for i in range(numSecurityObjects*numAccountObjects+1)]
-    securityEverActive = [False for i in range(numSecurityObjects*numAccountObjects+1)]
-    securityMtM = [False for i in range(numSecurityObjects+1)]
-    numSecurity = [Decimal(0.0) for i in range(numSecurityObjects*numAccountObjects+1)]
-    curValueSecurity = [Decimal(0.0) for i in range(numSecurityObjects*numAccountObjects+1)]
-    baseValueSecurity = [Decimal(0.0) for i in range(numSecurityObjects*numAccountObjects+1)]
-    currencySecurity = ['' for i in range(numSecurityObjects+1)]
-    for s in Security.objects.all():
-        currencySecurity[s.id] = s.currency
-    currencyAccount = ['' for i in range(numAccountObjects+1)]
-    for a in Account.objects.all():
-       currencyAccount[a.id] = a.currency
-
-    curValueAccount = [Decimal(0.0) for i in range(numAccountObjects+1)]
-    baseValueAccount = [Decimal(0.0) for i in range(numAccountObjects+1)]
-
-    if today.day > 15:
-        lastDay = last_day_of_month(today)
-        endOfMonth = True
-    else:
-        lastDay = today.replace(day=15)
-        endOfMonth = False
+    # set up data structure, state is only kept for positions (account and
+    # security) that occur in transactions
+    accountActive = set()
+    positionsOfAccount = {}
+    securityActive = {}
+    securityMtM = {}
+    numSecurity = {}
+    curValueSecurity = {}
+    baseValueSecurity = {}
+    currencySecurity = dict(Security.objects.values_list('id', 'currency'))
+    currencyAccount = dict(Account.objects.values_list('id', 'currency'))
+
+    lastDay = calendar.lastDate()
+
+    prices = HistValuation.objects.priceIndex(Security.objects.markToMarket().values_list('id', flat=True))
+    writer = ValuationWriter(AccountValuation, ('date', 'account_id'), compact=calendar.compact)
+    firstDate = currentDate
 
     while currentDate <= lastDay:
 
@@ -253,91 +734,77 @@ def updateAccountValuation(selectAccountId = None):
             # process current transaction record
             tSecurityId = t.security_id
             tAccountId = t.account_id
-            tPosition = tSecurityId + (tAccountId-1)*numSecurityObjects
+            tPosition = (tAccountId, tSecurityId)
+            if tPosition not in securityActive:
+                positionsOfAccount.setdefault(tAccountId, []).append(tSecurityId)
+                positionsOfAccount[tAccountId].sort()
+                numSecurity[tPosition] = Decimal(0.0)
+                curValueSecurity[tPosition] = Decimal(0.0)
+                baseValueSecurity[tPosition] = Decimal(0.0)
             securityActive[tPosition] = True
-            securityEverActive[tPosition] = True
-            accountActive[tAccountId] = True
-
-            # update base value
-            # treat accumulated interest or matched contributions separately
-            # also exclude write downs
-            # -cashflow b/c sign convention for cashflows
-            if not ((t.security.accumulate_interest and (t.kind == Transaction.INTEREST or t.kind == Transaction.MATCH))
-                        or t.kind == Transaction.WRITE_DOWN):
-                baseValueSecurity[tPosition] = baseValueSecurity[tPosition] - t.cashflow.amount
-
-            # update number of securities
+            accountActive.add(tAccountId)
             if t.security.mark_to_market:
-                numSecurity[tPosition] = numSecurity[tPosition] + t.num_transacted
                 securityMtM[tSecurityId] = True
-            # update current value
-            else:
-                # treat accumulated interest or matched contributions separate
-                # cashflow b/c sign convention for cashflows (always >0 for these)
-                if t.security.accumulate_interest and (t.kind == Transaction.INTEREST or t.kind == Transaction.MATCH):
-                    curValueSecurity[tPosition] = curValueSecurity[tPosition] + t.cashflow.amount
-                # -cashflow b/c sign convention for cashflows
-                elif not (t.kind == Transaction.INTEREST or t.kind == Transaction.MATCH):
-                    curValueSecurity[tPosition] = curValueSecurity[tPosition] - (t.cashflow.amount - t.tax.amount - t.expense.amount)
 
+            # update number of securities, current and base value
+            dNum, dCur, dBase = transactionEffect(t)
+            numSecurity[tPosition] = numSecurity[tPosition] + dNum
+            curValueSecurity[tPosition] = curValueSecurity[tPosition] + dCur
+            baseValueSecurity[tPosition] = baseValueSecurity[tPosition] + dBase
 
         # store information
-        # loop over accounts
-        for accountId in range(1,numAccountObjects+1):
-            # check if account is active
-            if accountActive[accountId] == True:
-                curValueAccount[accountId] = Money(amount=0.0, currency=currencyAccount[accountId])
-                baseValueAccount[accountId] = Money(amount=0.0, currency=currencyAccount[accountId])
-
-                # loop over securities
-                for securityId in range(1,numSecurityObjects+1):
-                    positionId = securityId + (accountId-1)*numSecurityObjects
-                    # only need to do sth for active objects or those with non-zero base value
-                    if securityActive[positionId] == True or baseValueSecurity[positionId] != 0.0:
-                        # update security value with market data if applicable
-                        if securityMtM[securityId] == True:
-                            # if all securities were sold, no longer need to update
-                            if numSecurity[positionId] <= 0.0:
-                                securityActive[positionId] = False
-                                curValueSecurity[positionId] = 0.0
-                            else:
-                                curValueSecurity[positionId] = numSecurity[positionId] * (HistValuation.objects.getHistValuation(securityId, currentDate).amount)
+        # loop over accounts with transactions
+        for accountId in sorted(accountActive):
+            curValueAccount = Money(amount=0.0, currency=currencyAccount[accountId])
+            baseValueAccount = Money(amount=0.0, currency=currencyAccount[accountId])
+
+            # loop over securities ever held in account
+            for securityId in positionsOfAccount[accountId]:
+                positionId = (accountId, securityId)
+                # only need to update active objects or those with non-zero base value
+                if securityActive[positionId] == True or baseValueSecurity[positionId] != 0.0:
+                    # update security value with market data if applicable
+                    if securityMtM.get(securityId) == True:
+                        # if all securities were sold, no longer need to update
+                        if numSecurity[positionId] <= 0.0:
+                            securityActive[positionId] = False
+                            curValueSecurity[positionId] = Decimal(0.0)
                         else:
-                            # if all securities were sold, no longer need to update
-                            if curValueSecurity[positionId] <= 0.0:
-                                securityActive[positionId] = False
-
-                        curValueAccount[accountId] = curValueAccount[accountId] + Money(amount=curValueSecurity[positionId],
-                                                                                        currency=currencySecurity[securityId])
-                        baseValueAccount[accountId] = baseValueAccount[accountId] + Money(amount=baseValueSecurity[positionId],
-                                                                                          currency=currencySecurity[securityId])
-                    elif securityEverActive[positionId] == True:
-                        curValueAccount[accountId] = curValueAccount[accountId] + Money(amount=curValueSecurity[positionId],
-                                                                                        currency=currencySecurity[securityId])
-                        baseValueAccount[accountId] = baseValueAccount[accountId] + Money(amount=baseValueSecurity[positionId],
-                                                                                          currency=currencySecurity[securityId])
-                    #if accountId == 8:
-                    #    print(currentDate, accountId, securityId, curValueAccount, baseValueAccount)
-
-            if accountActive[accountId] == True or baseValueAccount[accountId] != 0.0:
-                # store information, update record if possible
-                s, created = AccountValuation.objects.update_or_create(
-                    date = currentDate,
-                    account_id = accountId,
-                    defaults = {
-                        'cur_value': curValueAccount[accountId],
-                        'base_value': baseValueAccount[accountId],
-                        'modifiedDate': today
-                    },
-                )
-
-        # go to next date (15th of next month or last day of month)
-        if endOfMonth == True:
-            currentDate = mid_day_of_next_month(currentDate)
-            endOfMonth = False
-        else:
-            currentDate = last_day_of_month(currentDate)
-            endOfMonth = True
+                            curValueSecurity[positionId] = numSecurity[positionId] * (prices.asOf(securityId, currentDate).amount)
+                    else:
+                        # if all securities were sold, no longer need to update
+                        if curValueSecurity[positionId] <= 0.0:
+                            securityActive[positionId] = False
+
+                curValueAccount = curValueAccount + Money(amount=curValueSecurity[positionId],
+                                                          currency=currencySecurity[securityId])
+                baseValueAccount = baseValueAccount + Money(amount=baseValueSecurity[positionId],
+                                                            currency=currencySecurity[securityId])
+
+            # store information, record is updated if it exists
+            writer.add(
+                {
+                    'cur_value': curValueAccount,
+                    'base_value': baseValueAccount,
+                    'modifiedDate': today
+                },
+                date = currentDate,
+                account_id = accountId,
+            )
+
+        # go to next snapshot date
+        currentDate = calendar.nextDate(currentDate)
+
+    # write all snapshots at once, accounts replayed lose valuations no
+    # longer backed by transactions
+    existing = AccountValuation.objects.filter(date__gte=firstDate, account_id__in=relevantAccounts)
+    if selectAccountId is not None:
+        existing = existing.filter(account_id=selectAccountId)
+    stats = writer.write(existing, deleteStale=True)
+    stats['downsampled'] = downsampleValuations(AccountValuation.objects.filter(account_id__in=relevantAccounts),
+                                                calendar)
+    dirtyRanges.consumed('accountPending', started)
+    return stats
 
 def makePieChartSegPerf(segPerf):
 # Prepare data for pie chart
@@ -0,0 +1,149 @@
+# Cache for rate of return results, keyed by a fingerprint of the cashflows
+# (day offsets and amounts) so that unchanged valuations are not solved again
+
+from collections import OrderedDict
+from hashlib import sha1
+
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .calc import solveMultiple
+
+# stored for series without a rate of return, to not solve them again
+NO_RATE = 'none'
+
+class LocalBackend():
+    # in-process cache with least recently used eviction
+
+    def __init__(self, maxSize=4096):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        except KeyError:
+            return None
+
+    def set(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+class DjangoCacheBackend():
+    # uses Django's cache framework; size and eviction are set by the cache
+    # configuration (the default local memory cache evicts least recently
+    # used); the cache may be shared with other apps, so it cannot be cleared,
+    # entries expire with timeout
+
+    def __init__(self, alias='default', timeout=None, prefix='rate-of-return:'):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.cache.set(self.prefix + key, value, self.timeout)
+
+class RateCache():
+    # memoizes rates of return in front of the solver and counts hits and misses
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, solver, method='hybrid'):
+        # hash of the cashflows, independent of the order they were added in
+        days, amounts = solver.cashflowArrays()
+        order = np.argsort(days, kind='stable')
+        h = sha1(method.encode())
+        h.update(np.ascontiguousarray(days[order]).tobytes())
+        h.update(np.ascontiguousarray(amounts[order]).tobytes())
+        return h.hexdigest()
+
+    def lookup(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses = self.misses + 1
+        else:
+            self.hits = self.hits + 1
+        return value
+
+    def rateOfReturn(self, solver, method='hybrid', guess=None):
+        # cached version of solver.calcRateOfReturn
+        if not solver.numCashflows():
+            raise RuntimeError('Empty list')
+        key = self.fingerprint(solver, method)
+        rate = self.lookup(key)
+        if rate is None:
+            try:
+                rate = solver.calcRateOfReturn(method=method, guess=guess)
+            except RuntimeError:
+                self.backend.set(key, NO_RATE)
+                raise
+            self.backend.set(key, rate)
+        else:
+            solver.evaluations = 0
+            if rate == NO_RATE:
+                raise RuntimeError('No rate of return (cached)')
+        return rate
+
+    def solveMultiple(self, solvers):
+        # cached version of calc.solveMultiple, only misses are solved
+        rates = [None for s in solvers]
+        keys = {}
+        missing = []
+        for i, s in enumerate(solvers):
+            if not s.numCashflows():
+                continue
+            keys[i] = self.fingerprint(s)
+            rate = self.lookup(keys[i])
+            if rate is None:
+                missing.append(i)
+            elif rate != NO_RATE:
+                rates[i] = rate
+                s.evaluations = 0
+
+        if missing:
+            solved = solveMultiple([solvers[i] for i in missing])
+            for i, rate in zip(missing, solved):
+                rates[i] = rate
+                self.backend.set(keys[i], NO_RATE if rate is None else rate)
+
+        return rates
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / total if total > 0 else 0.0}
+
+    def clear(self):
+        # drops cached rates if the backend allows it and resets the counters
+        if hasattr(self.backend, 'clear'):
+            self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+_rateCache = None
+
+def getRateCache():
+    # rate cache with backend set up according to settings
+    global _rateCache
+    if _rateCache is None:
+        backend = getattr(settings, 'RATE_CACHE_BACKEND', 'local')
+        if backend == 'django':
+            _rateCache = RateCache(DjangoCacheBackend(getattr(settings, 'RATE_CACHE_ALIAS', 'default')))
+        else:
+            _rateCache = RateCache(LocalBackend(getattr(settings, 'RATE_CACHE_SIZE', 4096)))
+    return _rateCache
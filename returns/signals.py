@@ -0,0 +1,41 @@
+# Record which valuations are out of date whenever transactions are saved or
+# deleted, see DirtyRange, and keep the ledger of positions up to date;
+# connected in ReturnsConfig.ready
+
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Transaction, DirtyRange, Position
+from .processTransaction2 import transactionEffect, transactionCost
+
+def applyToLedger(t, sign):
+    # add (sign 1) or remove (sign -1) transaction t to its position
+    dNum, dCur, dBase = transactionEffect(t)
+    Position.objects.add(t.owner_id, t.account_id, t.security_id, t.security.currency,
+                         sign * dNum, sign * dCur, sign * dBase, sign * transactionCost(t), sign)
+
+@receiver(pre_save, sender=Transaction)
+def markPreviousTransaction(sender, instance, **kwargs):
+    # an edited transaction may have moved to another position or date,
+    # its previous state is removed from the ledger after saving
+    instance._previous = None
+    if instance.pk is None:
+        return
+    previous = Transaction.objects.select_related('security').filter(pk=instance.pk).first()
+    if previous is not None:
+        DirtyRange.objects.mark(previous.owner_id, previous.account_id, previous.security_id, previous.date)
+        instance._previous = previous
+
+@receiver(post_save, sender=Transaction)
+def markTransaction(sender, instance, **kwargs):
+    DirtyRange.objects.mark(instance.owner_id, instance.account_id, instance.security_id, instance.date)
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        applyToLedger(previous, -1)
+    applyToLedger(instance, 1)
+    instance._previous = None
+
+@receiver(post_delete, sender=Transaction)
+def markDeletedTransaction(sender, instance, **kwargs):
+    DirtyRange.objects.mark(instance.owner_id, instance.account_id, instance.security_id, instance.date)
+    applyToLedger(instance, -1)
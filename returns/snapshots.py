@@ -0,0 +1,108 @@
+# Calendar of the dates on which valuation snapshots are stored
+#
+# The granularity (daily, weekly, half-monthly or monthly) is set with
+# VALUATION_GRANULARITY. With VALUATION_DENSE_DAYS set, only the most recent
+# days use it, older snapshots use the coarser VALUATION_COARSE_GRANULARITY
+# and are downsampled to it as time goes by.
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from .utilities import last_day_of_month, end_of_week
+
+def halfMonthDate(any_day):
+    # valuation date (15th or last day of month) of the period containing any_day
+    if any_day.day > 15:
+        return last_day_of_month(any_day)
+    else:
+        return any_day.replace(day=15)
+
+# per granularity: snapshot date of the period containing a day and first
+# day of the period of a snapshot date
+GRANULARITIES = {
+    'daily': (lambda d: d, lambda d: d),
+    'weekly': (end_of_week, lambda d: d - timedelta(days=6)),
+    'half-monthly': (halfMonthDate, lambda d: d.replace(day=16) if d.day > 15 else d.replace(day=1)),
+    'monthly': (last_day_of_month, lambda d: d.replace(day=1)),
+}
+
+# coarser granularities whose snapshot dates are all included, older data
+# can be downsampled to these by deleting snapshots
+DOWNSAMPLE_TO = {
+    'daily': ('daily', 'weekly', 'half-monthly', 'monthly'),
+    'weekly': ('weekly',),
+    'half-monthly': ('half-monthly', 'monthly'),
+    'monthly': ('monthly',),
+}
+
+# granularities stored with ValuationWriter in compact mode
+DENSE_GRANULARITIES = ('daily', 'weekly')
+
+class SnapshotCalendar():
+    # snapshot dates are those of the dense granularity after boundary and
+    # those of the coarse one up to boundary (a coarse snapshot date)
+
+    def __init__(self, granularity = None, coarseGranularity = None, denseDays = None, today = None):
+        if granularity is None:
+            granularity = getattr(settings, 'VALUATION_GRANULARITY', 'half-monthly')
+        if coarseGranularity is None:
+            coarseGranularity = getattr(settings, 'VALUATION_COARSE_GRANULARITY', granularity)
+        if denseDays is None:
+            denseDays = getattr(settings, 'VALUATION_DENSE_DAYS', None)
+        if today is None:
+            today = timezone.now().date()
+        if granularity not in GRANULARITIES:
+            raise ImproperlyConfigured('Unknown valuation granularity %s' % granularity)
+        if coarseGranularity not in DOWNSAMPLE_TO[granularity]:
+            raise ImproperlyConfigured('Valuations with granularity %s cannot be downsampled to %s'
+                                       % (granularity, coarseGranularity))
+
+        self.granularity = granularity
+        self.coarseGranularity = coarseGranularity
+        self.today = today
+        self.compact = granularity in DENSE_GRANULARITIES
+        self.dense = GRANULARITIES[granularity]
+        self.coarse = GRANULARITIES[coarseGranularity]
+        if denseDays is None or coarseGranularity == granularity:
+            self.boundary = None
+        else:
+            self.boundary = self.coarse[0](today - timedelta(days=denseDays))
+
+    def isDense(self, any_day):
+        return self.boundary is None or any_day > self.boundary
+
+    def snapshotDate(self, any_day):
+        # snapshot date of the period containing any_day
+        if self.isDense(any_day):
+            return self.dense[0](any_day)
+        return self.coarse[0](any_day)
+
+    def periodStart(self, snapshotDate):
+        # first day of the period ending on snapshotDate
+        if self.isDense(snapshotDate):
+            start = self.dense[1](snapshotDate)
+            if self.boundary is not None and start <= self.boundary:
+                start = self.boundary + timedelta(days=1)
+            return start
+        return self.coarse[1](snapshotDate)
+
+    def nextDate(self, snapshotDate):
+        return self.snapshotDate(snapshotDate + timedelta(days=1))
+
+    def previousDate(self, any_day):
+        # snapshot date before the one of the period containing any_day
+        return self.periodStart(self.snapshotDate(any_day)) - timedelta(days=1)
+
+    def lastDate(self):
+        # snapshot date of the current period, valuations are kept up to it
+        return self.snapshotDate(self.today)
+
+    def isSnapshotDate(self, any_day):
+        return self.snapshotDate(any_day) == any_day
+
+def getSnapshotCalendar(today = None):
+    # calendar as configured in settings
+    return SnapshotCalendar(today=today)
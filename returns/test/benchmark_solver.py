@@ -0,0 +1,215 @@
+# Benchmark suite for the rate of return solvers in calc.py
+#
+# Generates synthetic cashflow series with a known rate of return and reports
+# time per solve, iterations (function evaluations), failure rate and median
+# error for each solver, pattern and series length, compared against stored
+# baselines recorded with the same number of samples.
+#
+# usage: python -m returns.test.benchmark_solver [--sizes 10 100 ...]
+#            [--samples N] [--save-baseline] [--fail-on-regression]
+
+import argparse
+import json
+import os
+import sys
+from datetime import date, timedelta
+from time import perf_counter
+
+import numpy as np
+
+from ..calc import Solver, ArraySolver, callSolver2, packSeries, solveBatch
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+SIZES = [10, 100, 1000, 10000, 100000, 1000000]
+
+# pure Python solvers are skipped above this number of cashflows
+MAX_SCALAR_SIZE = 100000
+
+# solves slower than baseline by more than this factor count as regression,
+# unless the baseline is faster than MIN_REGRESSION_TIME seconds (noise)
+REGRESSION_FACTOR = 1.5
+MIN_REGRESSION_TIME = 0.001
+
+# approximations (no exact rate of return), only fail if they give no result
+APPROXIMATE_SOLVERS = ['ArraySolver-dietz']
+
+DEFAULT_SAMPLES = 5
+
+def finalValue(days, amounts, rate):
+    # value at the last day that makes rate the exact rate of return
+    T = days.max() + 30.0
+    return T, -np.dot(amounts, (1.0 + rate) ** ((T - days) / 365.0))
+
+def savingsPlan(n, rng):
+    # regular contributions over up to 30 years, several per day for large n
+    rate = rng.uniform(-0.05, 0.12)
+    days = np.sort(rng.integers(0, 30*365, n-1)).astype(np.float64)
+    amounts = rng.uniform(50.0, 500.0, n-1)
+    T, final = finalValue(days, amounts, rate)
+    return np.append(days, T), np.append(amounts, final), rate
+
+def lumpSum(n, rng):
+    # one initial investment, small payouts (e.g. dividends) afterwards
+    rate = rng.uniform(-0.05, 0.12)
+    days = np.sort(rng.integers(1, 20*365, n-2)).astype(np.float64)
+    amounts = -rng.uniform(0.0, 0.5 / n, n-2) * 10000.0
+    days = np.append(0.0, days)
+    amounts = np.append(10000.0, amounts)
+    T, final = finalValue(days, amounts, rate)
+    return np.append(days, T), np.append(amounts, final), rate
+
+def signAlternating(n, rng):
+    # contributions and withdrawals alternate, may have no or several roots
+    rate = rng.uniform(-0.05, 0.12)
+    days = np.sort(rng.integers(0, 10*365, n-1)).astype(np.float64)
+    amounts = rng.uniform(50.0, 500.0, n-1) * np.where(np.arange(n-1) % 2 == 0, 1.0, -0.8)
+    T, final = finalValue(days, amounts, rate)
+    return np.append(days, T), np.append(amounts, final), rate
+
+PATTERNS = {'savings-plan': savingsPlan,
+            'lump-sum': lumpSum,
+            'sign-alternating': signAlternating}
+
+def toDates(days):
+    d0 = date(2000,1,1)
+    return [d0 + timedelta(days=int(d)) for d in days]
+
+def runSolver(name, days, amounts):
+    # returns rate (in %) and number of function evaluations, rate None on failure
+    if name == 'callSolver2':
+        cashflowList = [{'date': d, 'cashflow': c} for d, c in zip(toDates(days), amounts)]
+        return callSolver2(cashflowList), None
+
+    if name == 'Solver':
+        solver = Solver()
+        for d, c in zip(toDates(days), amounts):
+            solver.addCashflow(c, d)
+        rate = solver.calcRateOfReturn()
+    elif name == 'ArraySolver':
+        solver = ArraySolver.fromArrays(days, amounts)
+        rate = solver.calcRateOfReturn()
+    elif name == 'ArraySolver-hybrid':
+        solver = ArraySolver.fromArrays(days, amounts)
+        rate = solver.calcRateOfReturn(method='hybrid')
+    elif name == 'ArraySolver-dietz':
+        solver = ArraySolver.fromArrays(days, amounts)
+        rate = solver.calcModifiedDietz()
+    return rate, getattr(solver, 'evaluations', None)
+
+SOLVERS = ['Solver', 'callSolver2', 'ArraySolver', 'ArraySolver-hybrid', 'ArraySolver-dietz']
+SCALAR_SOLVERS = ['Solver', 'callSolver2']
+
+def benchmark(sizes, samples, seed=0, tolerance=0.1):
+    # returns dict of results keyed by 'solver/pattern/size'
+    results = {}
+    for pattern, generator in sorted(PATTERNS.items()):
+        for n in sizes:
+            rng = np.random.default_rng(seed)
+            series = [generator(n, rng) for i in range(samples)]
+
+            for name in SOLVERS:
+                if name in SCALAR_SOLVERS and n > MAX_SCALAR_SIZE:
+                    continue
+                times = []
+                evaluations = []
+                errors = []
+                failures = 0
+                for days, amounts, rate in series:
+                    start = perf_counter()
+                    try:
+                        r, it = runSolver(name, days, amounts)
+                    except RuntimeError:
+                        r, it = None, None
+                    times.append(perf_counter() - start)
+                    if it is not None:
+                        evaluations.append(it)
+                    if r is None:
+                        failures = failures + 1
+                        continue
+                    errors.append(abs(r - rate*100.0))
+                    if errors[-1] > tolerance and name not in APPROXIMATE_SOLVERS:
+                        failures = failures + 1
+                results['%s/%s/%d' % (name, pattern, n)] = {
+                    'time': float(np.median(times)),
+                    'iterations': float(np.mean(evaluations)) if evaluations else None,
+                    'failureRate': failures / float(samples),
+                    'error': float(np.median(errors)) if errors else None,
+                    'samples': samples,
+                }
+
+            # all samples in one batch, time per series
+            offsets, days, amounts = packSeries([(d, a) for d, a, r in series])
+            start = perf_counter()
+            rates, iterations = solveBatch(offsets, days, amounts, returnIterations=True)
+            elapsed = perf_counter() - start
+            errors = [abs(r - rate*100.0) for r, (d, a, rate) in zip(rates, series) if not np.isnan(r)]
+            failures = sum(1 for r, (d, a, rate) in zip(rates, series)
+                           if np.isnan(r) or abs(r - rate*100.0) > tolerance)
+            results['solveBatch/%s/%d' % (pattern, n)] = {
+                'time': elapsed / samples,
+                'iterations': float(np.mean(iterations)),
+                'failureRate': failures / float(samples),
+                'error': float(np.median(errors)) if errors else None,
+                'samples': samples,
+            }
+    return results
+
+def compare(results, baseline, factor=REGRESSION_FACTOR, minTime=MIN_REGRESSION_TIME):
+    # print results next to baseline, returns list of regressed keys; failure
+    # rates are only compared for baselines with the same number of samples
+    regressions = []
+    print('%-48s %12s %12s %8s %8s %8s %10s' % ('solver/pattern/size', 'time [ms]', 'baseline', 'ratio',
+                                               'iter', 'fail', 'error [%]'))
+    for key in sorted(results, key=lambda k: (k.split('/')[1], int(k.split('/')[2]), k.split('/')[0])):
+        r = results[key]
+        b = baseline.get(key)
+        iterations = '-' if r['iterations'] is None else '%.1f' % r['iterations']
+        error = '-' if r['error'] is None else '%.4f' % r['error']
+        if b is None:
+            print('%-48s %12.3f %12s %8s %8s %7.0f%% %10s' % (key, r['time']*1000.0, '-', '-', iterations,
+                                                            r['failureRate']*100.0, error))
+            continue
+        ratio = r['time'] / b['time'] if b['time'] > 0 else 1.0
+        flag = ''
+        if b.get('samples') != r['samples']:
+            flag = ' (baseline samples differ)'
+        if (ratio > factor and b['time'] >= minTime) or \
+           (b.get('samples') == r['samples'] and r['failureRate'] > b['failureRate']):
+            flag = ' REGRESSION' + flag
+            regressions.append(key)
+        print('%-48s %12.3f %12.3f %8.2f %8s %7.0f%% %10s%s' % (key, r['time']*1000.0, b['time']*1000.0, ratio,
+                                                               iterations, r['failureRate']*100.0, error, flag))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark rate of return solvers')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.sizes, args.samples, args.seed)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except (IOError, ValueError):
+        baseline = {}
+
+    regressions = compare(results, baseline)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+
+    if regressions and args.fail_on_regression:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import math
+import datetime
+
+from django.test import TestCase
+
+from ..calc import Solver, ArraySolver, hybridSolve, packSeries, solveBatch, solveMultiple
+
+def makeSolvers(dates, cashflows):
+    solver = Solver()
+    arraySolver = ArraySolver()
+    for d, c in zip(dates, cashflows):
+        solver.addCashflow(c, d)
+        arraySolver.addCashflow(c, d)
+    return solver, arraySolver
+
+# Tests array-backed solver against the reference implementation
+class ArraySolverTestCase(TestCase):
+    def test_matches_solver1(self):
+        dates = [datetime.date(2012,12,31), datetime.date(2013,12,31)]
+        cashflows = [100.0, -101.0]
+
+        solver, arraySolver = makeSolvers(dates, cashflows)
+
+        self.assertAlmostEqual(arraySolver.calcRateOfReturn(), 1.0, places=3)
+        self.assertAlmostEqual(arraySolver.calcRateOfReturn(), solver.calcRateOfReturn(), places=8)
+
+    def test_matches_solver2(self):
+        dates = [datetime.date(2000,12,31), datetime.date(2001,12,31),
+                 datetime.date(2002,12,31), datetime.date(2003,12,31),
+                 datetime.date(2004,12,31), datetime.date(2005,12,31)]
+        cashflows = [100.0, -10.0, 10.0, -10.0, -10.0, -105.539854]
+
+        solver, arraySolver = makeSolvers(dates, cashflows)
+
+        self.assertAlmostEqual(arraySolver.calcRateOfReturn(), 5.0, places=2)
+        self.assertAlmostEqual(arraySolver.calcRateOfReturn(), solver.calcRateOfReturn(), places=8)
+
+    def test_matches_solver_savings_plan(self):
+        # monthly contributions, final value at end
+        dates = [datetime.date(2010 + i // 12, i % 12 + 1, 15) for i in range(120)]
+        cashflows = [100.0 for i in range(120)]
+        dates.append(datetime.date(2020,1,15))
+        cashflows.append(-15000.0)
+
+        solver, arraySolver = makeSolvers(dates, cashflows)
+
+        self.assertAlmostEqual(arraySolver.calcRateOfReturn(), solver.calcRateOfReturn(), places=8)
+
+    def test_from_arrays(self):
+        arraySolver = ArraySolver.fromArrays([0, 365, 365], [100.0, -50.0, -55.0])
+        days, amounts = arraySolver.cashflowArrays()
+
+        self.assertEqual(list(days), [0.0, 365.0])
+        self.assertEqual(list(amounts), [100.0, -105.0])
+        self.assertAlmostEqual(arraySolver.calcRateOfReturn(), 5.0, places=3)
+
+    def test_from_arrays_unsorted(self):
+        arraySolver = ArraySolver.fromArrays([365, 0, 182, 365], [-50.0, 100.0, 0.0, -55.0])
+
+        self.assertEqual(arraySolver.numCashflows(), 3)
+        self.assertEqual(arraySolver.cashflowList, {0: 100.0, 182: 0.0, 365: -105.0})
+        arraySolver.addCashflow(-1.0, datetime.date(2000,1,1) + datetime.timedelta(days=365))
+        self.assertEqual(list(arraySolver.cashflowArrays()[1]), [100.0, 0.0, -106.0])
+
+    def test_exception_empty(self):
+        arraySolver = ArraySolver()
+
+        self.assertRaisesRegex(RuntimeError, 'Empty list', arraySolver.calcRateOfReturn)
+
+    def test_exception_diverging(self):
+        arraySolver = ArraySolver.fromArrays([0, 365], [100.0, 10.0])
+
+        self.assertRaisesRegex(RuntimeError, 'Iteration limit exceeded', arraySolver.calcRateOfReturn)
+
+# Tests batched solving of several cashflow series
+class SolveBatchTestCase(TestCase):
+    def test_batch_matches_solver(self):
+        series = [([0, 365], [100.0, -101.0]),
+                  ([0, 365, 730, 1095, 1461, 1826], [100.0, -10.0, 10.0, -10.0, -10.0, -105.539854]),
+                  ([0, 31, 59, 90, 365], [50.0, 50.0, 50.0, 50.0, -190.0])]
+        offsets, days, amounts = packSeries(series)
+        rates = solveBatch(offsets, days, amounts)
+
+        self.assertEqual(len(rates), 3)
+        for (d, a), r in zip(series, rates):
+            self.assertAlmostEqual(r, ArraySolver.fromArrays(d, a).calcRateOfReturn(), places=8)
+
+    def test_batch_failures(self):
+        series = [([0, 365], [100.0, 10.0]),
+                  ([], []),
+                  ([0, 365], [100.0, -101.0])]
+        offsets, days, amounts = packSeries(series)
+        rates = solveBatch(offsets, days, amounts)
+
+        self.assertTrue(math.isnan(rates[0]))
+        self.assertTrue(math.isnan(rates[1]))
+        self.assertAlmostEqual(rates[2], 1.0, places=3)
+
+    def test_solve_multiple(self):
+        solvers = [ArraySolver.fromArrays([0, 365], [100.0, -105.0]), ArraySolver()]
+
+        rates = solveMultiple(solvers)
+
+        self.assertAlmostEqual(rates[0], 5.0, places=3)
+        self.assertIsNone(rates[1])
+
+# Tests bracketed hybrid solver
+class HybridSolverTestCase(TestCase):
+    def test_basic_hybridSolve(self):
+        fdf = lambda x: (x**3 - 1.0, 3*x**2)
+        x, evaluations = hybridSolve(fdf, 0.0)
+
+        self.assertAlmostEqual(x, 1.0, places=5)
+
+    def test_hybrid_matches_newton(self):
+        dates = [datetime.date(2000,12,31), datetime.date(2001,12,31),
+                 datetime.date(2002,12,31), datetime.date(2003,12,31),
+                 datetime.date(2004,12,31), datetime.date(2005,12,31)]
+        cashflows = [100.0, -10.0, 10.0, -10.0, -10.0, -105.539854]
+
+        solver, arraySolver = makeSolvers(dates, cashflows)
+
+        self.assertAlmostEqual(solver.calcRateOfReturn(method='hybrid'), 5.0, places=4)
+        self.assertAlmostEqual(arraySolver.calcRateOfReturn(method='hybrid'),
+                               arraySolver.calcRateOfReturn(), places=2)
+
+    def test_hybrid_short_period_loss(self):
+        # damped Newton from 0 leaves [-1, 10] for this series
+        arraySolver = ArraySolver.fromArrays([0, 49], [85.54, -67.49])
+
+        self.assertRaisesRegex(RuntimeError, 'Iteration limit exceeded', arraySolver.calcRateOfReturn)
+        r = arraySolver.calcRateOfReturn(method='hybrid')
+        self.assertAlmostEqual(r, ((67.49/85.54)**(365.0/49) - 1.0)*100.0, places=3)
+        self.assertAlmostEqual(solveMultiple([arraySolver])[0], r, places=6)
+
+    def test_hybrid_warm_start(self):
+        arraySolver = ArraySolver.fromArrays([0, 100, 200, 365], [100.0, 20.0, -10.0, -120.0])
+        r = arraySolver.calcRateOfReturn(method='hybrid')
+        coldEvaluations = arraySolver.evaluations
+
+        self.assertAlmostEqual(arraySolver.calcRateOfReturn(method='hybrid', guess=r+0.5), r, places=4)
+        self.assertLess(arraySolver.evaluations, coldEvaluations)
+        self.assertLessEqual(arraySolver.evaluations, 6)
+
+    def test_hybrid_no_root(self):
+        arraySolver = ArraySolver.fromArrays([0, 365], [100.0, 10.0])
+
+        self.assertRaisesRegex(RuntimeError, 'Iteration limit exceeded',
+                               arraySolver.calcRateOfReturn, method='hybrid')
+
+# Tests Modified Dietz estimate
+class ModifiedDietzTestCase(TestCase):
+    def test_dietz_close_to_irr(self):
+        arraySolver = ArraySolver.fromArrays([0, 30, 90, 120, 181], [1000.0, 100.0, -50.0, 200.0, -1290.0])
+
+        self.assertAlmostEqual(arraySolver.calcModifiedDietz(wellConditioned=True),
+                               arraySolver.calcRateOfReturn(method='hybrid'), delta=0.05)
+
+    def test_dietz_single_period(self):
+        arraySolver = ArraySolver.fromArrays([0, 365], [100.0, -105.0])
+
+        self.assertAlmostEqual(arraySolver.calcModifiedDietz(), 5.0, places=8)
+
+    def test_dietz_not_well_conditioned(self):
+        # more than a year
+        arraySolver = ArraySolver.fromArrays([0, 400, 800], [100.0, 50.0, -160.0])
+        self.assertRaises(RuntimeError, arraySolver.calcModifiedDietz, wellConditioned=True)
+        arraySolver.calcModifiedDietz()
+
+        # large withdrawal shortly after start
+        arraySolver = ArraySolver.fromArrays([0, 10, 180], [100.0, -90.0, -11.0])
+        self.assertRaises(RuntimeError, arraySolver.calcModifiedDietz, wellConditioned=True)
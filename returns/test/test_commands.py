@@ -0,0 +1,78 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+
+import numpy as np
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from moneyed import Money
+
+from ..models import Security, Account, Transaction, Position, SecurityValuation, AccountValuation, HistValuation
+from ..processTransaction2 import updateSecurityValuation
+
+# Tests rebuilding valuations with the management command
+class RebuildValuationsTestCase(TestCase):
+    def setUp(self):
+        self.owners = [User.objects.create(username='owner%d' % i) for i in range(2)]
+        for i, owner in enumerate(self.owners):
+            account = Account.objects.create(name='Bank', owner=owner)
+            for j in range(3):
+                security = Security.objects.create(name='Savings %d' % j, descrip='Savings account')
+                Transaction.objects.create(date=datetime.date(2020,1+j,1+i), kind=Transaction.BUY,
+                                           security=security, account=account, owner=owner,
+                                           cashflow=Money(-100.0*(j+1), 'EUR'),
+                                           modifiedDate=datetime.date(2020,1,1))
+
+    def test_matches_update_per_owner(self):
+        out = StringIO()
+        call_command('rebuild_valuations', workers=1, security_chunks=2, stdout=out)
+        records = list(SecurityValuation.objects.order_by('owner_id', 'security_id', 'date')
+                       .values_list('owner_id', 'security_id', 'date', 'cur_value', 'base_value'))
+
+        SecurityValuation.objects.all().delete()
+        for owner in self.owners:
+            updateSecurityValuation(owner)
+
+        self.assertEqual(records, list(SecurityValuation.objects.order_by('owner_id', 'security_id', 'date')
+                                       .values_list('owner_id', 'security_id', 'date', 'cur_value', 'base_value')))
+        self.assertIn('[4/4] owner %d, securities' % self.owners[1].id, out.getvalue())
+        self.assertTrue(AccountValuation.objects.exists())
+
+    def test_rebuild_positions(self):
+        Position.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_positions', owners=[self.owners[0].id], stdout=out)
+        self.assertEqual(Position.objects.owner(self.owners[0].id).count(), 3)
+        self.assertFalse(Position.objects.owner(self.owners[1].id).exists())
+        self.assertIn('Rebuilt 3 positions', out.getvalue())
+
+    def test_owner_filter(self):
+        call_command('rebuild_valuations', workers=1, owners=[self.owners[0].id], skip_accounts=True,
+                     stdout=StringIO())
+
+        self.assertEqual(set(SecurityValuation.objects.values_list('owner_id', flat=True)),
+                         set([self.owners[0].id]))
+        self.assertFalse(AccountValuation.objects.exists())
+
+# Tests bulk loading historical prices
+class LoadPricesTestCase(TestCase):
+    def test_load_prices(self):
+        etf = Security.objects.create(name='Stock', descrip='Stock ETF', mark_to_market=True, symbol='ETF')
+        HistValuation.objects.create(date=datetime.date(2000,1,3), security=etf, value=Money(1.0, 'EUR'))
+        dates = np.arange('2000-01-01', '2020-01-01', dtype='datetime64[D]')
+        close = np.round(np.linspace(10.0, 100.0, len(dates)), 2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ETF.npz')
+            np.savez(path, date=dates, close=close)
+            out = StringIO()
+            call_command('load_prices', path, stdout=out)
+
+        self.assertIn('Loaded %d prices' % len(dates), out.getvalue())
+        self.assertEqual(HistValuation.objects.filter(security=etf).count(), len(dates))
+        self.assertEqual(HistValuation.objects.getHistValuation(etf.id, datetime.date(2000,1,3)),
+                         Money(close[2], 'EUR'))
@@ -0,0 +1,86 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+
+from moneyed import Money
+
+from ..models import Security, Account, Transaction, SecurityValuation, ValuationJob, ValuationRefresh
+
+# Tests refreshing valuations in background jobs
+class ValuationJobTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='secret')
+        self.account = Account.objects.create(name='Bank', owner=self.owner)
+        self.security = Security.objects.create(name='Savings', descrip='Savings account')
+        Transaction.objects.create(date=datetime.date(2020,1,10), kind=Transaction.BUY,
+                                   security=self.security, account=self.account, owner=self.owner,
+                                   cashflow=Money(-100.0, 'EUR'), modifiedDate=datetime.date(2020,1,10))
+
+    def test_duplicate_jobs_coalesced(self):
+        job1 = ValuationJob.objects.enqueue(ValuationJob.SECURITY, self.owner, self.security)
+        job2 = ValuationJob.objects.enqueue(ValuationJob.SECURITY, self.owner, self.security, fullRebuild=True)
+        job3 = ValuationJob.objects.enqueue(ValuationJob.ACCOUNT, self.owner, account=self.account)
+
+        self.assertEqual(job1.id, job2.id)
+        self.assertNotEqual(job1.id, job3.id)
+        self.assertTrue(ValuationJob.objects.get(id=job1.id).fullRebuild)
+
+        # running job is not reused
+        self.assertEqual(ValuationJob.objects.claimNext().id, job1.id)
+        job4 = ValuationJob.objects.enqueue(ValuationJob.SECURITY, self.owner, self.security)
+        self.assertNotEqual(job1.id, job4.id)
+
+    def test_refresh_view_and_worker(self):
+        self.client.login(username='owner', password='secret')
+        response = self.client.get(reverse('returns:security_refresh', args=[self.security.id]))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(SecurityValuation.objects.exists())
+        self.assertEqual(self.client.get(reverse('returns:valuation_jobs')).json()['pending'], 1)
+
+        call_command('run_valuation_worker', once=True, stdout=StringIO())
+
+        self.assertTrue(SecurityValuation.objects.exists())
+        status = self.client.get(reverse('returns:valuation_jobs')).json()
+        self.assertEqual(status['pending'], 0)
+        self.assertEqual(status['jobs'][0]['status'], 'Done')
+        self.assertEqual(self.client.get(reverse('returns:valuation_jobs'), {'id': 'x'}).status_code, 400)
+
+    def test_stale_running_job_requeued(self):
+        job = ValuationJob.objects.enqueue(ValuationJob.SECURITY, self.owner, self.security)
+        self.assertEqual(ValuationJob.objects.claimNext().id, job.id)
+        self.assertEqual(ValuationJob.objects.requeueStale(3600), 0)
+
+        # worker died two hours ago
+        ValuationJob.objects.filter(id=job.id).update(started=timezone.now() - datetime.timedelta(hours=2))
+        call_command('run_valuation_worker', once=True, stdout=StringIO())
+
+        self.assertEqual(ValuationJob.objects.get(id=job.id).status, ValuationJob.DONE)
+        self.assertTrue(SecurityValuation.objects.exists())
+
+    def test_most_stale_refreshed_first(self):
+        others = [Security.objects.create(name='Savings %d' % i, descrip='Savings account') for i in range(11)]
+        for s in others:
+            Transaction.objects.create(date=datetime.date(2020,2,10), kind=Transaction.BUY,
+                                       security=s, account=self.account, owner=self.owner,
+                                       cashflow=Money(-100.0, 'EUR'), modifiedDate=datetime.date(2020,2,10))
+        self.client.login(username='owner', password='secret')
+
+        # 12 securities, 10 refreshed per run
+        response = self.client.get(reverse('returns:update_hist_data'))
+        first = set(s.id for s in response.context['updatedSecurities'])
+        self.assertEqual(len(first), 10)
+        # staleness covers all 12 securities and the account, not only the ones refreshed
+        self.assertIn(('never', 13), response.context['staleness'])
+        call_command('run_valuation_worker', once=True, stdout=StringIO())
+        self.assertEqual(ValuationRefresh.objects.filter(refreshed__isnull=False).count(), 11)
+
+        response = self.client.get(reverse('returns:update_hist_data'))
+        second = set(s.id for s in response.context['updatedSecurities'])
+        self.assertEqual(len(first & second), 8)
+        self.assertIn(('never', 2), response.context['staleness'])
@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from time import perf_counter
+
+import numpy as np
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from moneyed import Money
+
+from ..models import Security, HistValuation
+from ..marketData import TokenBucket, parseDaily, fetchDailyPrices, AlphaVantageProvider, FileProvider, \
+    FakeHTTPProvider, InvalidSymbol
+
+CSV = """timestamp,open,high,low,close,volume
+2020-03-04,11.0,12.0,10.0,11.5,100
+2020-03-03,10.0,11.0,9.0,10.5,100
+2020-03-02,10.0,11.0,9.0,10.0,100
+"""
+
+class FakeResponse():
+    def __init__(self, text):
+        self.text_ = text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def text(self):
+        return self.text_
+
+class FakeSession():
+    # answers with the quota note for the first request of each symbol
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, params):
+        symbol = params['symbol']
+        self.requests.append(symbol)
+        if self.requests.count(symbol) == 1:
+            return FakeResponse('{"Note": "API call frequency exceeded"}')
+        if symbol == 'BAD':
+            return FakeResponse('{"Error Message": "Invalid API call"}')
+        return FakeResponse(CSV)
+
+# Tests concurrent fetching of prices within the API quota
+@override_settings(ALPHA_VANTAGE_REQUESTS_PER_MINUTE=6000, ALPHA_VANTAGE_BACKOFF=0.01)
+class MarketDataTestCase(TestCase):
+    def test_token_bucket(self):
+        async def acquireAll(bucket, n):
+            for i in range(n):
+                await bucket.acquire()
+        start = perf_counter()
+        asyncio.run(acquireAll(TokenBucket(100.0), 11))
+        self.assertGreater(perf_counter() - start, 0.09)
+
+    def test_parse(self):
+        self.assertEqual(parseDaily(CSV, datetime.date(2020,3,3)),
+                         [(datetime.date(2020,3,4), Decimal('11.5')), (datetime.date(2020,3,3), Decimal('10.5'))])
+
+    def test_fetch_with_retries(self):
+        session = FakeSession()
+        prices = fetchDailyPrices({'ETF': datetime.date(2020,3,1), 'BAD': datetime.date(2020,3,1)},
+                                  apiKey='demo', session=session)
+        self.assertEqual(len(prices['ETF']), 3)
+        self.assertIsInstance(prices['BAD'], Exception)
+        self.assertEqual(sorted(session.requests), ['BAD', 'BAD', 'ETF', 'ETF'])
+
+    def test_save_values(self):
+        stock = Security.objects.create(name='Stock', descrip='Stock ETF', mark_to_market=True,
+                                        symbol='ETF', active=True)
+        HistValuation.objects.create(date=datetime.date(2020,3,2), security=stock, value=Money(10.0, 'EUR'))
+        updated = Security.objects.saveMarkToMarketValues(provider=AlphaVantageProvider('demo', FakeSession()))
+        self.assertEqual(updated, [stock])
+        self.assertEqual(HistValuation.objects.filter(security=stock).count(), 3)
+        self.assertEqual(HistValuation.objects.get(security=stock, date=datetime.date(2020,3,4)).value,
+                         Money(11.5, 'EUR'))
+
+# Tests price providers reading local files
+class PriceProviderTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.directory.name, 'ETF.csv'), 'w') as f:
+            f.write(CSV)
+        np.savez(os.path.join(self.directory.name, 'BOND.npz'),
+                 date=np.array(['2020-03-02', '2020-03-04', '2020-03-03'], dtype='datetime64[D]'),
+                 close=np.array([100.0, 101.5, 100.5]))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_file_provider(self):
+        prices = FileProvider(self.directory.name).fetch(['ETF', 'BOND', 'BAD'], datetime.date(2020,3,3))
+        self.assertEqual(prices['ETF'], parseDaily(CSV, datetime.date(2020,3,3)))
+        self.assertEqual(prices['BOND'],
+                         [(datetime.date(2020,3,4), Decimal('101.5')), (datetime.date(2020,3,3), Decimal('100.5'))])
+        self.assertIsInstance(prices['BAD'], InvalidSymbol)
+
+    def test_fake_http_provider(self):
+        since = {'ETF': datetime.date(2020,3,1), 'BOND': datetime.date(2020,3,3)}
+        expected = FileProvider(self.directory.name).fetch(['ETF', 'BOND'], since)
+        provider = FakeHTTPProvider(directory=self.directory.name, quotaEvery=2)
+        prices = provider.fetch(['ETF', 'BOND'], since)
+        self.assertEqual(prices, expected)
+        self.assertEqual(provider.session.requests, 3)
+
+    def test_fetch_prices_command(self):
+        etf = Security.objects.create(name='Stock', descrip='Stock ETF', mark_to_market=True,
+                                      symbol='ETF', active=True)
+        bond = Security.objects.create(name='Bond', descrip='Bond ETF', mark_to_market=True,
+                                       symbol='BOND', active=True, currency='USD')
+        out = StringIO()
+        call_command('fetch_prices', provider='file', directory=self.directory.name, stdout=out)
+        self.assertIn('2 securities', out.getvalue())
+        self.assertEqual(HistValuation.objects.get(security=bond, date=datetime.date(2020,3,4)).value,
+                         Money(101.5, 'USD'))
+        self.assertEqual(etf.markToMarket(FileProvider(self.directory.name)),
+                         (Money(11.5, 'EUR'), datetime.date(2020,3,4)))
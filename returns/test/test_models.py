@@ -1,7 +1,253 @@
 import math
 import datetime
+from decimal import Decimal
 
-from django.test import TestCase
+from django.db import IntegrityError, transaction
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.contrib.auth.models import User
 
-from .models import SecurityValuation, AccountValuation    
-    
\ No newline at end of file
+from moneyed import Money
+
+from ..models import Security, Account, Transaction, Position, SecurityValuation, AccountValuation, HistValuation
+from ..processTransaction2 import rebuildPositions
+from ..utilities import last_day_of_month, mid_day_of_next_month
+
+def createValuations(owner, security, beginDate, endDate, inflow, growth):
+    # create half-monthly valuations for a savings plan with constant growth
+    d = beginDate
+    base = 0.0
+    cur = 0.0
+    while d <= endDate:
+        base = base + inflow
+        cur = round(cur * growth + inflow, 2)
+        SecurityValuation.objects.create(date=d, security=security, owner=owner,
+                                         cur_value=Money(cur, security.currency),
+                                         base_value=Money(base, security.currency),
+                                         sum_num=0, modifiedDate=d)
+        if d.day == 15:
+            d = last_day_of_month(d)
+        else:
+            d = mid_day_of_next_month(d)
+
+# Tests rate of return calculation on valuations
+class ValuationRateOfReturnTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.security1 = Security.objects.create(name='Stock', descrip='Stock ETF')
+        self.security2 = Security.objects.create(name='Bond', descrip='Bond ETF')
+        createValuations(self.owner, self.security1, datetime.date(2010,1,15),
+                         datetime.date(2020,12,31), 100.0, 1.003)
+        createValuations(self.owner, self.security2, datetime.date(2015,6,15),
+                         datetime.date(2020,12,31), 50.0, 1.001)
+
+    def test_single_query(self):
+        valuation = SecurityValuation.objects.all()
+
+        with self.assertNumQueries(1):
+            valuation.getHistoricalRateOfReturn()
+
+    def test_periods_match_single_period(self):
+        valuation = SecurityValuation.objects.all()
+        periods = [('A', datetime.date(2012,3,1), datetime.date(2016,7,20)),
+                   ('B', datetime.date(2016,1,1), datetime.date(2017,1,1)),
+                   ('C', None, datetime.date(2020,12,31))]
+
+        histPerf = valuation.getHistoricalRateOfReturn(periods)
+
+        for suffix, beginDate, endDate in periods:
+            perf = valuation.getRateOfReturn(beginDate, endDate)
+            self.assertAlmostEqual(histPerf['r' + suffix], perf['rate'], places=2)
+            self.assertEqual(histPerf['i' + suffix], perf['initial'])
+            self.assertEqual(histPerf['t' + suffix], perf['final'])
+
+    def test_rate_of_return(self):
+        # 0.3% growth per half month is about 7.5% per year
+        perf = SecurityValuation.objects.filter(security=self.security1)\
+                                        .getRateOfReturn(datetime.date(2011,1,1), datetime.date(2020,12,31))
+
+        self.assertAlmostEqual(perf['rate'], (1.003**24 - 1.0) * 100.0, delta=0.2)
+        self.assertEqual(perf['final'], SecurityValuation.objects.get(security=self.security1,
+                                                                      date=datetime.date(2020,12,31)).cur_value)
+
+    def test_rolling_rate_of_return(self):
+        valuation = SecurityValuation.objects.filter(security=self.security1)
+        dates, rates = valuation.getRollingRateOfReturn()
+
+        self.assertEqual(dates[0], datetime.date(2011,1,15))
+        self.assertEqual(dates[-1], datetime.date(2020,12,31))
+        for d, r in list(zip(dates, rates))[::24]:
+            perf = valuation.getRateOfReturn(datetime.date(d.year-1, d.month, d.day), d)
+            self.assertAlmostEqual(r, perf['rate'], places=3)
+
+    def test_chart_rolling_rate_of_return(self):
+        chart = SecurityValuation.objects.all().makeRollingReturnChart()
+        chartdata = chart['chartdata']
+
+        self.assertEqual(chart['chartcontainer'], 'rolling_return')
+        self.assertEqual(len(chartdata['y1']), len(chartdata['x']))
+        self.assertAlmostEqual(chartdata['y1'][-1], 7.0, delta=1.0)
+        self.assertNotIn('y3', SecurityValuation.objects.all().makeChart()['chartdata'])
+
+    def test_time_weighted_return(self):
+        valuation = SecurityValuation.objects.filter(security=self.security1)
+        twr = valuation.getTimeWeightedReturn(datetime.date(2011,1,1), datetime.date(2020,12,31))
+
+        self.assertAlmostEqual(twr, (1.003**24 - 1.0) * 100.0, delta=0.1)
+        self.assertAlmostEqual(valuation.getHistoricalRateOfReturn()['wInfY'],
+                               valuation.getTimeWeightedReturn(), places=8)
+
+    def test_time_weighted_return_not_computable(self):
+        # nothing invested before the period, none of it before the first valuation
+        security = Security.objects.create(name='New', descrip='Not yet bought')
+        for d in (datetime.date(2020,1,15), datetime.date(2020,1,31), datetime.date(2020,2,15)):
+            SecurityValuation.objects.create(date=d, security=security, owner=self.owner,
+                                             cur_value=Money(0.0, 'EUR'), base_value=Money(0.0, 'EUR'),
+                                             sum_num=0, modifiedDate=d)
+        valuation = SecurityValuation.objects.filter(security=security)
+
+        self.assertEqual(valuation.getTimeWeightedReturn(datetime.date(2020,1,1), datetime.date(2020,2,15)), 'Error')
+        self.assertEqual(valuation.getTimeWeightedReturn(datetime.date(2020,1,1), datetime.date(2020,1,14)), 'Error')
+
+    def test_rate_of_return_method(self):
+        valuation = SecurityValuation.objects.all()
+        beginDate = datetime.date(2020,1,1)
+        endDate = datetime.date(2020,6,30)
+
+        perfIRR = valuation.getRateOfReturn(beginDate, endDate)
+        perfAuto = valuation.getRateOfReturn(beginDate, endDate, method='auto')
+        perfLong = valuation.getRateOfReturn(datetime.date(2015,1,1), endDate, method='auto')
+        histPerf = valuation.getHistoricalRateOfReturn([('H', beginDate, endDate)], method='dietz')
+
+        self.assertEqual(perfIRR['method'], 'irr')
+        self.assertEqual(perfAuto['method'], 'dietz')
+        self.assertEqual(perfLong['method'], 'irr')
+        self.assertEqual(histPerf['mH'], 'dietz')
+        self.assertAlmostEqual(perfAuto['rate'], perfIRR['rate'], delta=0.05)
+        self.assertEqual(histPerf['rH'], perfAuto['rate'])
+        self.assertEqual(SecurityValuation.objects.getRateOfReturn(beginDate, endDate, method='dietz')['method'],
+                         'dietz')
+
+    def test_rate_of_return_loads_range_only(self):
+        valuation = SecurityValuation.objects.filter(security=self.security1)
+        beginDate = datetime.date(2020,1,1)
+        endDate = datetime.date(2020,6,30)
+
+        # valuation of 2019-12-31 as initial value and those of 2020 up to the end date
+        restricted = valuation.restrictToRange(beginDate, endDate)
+        self.assertEqual(restricted.order_by('date').first().date, datetime.date(2019,12,31))
+        self.assertEqual(restricted.count(), 13)
+        perf = valuation.getRateOfReturn(beginDate, endDate)
+        solver, initial, final = valuation.valuationSeries().rateOfReturnSolver(beginDate, endDate)
+        self.assertEqual((perf['initial'], perf['final']), (initial, final))
+        self.assertAlmostEqual(perf['rate'], solver.calcRateOfReturn(), places=3)
+
+# Tests as-of lookups of historical valuations
+class PriceIndexTestCase(TestCase):
+    def setUp(self):
+        self.security1 = Security.objects.create(name='Stock', descrip='Stock ETF', mark_to_market=True)
+        self.security2 = Security.objects.create(name='Fund', descrip='US fund', currency='USD')
+        for d, v in [(datetime.date(2020,1,10), 100.0), (datetime.date(2020,3,2), 105.5),
+                     (datetime.date(2020,2,3), 98.25)]:
+            HistValuation.objects.create(date=d, security=self.security1, value=Money(v, 'EUR'))
+
+    def test_matches_get_hist_valuation(self):
+        dates = [datetime.date(2019,12,31), datetime.date(2020,1,10), datetime.date(2020,2,15),
+                 datetime.date(2020,3,2), datetime.date(2021,1,1)]
+        with self.assertNumQueries(2):
+            prices = HistValuation.objects.priceIndex()
+
+        for securityId in (self.security1.id, self.security2.id):
+            expected = [HistValuation.objects.getHistValuation(securityId, d) for d in dates]
+            with self.assertNumQueries(0):
+                self.assertEqual([prices.asOf(securityId, d) for d in dates], expected)
+                self.assertEqual(prices.asOfMany(securityId, dates), expected)
+        self.assertEqual(prices.asOf(self.security2.id, dates[0]), Money(0.0, 'USD'))
+
+    def test_upsert(self):
+        prices = [(datetime.date(2020,1,1) + datetime.timedelta(days=i), Decimal('50.25') + i) for i in range(200)]
+        prices.append((datetime.date(2020,3,2), Decimal('106.00')))
+        # one query for the positions to mark out of date, one for the prices
+        with self.assertNumQueries(2):
+            self.assertEqual(HistValuation.objects.upsert(self.security1.id, prices, 'EUR'), 200)
+        self.assertEqual(HistValuation.objects.filter(security=self.security1).count(), 200)
+        self.assertEqual(HistValuation.objects.getHistValuation(self.security1.id, datetime.date(2020,3,2)),
+                         Money(106.0, 'EUR'))
+        self.assertEqual(HistValuation.objects.getHistValuation(self.security1.id, datetime.date(2020,1,1)),
+                         Money(50.25, 'EUR'))
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            HistValuation.objects.create(date=datetime.date(2020,3,2), security=self.security1, value=Money(1.0, 'EUR'))
+
+# Tests ledger of positions kept up to date when transactions change
+class PositionTestCase(TestCase):
+    def positions(self):
+        return list(Position.objects.order_by('account_id', 'security_id')
+                    .values_list('account_id', 'security_id', 'num', 'cur_value', 'base_value', 'cost', 'transactions'))
+
+    def test_ledger_matches_rebuild(self):
+        owner = User.objects.create(username='owner')
+        accounts = [Account.objects.create(name='Broker', owner=owner),
+                    Account.objects.create(name='Bank', owner=owner)]
+        stock = Security.objects.create(name='Stock', descrip='Stock ETF', mark_to_market=True)
+        savings = Security.objects.create(name='Savings', descrip='Savings account')
+        buy = Transaction.objects.create(date=datetime.date(2020,1,10), kind=Transaction.BUY,
+                                         security=stock, account=accounts[0], owner=owner,
+                                         cashflow=Money(-1000.0, 'EUR'), num_transacted=10,
+                                         modifiedDate=datetime.date(2020,1,10))
+        Transaction.objects.create(date=datetime.date(2020,3,10), kind=Transaction.SELL,
+                                   security=stock, account=accounts[0], owner=owner,
+                                   cashflow=Money(450.0, 'EUR'), num_transacted=-4,
+                                   modifiedDate=datetime.date(2020,3,10))
+        deposit = Transaction.objects.create(date=datetime.date(2020,2,1), kind=Transaction.BUY,
+                                             security=savings, account=accounts[1], owner=owner,
+                                             cashflow=Money(-500.0, 'EUR'), tax=Money(0.0, 'EUR'),
+                                             expense=Money(0.0, 'EUR'),
+                                             modifiedDate=datetime.date(2020,2,1))
+        buy.num_transacted = 12
+        buy.account = accounts[1]
+        buy.save()
+        deposit.delete()
+
+        ledger = self.positions()
+        self.assertEqual(len(ledger), 2)
+        self.assertEqual(Position.objects.get(account=accounts[0]).num, -4)
+        self.assertEqual(Position.objects.get(account=accounts[1]).cost, Money(1000.0, 'EUR'))
+        self.assertEqual(list(Position.objects.owner(owner).held().values_list('account_id', flat=True)),
+                         [accounts[1].id])
+
+        rebuildPositions()
+        self.assertEqual(ledger, self.positions())
+
+# Tests filling the ledger of positions when migrating existing data
+class PositionMigrationTestCase(TransactionTestCase):
+    def migrate(self, target = None):
+        # to latest migrations without target
+        executor = MigrationExecutor(connection)
+        targets = [('returns', target)] if target else executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate()
+
+    def test_positions_filled(self):
+        apps = self.migrate('0004_dirtyrange')
+        owner = apps.get_model('auth', 'User').objects.create(username='owner')
+        account = apps.get_model('returns', 'Account').objects.create(name='Bank', owner_id=owner.id)
+        security = apps.get_model('returns', 'Security').objects.create(name='Savings', descrip='Savings account')
+        HistTransaction = apps.get_model('returns', 'Transaction')
+        for amount in (-100.0, -50.0):
+            HistTransaction._default_manager.create(date=datetime.date(2020,1,10), kind=Transaction.BUY,
+                                                    security_id=security.id, account_id=account.id, owner_id=owner.id,
+                                                    cashflow=Money(amount, 'EUR'), modifiedDate=datetime.date(2020,1,10))
+
+        apps = self.migrate('0005_position')
+        position = apps.get_model('returns', 'Position').objects.get(owner_id=owner.id)
+        self.assertEqual(position.transactions, 2)
+        self.assertEqual(position.base_value, Money(150.0, 'EUR'))
+
+        self.migrate()
+        self.assertEqual(list(Security.objects.securityOwnedBy(owner.id).values_list('id', flat=True)), [security.id])
+        self.assertEqual(list(Account.objects.accountOwnedBy(owner.id).values_list('id', flat=True)), [account.id])
@@ -0,0 +1,50 @@
+import datetime
+
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+
+from ..models import Security, SecurityValuation, getHistoricalRatesOfReturn
+from ..performance import getPerformanceSummary, getExecutor, performanceWorkers, shutdownExecutor
+from .test_models import createValuations
+
+# Tests performance summary computed in worker processes
+class PerformanceSummaryTestCase(TestCase):
+    def setUp(self):
+        owner = User.objects.create(username='owner')
+        self.security1 = Security.objects.create(name='Stock', descrip='Stock ETF')
+        self.security2 = Security.objects.create(name='Bond', descrip='Bond ETF')
+        createValuations(owner, self.security1, datetime.date(2010,1,15),
+                         datetime.date(2020,12,31), 100.0, 1.003)
+        createValuations(owner, self.security2, datetime.date(2015,6,15),
+                         datetime.date(2020,12,31), 50.0, 1.001)
+        self.periods = [('A', datetime.date(2012,3,1), datetime.date(2016,7,20)),
+                        ('B', None, datetime.date(2020,12,31))]
+
+    def tearDown(self):
+        shutdownExecutor()
+
+    def valuationSets(self):
+        valuation = SecurityValuation.objects.all()
+        return [valuation,
+                valuation.filter(security=self.security1),
+                valuation.filter(security=self.security2)]
+
+    def test_parallel_matches_serial(self):
+        expected = getHistoricalRatesOfReturn(self.valuationSets(), self.periods)
+        parallel = getPerformanceSummary(self.valuationSets(), self.periods, workers=2)
+        serial = getPerformanceSummary(self.valuationSets(), self.periods, workers=1)
+
+        self.assertEqual(serial, expected)
+        self.assertEqual(len(parallel), 3)
+        for p, e in zip(parallel, expected):
+            self.assertEqual(p.keys(), e.keys())
+            for key in ('rA', 'rB', 'wA', 'wB'):
+                self.assertAlmostEqual(p[key], e[key], places=2)
+            self.assertEqual(p['tB'], e['tB'])
+
+    def test_serial_by_default(self):
+        with override_settings(PERFORMANCE_WORKERS=None):
+            self.assertEqual(performanceWorkers(), 1)
+        executor = getExecutor(2)
+        self.assertIs(getExecutor(2), executor)
+        self.assertIsNot(getExecutor(3), executor)
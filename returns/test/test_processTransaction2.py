@@ -0,0 +1,244 @@
+import datetime
+import random
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from moneyed import Money
+
+from ..models import Security, Account, Transaction, HistValuation, SecurityValuation, AccountValuation, PositionValuation, \
+    DirtyRange
+from ..snapshots import SnapshotCalendar
+from ..processTransaction2 import updateSecurityValuation, updateAccountValuation, rollUpAccountValuation, \
+    propagateTransactionChange
+
+# Tests rebuilding security and account valuations from transactions
+class UpdateValuationTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.account = Account.objects.create(name='Broker', owner=self.owner)
+        self.stock = Security.objects.create(name='Stock', descrip='Stock ETF', mark_to_market=True)
+        self.savings = Security.objects.create(name='Savings', descrip='Savings account')
+        HistValuation.objects.create(date=datetime.date(2020,1,10), security=self.stock,
+                                     value=Money(100.0, 'EUR'))
+        HistValuation.objects.create(date=datetime.date(2020,6,1), security=self.stock,
+                                     value=Money(110.0, 'EUR'))
+        Transaction.objects.create(date=datetime.date(2020,1,10), kind=Transaction.BUY,
+                                   security=self.stock, account=self.account, owner=self.owner,
+                                   cashflow=Money(-1000.0, 'EUR'), num_transacted=10,
+                                   modifiedDate=datetime.date(2020,1,10))
+        Transaction.objects.create(date=datetime.date(2020,2,1), kind=Transaction.BUY,
+                                   security=self.savings, account=self.account, owner=self.owner,
+                                   cashflow=Money(-500.0, 'EUR'),
+                                   modifiedDate=datetime.date(2020,2,1))
+
+    def test_security_valuation(self):
+        stats1 = updateSecurityValuation(self.owner)
+        count = SecurityValuation.objects.count()
+        stats2 = updateSecurityValuation(self.owner.id)
+
+        stats3 = updateSecurityValuation(self.owner, fullRebuild=True)
+
+        self.assertEqual(stats1['created'], count)
+        self.assertEqual(stats2['created'], 0)
+        # only most recent valuation of both securities recomputed
+        self.assertEqual(stats2['updated'], 2)
+        self.assertEqual(stats3['updated'], count)
+        self.assertEqual(SecurityValuation.objects.count(), count)
+        self.assertTrue(SecurityValuation.objects.filter(date=datetime.date(2020,1,31),
+                                                         security=self.stock).exists())
+
+        v = SecurityValuation.objects.get(date=datetime.date(2020,6,15), security=self.stock)
+        self.assertEqual(v.cur_value, Money(1100.0, 'EUR'))
+        self.assertEqual(v.base_value, Money(1000.0, 'EUR'))
+        self.assertEqual(v.sum_num, 10)
+        self.assertFalse(SecurityValuation.objects.filter(date=datetime.date(2020,1,31),
+                                                          security=self.savings).exists())
+        v = SecurityValuation.objects.get(date=datetime.date(2020,2,15), security=self.savings)
+        self.assertEqual(v.cur_value, Money(500.0, 'EUR'))
+
+    def test_account_valuation(self):
+        updateAccountValuation()
+        count = AccountValuation.objects.count()
+        stats = updateAccountValuation(self.account.id)
+
+        self.assertEqual(stats['updated'], count)
+        self.assertEqual(AccountValuation.objects.count(), count)
+
+        v = AccountValuation.objects.get(date=datetime.date(2020,6,15), account=self.account)
+        self.assertEqual(v.cur_value, Money(1600.0, 'EUR'))
+        self.assertEqual(v.base_value, Money(1500.0, 'EUR'))
+
+    def valuationRecords(self):
+        return (list(SecurityValuation.objects.order_by('security_id', 'date')
+                     .values_list('security_id', 'date', 'cur_value', 'base_value', 'sum_num')),
+                list(PositionValuation.objects.order_by('account_id', 'security_id', 'date')
+                     .values_list('account_id', 'security_id', 'date', 'cur_value', 'base_value', 'sum_num')))
+
+    def test_incremental_matches_full_rebuild(self):
+        updateSecurityValuation(self.owner, positions=True)
+        count = SecurityValuation.objects.count()
+
+        # sell part of the stock, close savings account
+        Transaction.objects.create(date=datetime.date(2022,3,20), kind=Transaction.SELL,
+                                   security=self.stock, account=self.account, owner=self.owner,
+                                   cashflow=Money(480.0, 'EUR'), num_transacted=-4,
+                                   modifiedDate=datetime.date.today())
+        Transaction.objects.create(date=datetime.date(2021,5,5), kind=Transaction.SELL,
+                                   security=self.savings, account=self.account, owner=self.owner,
+                                   cashflow=Money(500.0, 'EUR'),
+                                   modifiedDate=datetime.date.today())
+        HistValuation.objects.create(date=datetime.date(2022,1,3), security=self.stock,
+                                     value=Money(120.0, 'EUR'))
+        stats = updateSecurityValuation(self.owner, positions=True)
+        incremental = self.valuationRecords()
+
+        SecurityValuation.objects.all().delete()
+        PositionValuation.objects.all().delete()
+        updateSecurityValuation(self.owner, fullRebuild=True, positions=True)
+
+        self.assertEqual(incremental, self.valuationRecords())
+        self.assertGreater(stats['deleted'], 0)
+        self.assertLess(stats['created'] + stats['updated'], count)
+
+    def test_roll_up_matches_replay(self):
+        # random transactions in several accounts and securities
+        rng = random.Random(1)
+        accounts = [self.account, Account.objects.create(name='Bank', owner=self.owner)]
+        securities = [self.stock, self.savings,
+                      Security.objects.create(name='Bond', descrip='Bond ETF', mark_to_market=True),
+                      Security.objects.create(name='Deposit', descrip='Deposit', accumulate_interest=True)]
+        for k in range(60):
+            HistValuation.objects.create(date=datetime.date(2020,7,1) + datetime.timedelta(days=30*k),
+                                         security=securities[k % 2 * 2], value=Money(rng.uniform(50, 150), 'EUR'))
+        for k in range(100):
+            s = rng.choice(securities)
+            kind = rng.choice([Transaction.BUY, Transaction.BUY, Transaction.SELL, Transaction.INTEREST])
+            cashflow = -rng.uniform(10, 500) if kind == Transaction.BUY else rng.uniform(5, 200)
+            num = 0
+            if s.mark_to_market:
+                num = rng.randint(1, 5) if kind == Transaction.BUY else -rng.randint(0, 3)
+            Transaction.objects.create(date=datetime.date(2020,7,1) + datetime.timedelta(days=rng.randint(0, 1500)),
+                                       kind=kind, security=s, account=rng.choice(accounts), owner=self.owner,
+                                       cashflow=Money(round(cashflow, 2), 'EUR'), num_transacted=num,
+                                       modifiedDate=datetime.date(2020,7,1))
+
+        updateAccountValuation(rollUp=False)
+        replay = list(AccountValuation.objects.order_by('account_id', 'date')
+                      .values_list('account_id', 'date', 'cur_value', 'base_value'))
+
+        updateSecurityValuation(self.owner, positions=True)
+        stats = rollUpAccountValuation()
+        rollUp = list(AccountValuation.objects.order_by('account_id', 'date')
+                      .values_list('account_id', 'date', 'cur_value', 'base_value'))
+
+        self.assertEqual(stats['updated'], len(replay))
+        self.assertEqual(rollUp, replay)
+
+
+    def accountRecords(self):
+        return list(AccountValuation.objects.order_by('account_id', 'date')
+                    .values_list('account_id', 'date', 'cur_value', 'base_value'))
+
+    def test_delta_matches_rebuild(self):
+        updateSecurityValuation(self.owner, positions=True)
+        updateAccountValuation(rollUp=False)
+
+        # buy more stock, pay more into savings account
+        t = Transaction.objects.create(date=datetime.date(2021,3,3), kind=Transaction.BUY,
+                                       security=self.stock, account=self.account, owner=self.owner,
+                                       cashflow=Money(-220.0, 'EUR'), num_transacted=2,
+                                       modifiedDate=datetime.date.today())
+        self.assertTrue(propagateTransactionChange(new=t))
+        t = Transaction.objects.get(security=self.savings)
+        old = Transaction.objects.get(pk=t.pk)
+        t.cashflow = Money(-700.0, 'EUR')
+        t.save()
+        self.assertTrue(propagateTransactionChange(old, t))
+        delta = (self.valuationRecords(), self.accountRecords())
+
+        SecurityValuation.objects.all().delete()
+        PositionValuation.objects.all().delete()
+        AccountValuation.objects.all().delete()
+        updateSecurityValuation(self.owner, fullRebuild=True, positions=True)
+        updateAccountValuation(rollUp=False)
+        self.assertEqual(delta, (self.valuationRecords(), self.accountRecords()))
+
+        # selling everything ends the position, needs a rebuild
+        t = Transaction.objects.create(date=datetime.date(2022,1,3), kind=Transaction.SELL,
+                                       security=self.stock, account=self.account, owner=self.owner,
+                                       cashflow=Money(1440.0, 'EUR'), num_transacted=-12,
+                                       modifiedDate=datetime.date.today())
+        self.assertFalse(propagateTransactionChange(new=t))
+        self.assertEqual(delta, (self.valuationRecords(), self.accountRecords()))
+
+    def test_dirty_ranges(self):
+        # transactions of setUp, one range per position
+        self.assertEqual(DirtyRange.objects.count(), 2)
+        self.assertEqual(DirtyRange.objects.get(security=self.stock).date, datetime.date(2020,1,10))
+        updateSecurityValuation(self.owner)
+        updateAccountValuation(rollUp=False)
+        self.assertEqual(DirtyRange.objects.count(), 0)
+
+        # ranges of the same position are merged
+        for k in range(5):
+            Transaction.objects.create(date=datetime.date(2021,5-k,1), kind=Transaction.BUY,
+                                       security=self.stock, account=self.account, owner=self.owner,
+                                       cashflow=Money(-100.0, 'EUR'), num_transacted=1,
+                                       modifiedDate=datetime.date.today())
+        self.assertEqual(list(DirtyRange.objects.values_list('security_id', 'date')),
+                         [(self.stock.id, datetime.date(2021,1,1))])
+
+        # deleted transactions leave no valuations behind
+        Transaction.objects.filter(security=self.savings).delete()
+        updateSecurityValuation(self.owner)
+        updateAccountValuation(rollUp=False)
+        self.assertFalse(SecurityValuation.objects.filter(security=self.savings).exists())
+        v = AccountValuation.objects.get(date=datetime.date(2021,6,15), account=self.account)
+        self.assertEqual(v.base_value, Money(1500.0, 'EUR'))
+        self.assertEqual(DirtyRange.objects.count(), 0)
+
+    def test_price_changes(self):
+        updateSecurityValuation(self.owner)
+        updateAccountValuation(rollUp=False)
+        v = SecurityValuation.objects.get(date=datetime.date(2020,3,15), security=self.stock)
+        self.assertEqual(v.cur_value, Money(1000.0, 'EUR'))
+
+        # prices stored before the last valuation mark it out of date
+        HistValuation.objects.upsert(self.stock.id, [(datetime.date(2020,3,1), 120.0)], 'EUR')
+        self.assertEqual(list(DirtyRange.objects.values_list('security_id', 'date')),
+                         [(self.stock.id, datetime.date(2020,3,1))])
+        updateSecurityValuation(self.owner)
+        updateAccountValuation(rollUp=False)
+        v = SecurityValuation.objects.get(date=datetime.date(2020,3,15), security=self.stock)
+        self.assertEqual(v.cur_value, Money(1200.0, 'EUR'))
+        v = AccountValuation.objects.get(date=datetime.date(2020,3,15), account=self.account)
+        self.assertEqual(v.cur_value, Money(1700.0, 'EUR'))
+        self.assertEqual(DirtyRange.objects.count(), 0)
+
+    def test_dense_calendar(self):
+        # daily snapshots for the last 40 days, half-monthly before
+        calendar = SnapshotCalendar('daily', 'half-monthly', 40)
+        updateSecurityValuation(self.owner, calendar=calendar)
+        dense = SecurityValuation.objects.filter(date__gt=calendar.boundary, security=self.stock)
+        self.assertEqual(dense.count(), (calendar.lastDate() - calendar.boundary).days)
+        coarse = list(SecurityValuation.objects.filter(date__lte=calendar.boundary)
+                      .order_by('security_id', 'date').values_list('security_id', 'date', 'cur_value'))
+
+        # unchanged values are not written again
+        stats = updateSecurityValuation(self.owner, fullRebuild=True, calendar=calendar)
+        self.assertEqual(stats['updated'], 2)
+
+        # older daily snapshots are downsampled as time goes by
+        later = SnapshotCalendar('daily', 'half-monthly', 40, calendar.today + datetime.timedelta(days=31))
+        stats = updateSecurityValuation(self.owner, calendar=later)
+        self.assertGreater(stats['downsampled'], 0)
+        self.assertEqual(coarse, list(SecurityValuation.objects.filter(date__lte=calendar.boundary)
+                                      .order_by('security_id', 'date').values_list('security_id', 'date', 'cur_value')))
+        self.assertFalse(any(not later.isSnapshotDate(d) for d in
+                             SecurityValuation.objects.values_list('date', flat=True)))
+
+        SecurityValuation.objects.all().delete()
+        updateSecurityValuation(self.owner, calendar=SnapshotCalendar('half-monthly', 'half-monthly'))
+        self.assertEqual(coarse, list(SecurityValuation.objects.filter(date__lte=calendar.boundary)
+                                      .order_by('security_id', 'date').values_list('security_id', 'date', 'cur_value')))
@@ -0,0 +1,48 @@
+from django.test import TestCase
+
+from ..calc import ArraySolver
+from ..rateCache import RateCache, LocalBackend, DjangoCacheBackend
+
+# Tests caching of rate of return results
+class RateCacheTestCase(TestCase):
+    def test_hit_and_miss(self):
+        cache = RateCache(LocalBackend())
+        r1 = cache.rateOfReturn(ArraySolver.fromArrays([0, 365], [100.0, -105.0]))
+        r2 = cache.rateOfReturn(ArraySolver.fromArrays([365, 0], [-105.0, 100.0]))
+
+        self.assertAlmostEqual(r1, 5.0, places=3)
+        self.assertEqual(r1, r2)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_no_rate_is_cached(self):
+        cache = RateCache(LocalBackend())
+        for i in range(2):
+            self.assertRaises(RuntimeError, cache.rateOfReturn,
+                              ArraySolver.fromArrays([0, 365], [100.0, 10.0]))
+
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_lru_eviction(self):
+        cache = RateCache(LocalBackend(maxSize=2))
+        solvers = [ArraySolver.fromArrays([0, 365], [100.0, -100.0 - i]) for i in range(3)]
+        cache.rateOfReturn(solvers[0])
+        cache.rateOfReturn(solvers[1])
+        cache.rateOfReturn(solvers[0])
+        cache.rateOfReturn(solvers[2])
+
+        self.assertEqual(len(cache.backend.entries), 2)
+        self.assertIsNotNone(cache.backend.get(cache.fingerprint(solvers[0])))
+        self.assertIsNone(cache.backend.get(cache.fingerprint(solvers[1])))
+
+    def test_solve_multiple(self):
+        cache = RateCache(DjangoCacheBackend(prefix='test-solve-multiple:'))
+        solvers = [ArraySolver.fromArrays([0, 365], [100.0, -105.0]), ArraySolver(),
+                   ArraySolver.fromArrays([0, 365], [100.0, -110.0])]
+        rates1 = cache.solveMultiple(solvers)
+        rates2 = cache.solveMultiple(solvers)
+
+        self.assertEqual(rates1, rates2)
+        self.assertIsNone(rates1[1])
+        self.assertAlmostEqual(rates1[2], 10.0, places=3)
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 2, 'hitRate': 0.5})
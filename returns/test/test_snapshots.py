@@ -0,0 +1,27 @@
+import datetime
+
+from django.test import TestCase
+
+from ..snapshots import SnapshotCalendar
+
+# Tests calendars of snapshot dates
+class SnapshotCalendarTestCase(TestCase):
+    def test_granularities(self):
+        today = datetime.date(2026,10,18)
+        day = datetime.date(2026,10,7)
+        expected = {'daily': day,
+                    'weekly': datetime.date(2026,10,11),
+                    'half-monthly': datetime.date(2026,10,15),
+                    'monthly': datetime.date(2026,10,31)}
+        for granularity, snapshotDate in expected.items():
+            calendar = SnapshotCalendar(granularity, granularity, None, today)
+            self.assertEqual(calendar.snapshotDate(day), snapshotDate)
+            self.assertEqual(calendar.previousDate(calendar.nextDate(snapshotDate)), snapshotDate)
+
+    def test_dense_period(self):
+        calendar = SnapshotCalendar('daily', 'half-monthly', 30, datetime.date(2026,10,18))
+        self.assertEqual(calendar.boundary, datetime.date(2026,9,30))
+        self.assertEqual(calendar.snapshotDate(datetime.date(2026,9,20)), datetime.date(2026,9,30))
+        self.assertEqual(calendar.nextDate(datetime.date(2026,9,30)), datetime.date(2026,10,1))
+        self.assertEqual(calendar.previousDate(datetime.date(2026,10,1)), datetime.date(2026,9,30))
+        self.assertEqual(calendar.lastDate(), datetime.date(2026,10,18))
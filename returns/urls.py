@@ -21,6 +21,7 @@ urlpatterns = [
     re_path(r'^add_interest/(?P<security_id>[0-9]+)$', views.add_interest, name='add_interest'),
     re_path(r'^add_mtm_data/$', views.add_mtm_data, name='add_mtm_data'),
     re_path(r'^update_hist_data/$', views.update_hist_data, name='update_hist_data'),
+    re_path(r'^jobs/status/$', views.valuation_jobs, name='valuation_jobs'),
     re_path(r'^inflation/latest/$', views.inflation_latest, name='inflation_latest'),
     re_path(r'^inflation/new/$', views.inflation_new, name='inflation_new'),
     re_path(r'^inflation/(?P<inflation_id>[0-9]+)/$', views.inflation, name='inflation'),
@@ -19,3 +19,33 @@ def last_day_of_month(any_day):
 def mid_day_of_next_month(any_day):
     next_month = any_day.replace(day=28) + timedelta(days=4)  # this will never fail
     return next_month.replace(day=15)
+
+def end_of_week(any_day):
+    # Sunday of the week containing any_day
+    return any_day + timedelta(days=6 - any_day.weekday())
+
+# upper bounds of age classes for staleness reports
+STALENESS_BUCKETS = [('< 1 hour', timedelta(hours=1)),
+                     ('< 1 day', timedelta(days=1)),
+                     ('< 1 week', timedelta(weeks=1)),
+                     ('< 30 days', timedelta(days=30))]
+
+def stalenessReport(timestamps, now=None):
+    # number of items per age class of their last refresh (None for never)
+    if now is None:
+        now = timezone.now()
+    report = [[label, 0] for label, limit in STALENESS_BUCKETS] + [['older', 0], ['never', 0]]
+    for t in timestamps:
+        if t is None:
+            report[-1][1] += 1
+            continue
+        for i, (label, limit) in enumerate(STALENESS_BUCKETS):
+            if now - t < limit:
+                report[i][1] += 1
+                break
+        else:
+            report[-2][1] += 1
+    return [tuple(r) for r in report]
+
+def formatStaleness(report):
+    return ', '.join('%s: %d' % (label, n) for label, n in report if n > 0) or 'nothing to refresh'
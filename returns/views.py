@@ -1,3 +1,4 @@
+import logging
 from datetime import datetime, date#, timedelta
 #rom time import mktime
 
@@ -6,6 +7,7 @@ from sys import stderr
 from django.shortcuts import render, get_object_or_404, redirect
 from django.template import RequestContext
 #from django.http import HttpResponse, Http404
+from django.http import JsonResponse, HttpResponseBadRequest
 from django.utils import timezone
 from django.core.exceptions import PermissionDenied
 
@@ -16,10 +18,15 @@ from django.db.models import Sum
 
 from moneyed import Money#, get_currency
 
-from .models import Transaction, Account, Security, Inflation, SecurityValuation, AccountValuation
-from .processTransaction2 import updateSecurityValuation, updateAccountValuation, makeBarChartSegPerf, makePieChartSegPerf
+from .models import Transaction, Account, Security, Inflation, SecurityValuation, AccountValuation, ValuationJob, ValuationRefresh
+from .jobs import requestRefresh, jobStatus, transactionChanged
+from .performance import getPerformanceSummary
+from .processTransaction2 import makeBarChartSegPerf, makePieChartSegPerf
 from .forms import AccountForm, SecurityForm, TransactionForm, TransactionFormForSuperuser, AddInterestForm, AddInterestFormForSuperuser, InflationForm
 #from .utilities import yearsago, last_day_of_month
+from .utilities import stalenessReport, formatStaleness
+
+logger = logging.getLogger(__name__)
 
 
 @login_required
@@ -149,20 +156,22 @@ def all_accounts(request):
 
     data['inflation'] = Inflation.objects.rateOfInflation()
 
-    data['histPerf'] = valuation.getHistoricalRateOfReturn()
+    # need to calculate information sector specific, solve in parallel
+    segValuations = [valuation.filter(security__in=Security.objects.kinds([kind[0]]))
+                     for kind in Security.SEC_KIND_CHOICES]
+    performance = getPerformanceSummary([valuation] + segValuations)
+
+    data['histPerf'] = performance[0]
     data['histPerf'].update(Inflation.objects.getHistoricalRateOfInflation())
 
     data['returns'] = data['histPerf']['rInfY']
     data['total'] = data['histPerf']['tInfY']
 
-    # need to calculate information sector specific
     data['segPerf'] = {}
     total = 0
     try:
-        for kind in Security.SEC_KIND_CHOICES:
-            securities = Security.objects.kinds([kind[0]])
-            valuation1 = valuation.filter(security__in=securities)
-            data['segPerf'][kind[1]] = valuation1.getHistoricalRateOfReturn()
+        for kind, segPerf in zip(Security.SEC_KIND_CHOICES, performance[1:]):
+            data['segPerf'][kind[1]] = segPerf
             # only store if there is a current value to store
             try:
                 total = total + float(data['segPerf'][kind[1]]['tYTD'].amount)
@@ -186,9 +195,17 @@ def all_accounts(request):
 
     # prepare data for line chart
     data['chart_asset_history'] = valuation.makeChart()
+    data['chart_rolling_return'] = rollingReturnChart(request, valuation)
 
     return render(request, 'returns/all_accounts.html', data)
 
+def rollingReturnChart(request, valuation):
+    # trailing 1-year return needs a rolling solve over all valuations, only
+    # computed on request (?rolling=1)
+    if request.GET.get('rolling'):
+        return valuation.makeRollingReturnChart()
+    return None
+
 @login_required
 def account(request, account_id):
     account = get_object_or_404(Account, pk=account_id)
@@ -210,6 +227,7 @@ def account(request, account_id):
     data['total'] = data['histPerf']['tInfY']
 
     data['chart_asset_history'] = valuation.makeChart()
+    data['chart_rolling_return'] = rollingReturnChart(request, valuation)
 
     return render(request, 'returns/account.html', data)
 
@@ -239,6 +257,7 @@ def security(request, security_id):
     data['total'] = data['histPerf']['tInfY']
 
     data['chart_asset_history'] = valuation.makeChart()
+    data['chart_rolling_return'] = rollingReturnChart(request, valuation)
 
     return render(request, 'returns/security.html', data)
 
@@ -319,9 +338,10 @@ def timeperiod(request):
 
         data['inflation'] = Inflation.objects.rateOfInflation(beginDate = begin_date, endDate = end_date)
 
-        rateOfReturn = valuation.getRateOfReturn(beginDate = begin_date, endDate = end_date)
+        rateOfReturn = valuation.getRateOfReturn(beginDate = begin_date, endDate = end_date, method = 'auto')
 
         data['returns'] = rateOfReturn['rate']
+        data['method'] = rateOfReturn['method']
         data['total'] = rateOfReturn['final']
 
         # prepare data for line chart
@@ -342,10 +362,12 @@ def transaction_new(request):
                 transaction.owner = request.user
             transaction.modifiedDate = timezone.now()
             transaction.save()
+            transactionChanged(new=transaction)
 
             if float(request.POST['match']) > 0:
                 matched_transaction = transaction.match(request.POST['match'])
                 matched_transaction.save()
+                transactionChanged(new=matched_transaction)
             # return redirect('returns:transaction', transaction_id=transaction.id)
             return redirect('returns:transaction_new')
     else:
@@ -360,6 +382,8 @@ def transaction_new(request):
 def transaction_edit(request, transaction_id):
     transaction = get_object_or_404(Transaction, pk=transaction_id)
     if request.method == "POST":
+        # copy as stored, form changes the instance
+        old = Transaction.objects.select_related('security').get(pk=transaction_id)
         if request.user.is_superuser:
             form = TransactionFormForSuperuser(request.POST, instance=transaction)
         else:
@@ -370,6 +394,7 @@ def transaction_edit(request, transaction_id):
                 transaction.owner = request.user
             transaction.modifiedDate = timezone.now()
             transaction.save()
+            transactionChanged(old, transaction)
             return redirect('returns:transaction', transaction_id=transaction.id)
     else:
         form = TransactionForm(request.user, instance=transaction)
@@ -401,8 +426,7 @@ def account_edit(request, account_id):
 @login_required
 def account_refresh(request, account_id):
     account = get_object_or_404(Account, pk=account_id)
-    AccountValuation.objects.filter(account__id=account_id).delete()
-    updateAccountValuation(selectAccountId = account.id)
+    requestRefresh(ValuationJob.ACCOUNT, owner=account.owner, account=account, fullRebuild=True)
     return redirect('returns:account', account_id=account.id)
 
 @login_required
@@ -431,8 +455,7 @@ def security_edit(request, security_id):
 @login_required
 def security_refresh(request, security_id):
     security = get_object_or_404(Security, pk=security_id)
-    SecurityValuation.objects.filter(owner=request.user, security__id=security_id).delete()
-    updateSecurityValuation(owner=request.user, selectSecurityId=security.id)
+    requestRefresh(ValuationJob.SECURITY, owner=request.user, security=security, fullRebuild=True)
     return redirect('returns:security', security_id=security.id)
 
 @login_required
@@ -463,7 +486,7 @@ def add_interest(request, security_id):
                 )
 
             # update security valuations
-            updateSecurityValuation(owner, selectSecurityId=security_id)
+            requestRefresh(ValuationJob.SECURITY, owner=owner, security=security)
             return redirect('returns:transaction', transaction_id=t.id)
     else:
         today = timezone.now().date()
@@ -477,38 +500,71 @@ def add_interest(request, security_id):
     return render(request, 'returns/add_interest.html', {'form': form})
 
 def update_hist_data(request):
-    # update security and account valuations
+    # update security and account valuations, those refreshed longest ago first
 
     # restrict to data for current user
     if (not request.user.is_authenticated) or request.user.is_superuser:
         for u in User.objects.all():
-            for s in Security.objects.securityOwnedBy(u).active().order_by('?')[0:5]:
-                updateSecurityValuation(u, s.id)
-                print("Updating security valuations of ", s, " for user", u, file=stderr)
-            for a in Account.objects.accountOwnedBy(u).active().order_by('?')[0:5]:
-                updateAccountValuation(a.id)
-                print("Updating account valuations of ", a, " for user", u, file=stderr)
+            refreshSecurities, refreshAccounts, staleness = mostStaleValuations(u, 5, 5)
+            for r in refreshSecurities:
+                requestRefresh(ValuationJob.SECURITY, owner=u, security=r.security)
+                print("Updating security valuations of ", r.security, " for user", u, file=stderr)
+            for r in refreshAccounts:
+                requestRefresh(ValuationJob.ACCOUNT, owner=u, account=r.account)
+                print("Updating account valuations of ", r.account, " for user", u, file=stderr)
     else:
         curUser = request.user
+        refreshSecurities, refreshAccounts, staleness = mostStaleValuations(curUser, 10, 5)
         updatedSecurities = []
         updatedAccounts = []
-        for s in Security.objects.securityOwnedBy(curUser).active().order_by('?')[0:10]:
-            updateSecurityValuation(curUser, s.id)
-            updatedSecurities.append(s)
-            print("Updating security valuations of", s, "for user", curUser, file=stderr)
-        for a in Account.objects.accountOwnedBy(curUser).active().order_by('?')[0:5]:
-            updateAccountValuation(a.id)
-            updatedAccounts.append(a)
-            print("Updating account valuations of", a, "for user", curUser, file=stderr)
-        return render(request, 'returns/update_hist_data.html', {'updatedSecurities': updatedSecurities, 'updatedAccounts': updatedAccounts} )
+        for r in refreshSecurities:
+            requestRefresh(ValuationJob.SECURITY, owner=curUser, security=r.security)
+            updatedSecurities.append(r.security)
+            print("Updating security valuations of", r.security, "for user", curUser, file=stderr)
+        for r in refreshAccounts:
+            requestRefresh(ValuationJob.ACCOUNT, owner=curUser, account=r.account)
+            updatedAccounts.append(r.account)
+            print("Updating account valuations of", r.account, "for user", curUser, file=stderr)
+        return render(request, 'returns/update_hist_data.html',
+                      {'updatedSecurities': updatedSecurities, 'updatedAccounts': updatedAccounts,
+                       'staleness': staleness})
     return redirect('returns:index')
 
+def mostStaleValuations(user, numSecurities, numAccounts):
+    # valuation refresh records of active securities and accounts of user
+    # refreshed longest ago and staleness report of all of them
+    securityIds = list(Security.objects.securityOwnedBy(user).active().values_list('id', flat=True))
+    accountIds = list(Account.objects.accountOwnedBy(user).active().values_list('id', flat=True))
+    refreshSecurities, securityTimes = ValuationRefresh.objects.mostStale(ValuationJob.SECURITY, user.id,
+                                                                          securityIds, numSecurities)
+    refreshAccounts, accountTimes = ValuationRefresh.objects.mostStale(ValuationJob.ACCOUNT, user.id,
+                                                                       accountIds, numAccounts)
+    staleness = stalenessReport(securityTimes + accountTimes)
+    logger.info("Staleness of valuations for user %s: %s", user, formatStaleness(staleness))
+    return refreshSecurities, refreshAccounts, staleness
+
+@login_required
+def valuation_jobs(request):
+    # status of recent valuation refresh jobs, polled by the UI
+    jobs = ValuationJob.objects.order_by('-created', '-id')
+    if not request.user.is_superuser:
+        jobs = jobs.owner(request.user.id)
+    if 'id' in request.GET:
+        try:
+            ids = [int(i) for i in request.GET.getlist('id')]
+        except ValueError:
+            return HttpResponseBadRequest('Job ids must be integers')
+        jobs = jobs.filter(id__in=ids)
+
+    return JsonResponse({'pending': jobs.filter(status__in=[ValuationJob.QUEUED, ValuationJob.RUNNING]).count(),
+                         'jobs': [jobStatus(j) for j in jobs[0:20]]})
+
 def update_hist_data_all(request):
-    # update security and account valuations
+    # update all security and account valuations
     for u in User.objects.all():
-        updateSecurityValuation(u)
+        requestRefresh(ValuationJob.SECURITY, owner=u)
         print("Updating security valuations for user", u, file=stderr)
-    updateAccountValuation()
+    requestRefresh(ValuationJob.ACCOUNT)
     print("Updating account valuations", file=stderr)
 
     return redirect('returns:index')